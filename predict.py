@@ -110,12 +110,13 @@ class Predictor(BasePredictor):
         output_path = m.voice_conversion(
             str(input_audio),
             rvc_dirname,
-            pitch_change,
-            f0_method,
-            index_rate,
-            filter_radius,
-            rms_mix_rate,
-            protect,
+            pitch=pitch_change,
+            f0_method=f0_method,
+            index_rate=index_rate,
+            filter_radius=filter_radius,
+            rms_mix_rate=rms_mix_rate,
+            protect=protect,
+            output_format=output_format,
         )
         print(f"[+] Converted audio generated at {output_path}")
 
@@ -1,12 +1,10 @@
 import logging
 import os
+import shutil
 import sys
-import tempfile
-import urllib.parse
 from datetime import datetime
 from pathlib import Path
 
-import httpx
 import runpod
 import ufiles
 
@@ -14,41 +12,37 @@ from src import config, schemas
 
 sys.path.insert(0, os.path.abspath("src"))
 
+import admission
+import dispatcher
+import input_fetcher
 import main
+import metrics
+import profiling
+import result_cache
+import tracing
+import workspace
+from worker_pool import ModelRegistry, configure_threads, plan_workers
 
 config.Settings.config_logger()
-
-
-def download_input_audio(url):
-    """Download input audio from URL to a temporary file"""
-
-    # Create a temporary file with the correct extension
-    url_parsed = urllib.parse.urlparse(url)
-    url_path = Path(url_parsed.path)
-    extension = url_path.suffix or ".wav"
-    temp_file = tempfile.NamedTemporaryFile(suffix=extension, delete=False)
-    temp_file.close()
-
-    # Download the file
-    with httpx.stream("GET", url) as response:
-        response.raise_for_status()  # Raise an error if the request failed
-        with open(temp_file.name, "wb") as f:
-            for chunk in response.iter_bytes():
-                f.write(chunk)
-
-    return temp_file.name
-
-
-def convert_to_mp3(path: Path) -> Path:
-    try:
-        from pydub import AudioSegment
-
-        mp3_path = path.replace(".wav", ".mp3")
-        AudioSegment.from_wav(path).export(mp3_path, format="mp3")
-        return mp3_path
-    except Exception as e:
-        logging.error(f"Error converting to MP3: {str(e)}")
-        return None
+results = result_cache.ResultCache()
+# the voice model of the last request stays loaded, as the admission budget
+# leaves room for the weights of one
+models = ModelRegistry(config.Settings.device, config.Settings.is_half, max_models=1)
+# also resends webhooks left in the outbox by a previous process
+webhooks = dispatcher.Dispatcher().start()
+metrics.CallbackGauge(
+    "rvc_webhooks_pending",
+    "Webhooks waiting in the outbox",
+    lambda: len(webhooks.pending()),
+)
+admission_control = admission.Controller(config.Settings.device)
+if metrics.PORT:
+    metrics.start_http_server()
+_ufiles_client = None
+if config.Settings.device == "cpu":
+    # one conversion at a time: one intra-op thread per physical core
+    plan = plan_workers(processes=1)[0]
+    configure_threads(plan["intra_op"], plan["inter_op"], plan["cpus"])
 
 
 def encode_audio(path: Path) -> str:
@@ -59,77 +53,194 @@ def encode_audio(path: Path) -> str:
     return encoded_audio
 
 
+def get_ufiles_client():
+    """One client per process, so uploads reuse its connections."""
+    global _ufiles_client
+    if _ufiles_client is None:
+        _ufiles_client = ufiles.UFiles(
+            api_key=config.Settings.UFILES_API_KEY,
+            ufiles_base_url=config.Settings.UFILES_BASE_URL,
+        )
+    return _ufiles_client
+
+
+def convert_and_upload(
+    input_data, input_audio_path, output_path, audio=None, profile=False, decision=None
+):
+    """Convert and upload, return the output dict and the local output file."""
+    stats = {}
+    # Perform voice conversion, once the worker has room for its estimated memory
+    with admission_control.reserve(decision):
+        output_path = main.voice_conversion(
+            input_audio=input_audio_path,
+            audio=audio,
+            rvc_model=input_data.rvc_model_name,
+            pitch=input_data.pitch_change,
+            f0_method=input_data.f0_method,
+            index_rate=input_data.index_rate,
+            filter_radius=input_data.filter_radius,
+            rms_mix_rate=input_data.rms_mix_rate,
+            protect=input_data.protect,
+            skip_silence=input_data.skip_silence,
+            output_format=input_data.output_format,
+            output_path=output_path,
+            profile=profile,
+            registry=models,
+            stats=stats,
+        )
+    logging.info(f"[+] Converted audio generated at {output_path}")
+
+    with tracing.span("upload"):
+        uploaded = dispatcher.with_retries(
+            lambda: get_ufiles_client().upload_file(
+                filepath=output_path,
+                filename=input_data.upload_filename,
+            )
+        )
+    output = {
+        "created_at": datetime.now().isoformat(),
+        "output_url": uploaded.url,
+        "format": input_data.output_format,
+        "message": "Voice conversion completed successfully",
+    }
+    if input_data.skip_silence:
+        output["skipped_ratio"] = stats.get("skipped_ratio", 0.0)
+        tracing.set_trace_attributes(skipped_ratio=output["skipped_ratio"])
+    if profile:
+        # the trace and summaries, zipped next to the output
+        profile_dir = profiling.profile_dir(output_path)
+        archive = shutil.make_archive(profile_dir, "zip", profile_dir)
+        with tracing.span("upload"):
+            uploaded = dispatcher.with_retries(
+                lambda: get_ufiles_client().upload_file(
+                    filepath=archive,
+                    filename=f"neda/profiles/{input_data.rvc_model_name}.zip",
+                )
+            )
+        output["profile_url"] = uploaded.url
+    return output, output_path
+
+
 def handler(event):
     """
     RunPod handler function for voice conversion
     """
+    # the root span of the job, every stage below is a child of it
+    with tracing.span("request", job_id=event.get("id")) as span, metrics.track_job():
+        result = handle(event)
+        span.set(failed="error" in result)
+    return result
+
+
+def handle(event):
+    # all files of this job live in its own directory, removed at the end
+    job = workspace.Workspace(event.get("id")).open()
     try:
         # Get input parameters
         input_params: dict[str, str] = event.get("input", {})
         input_data = schemas.RVCV2InputSchema(**input_params)
-        input_audio_path = download_input_audio(input_data.input_audio)
+        # downloaded and decoded at once, with size and duration limits
+        fetched = input_fetcher.fetch_audio(input_data.input_audio, directory=job.dir)
+        input_audio_path = fetched.path
+        output_path = job.path("output." + input_data.output_format)
 
         if input_data.custom_rvc_model_download_url:
             logging.info(
                 f"[+] Downloading RVC model from {input_data.custom_rvc_model_download_url}"
             )
-            main.download_online_model(
-                url=input_data.custom_rvc_model_download_url,
-                dir_name=input_data.rvc_model_name,
-            )
+            with tracing.span("model_download"):
+                main.download_online_model(
+                    url=input_data.custom_rvc_model_download_url,
+                    dir_name=input_data.rvc_model_name,
+                )
 
         # Validate RVC model exists
         if not input_data.check_rvc_model_exists():
             result = {"error": f"The folder {input_data.rvc_model_path} does not exist."}
             if input_data.webhook_url:
-                response = httpx.post(input_data.webhook_url, json=result)
-                # response.raise_for_status()
-                logging.info(f"[+] Webhook sent {response.status_code}")
-                logging.info(f"[+] Webhook response: {response.text}")
+                webhooks.post(input_data.webhook_url, result)
             return result
 
-        # Perform voice conversion
-        output_path = main.voice_conversion(
-            input_audio=input_audio_path,
-            rvc_model=input_data.rvc_model_name,
-            pitch=input_data.pitch_change,
-            f0_method=input_data.f0_method,
-            index_rate=input_data.index_rate,
-            filter_radius=input_data.filter_radius,
-            rms_mix_rate=input_data.rms_mix_rate,
-            protect=input_data.protect,
+        # estimated cost of the job against the capacity of this worker
+        version, sr = admission.model_info(
+            input_data.rvc_model_path, config.Settings.is_half
         )
-        logging.info(f"[+] Converted audio generated at {output_path}")
-
-        # If output is wav but mp3 is requested, convert to mp3
-        final_output_path = output_path
-        if input_data.output_format == "mp3" and output_path.endswith(".wav"):
-            final_output_path = convert_to_mp3(output_path)
-
-        ufiles_client = ufiles.UFiles(
-            api_key=config.Settings.UFILES_API_KEY,
-            ufiles_base_url=config.Settings.UFILES_BASE_URL,
+        decision = admission_control.decide(
+            len(fetched.audio) / 16000,
+            input_data.f0_method,
+            version,
+            sr,
+            models.segment_seconds(input_data.rvc_model_name),
         )
-        uploaded = ufiles_client.upload_file(
-            filepath=final_output_path,
-            filename=input_data.upload_filename,
+        tracing.set_trace_attributes(
+            admission=decision.action, estimated_seconds=decision.estimate.seconds
         )
-        output = {
-            "created_at": datetime.now().isoformat(),
-            "output_url": uploaded.url,
-            "format": input_data.output_format,
-            "message": "Voice conversion completed successfully",
-        }
+        if decision.action == "reject":
+            result = {"error": f"Job rejected: {decision.reason}"}
+            if input_data.webhook_url:
+                webhooks.post(input_data.webhook_url, result)
+            return result
+        if decision.action == "downgrade":
+            logging.info(f"[+] {decision.reason}")
+            input_data.f0_method = decision.f0_method
 
-        if input_data.webhook_url:
-            response = httpx.post(input_data.webhook_url, json=output)
-            # response.raise_for_status()
-            logging.info(f"[+] Webhook sent {response.status_code}")
-            logging.info(f"[+] Webhook response: {response.text}")
+        profile = profiling.should_profile(input_data.profile)
+        if not result_cache.ENABLED or profile:
+            # a profiled request always converts, and is not cached
+            output, _ = convert_and_upload(
+                input_data,
+                input_audio_path,
+                output_path,
+                fetched.audio,
+                profile,
+                decision,
+            )
+        else:
+            params = input_data.model_dump()
+            # a hit returns an object uploaded under this name
+            params["upload_filename"] = input_data.upload_filename
+            key = result_cache.request_key(
+                input_audio_path,
+                input_data.rvc_model_path,
+                params,
+                audio_sha256=fetched.sha256,
+            )
+            with results.single_flight(key):
+                cached = results.get(key)
+                if cached is not None:
+                    logging.info(f"[+] Returning cached result {key}")
+                    output = {
+                        "created_at": datetime.now().isoformat(),
+                        "output_url": cached["output_url"],
+                        "format": cached["format"],
+                        "message": "Voice conversion completed successfully",
+                        "cached": True,
+                    }
+                    if "skipped_ratio" in cached:
+                        output["skipped_ratio"] = cached["skipped_ratio"]
+                else:
+                    output, _ = convert_and_upload(
+                        input_data,
+                        input_audio_path,
+                        output_path,
+                        fetched.audio,
+                        decision=decision,
+                    )
+                    results.put(
+                        key,
+                        {
+                            k: output[k]
+                            for k in ("output_url", "format", "skipped_ratio")
+                            if k in output
+                        },
+                    )
 
-        # Clean up temporary files
-        if os.path.exists(input_audio_path):
-            os.remove(input_audio_path)
+        output["estimate"] = decision.estimate._asdict()
+        if decision.action == "downgrade":
+            output["f0_method"] = decision.f0_method
+        if input_data.webhook_url:
+            # delivered in the background, with retries
+            webhooks.post(input_data.webhook_url, output)
 
         return {"output": output}
 
@@ -141,11 +252,13 @@ def handler(event):
         logging.error(f"Error: {error_message}")
         logging.error(error_traceback)
         if input_data.webhook_url:
-            response = httpx.post(input_data.webhook_url, json={"error": error_message, "traceback": error_traceback})
-            # response.raise_for_status()
-            logging.info(f"[+] Webhook sent {response.status_code}")
-            logging.info(f"[+] Webhook response: {response.text}")
+            webhooks.post(
+                input_data.webhook_url,
+                {"error": error_message, "traceback": error_traceback},
+            )
         return {"error": error_message, "traceback": error_traceback}
+    finally:
+        job.close()
 
 
 # Start the RunPod serverless function
@@ -0,0 +1,287 @@
+"""Cost estimates and admission control of conversion jobs.
+
+``estimate`` predicts the seconds and peak memory of a conversion from the
+input duration, the f0 method and the version and sample rate of the voice
+model. The coefficients come from ``benchmarks/baselines/cost_model.json``,
+written by ``python -m benchmarks.costs`` on synthetic inputs: the f0 stage
+runs on the whole input, the other stages per segment, so their memory
+stops growing past one segment while their time keeps growing with the
+number of segments. The segment length is the ``x_max`` of the tuned voice model
+when it is loaded, the longest calibrated one otherwise. ``hybrid[...]``
+stacks cost the sum of the times and the largest memory of their methods.
+
+``Controller.decide`` admits a job, queues it until the memory reserved by
+the running jobs leaves room for it, downgrades its f0 method to a cheaper
+one or rejects it. Estimated seconds are divided by the speed of the worker
+relative to the calibration machine, ``RVC_COST_SPEED``, measured with the
+calibration workload of ``benchmarks.pipeline`` on CPUs at the first
+decision when unset. The estimated seconds of the jobs running and waiting
+are exported as the ``rvc_estimated_backlog_seconds`` gauge, a signal for
+autoscaling.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import autotune
+import metrics
+from model_artifacts import find_artifact, read_metadata
+
+COST_MODEL = os.getenv(
+    "RVC_COST_MODEL",
+    os.path.join(
+        os.path.dirname(__file__), "benchmarks", "baselines", "cost_model.json"
+    ),
+)
+MAX_SECONDS = float(os.getenv("RVC_ADMIT_MAX_SECONDS", "0"))  # 0: no limit
+MEMORY_BYTES = int(os.getenv("RVC_ADMIT_MEMORY_BYTES", "0"))  # 0: measured
+QUEUE_SECONDS = float(os.getenv("RVC_ADMIT_QUEUE_SECONDS", "300"))
+DOWNGRADE = os.getenv("RVC_ADMIT_DOWNGRADE", "1") != "0"
+SPEED = os.getenv("RVC_COST_SPEED")
+# cheaper f0 methods to fall back to, in order of preference
+DOWNGRADE_TO = ("rmvpe", "pm")
+
+Estimate = namedtuple("Estimate", ["seconds", "memory_bytes"])
+Decision = namedtuple("Decision", ["action", "estimate", "f0_method", "reason"])
+
+_costs = None
+
+decisions_total = metrics.Counter(
+    "rvc_admission_decisions_total", "Admission decisions", ("action",)
+)
+backlog_seconds = metrics.Gauge(
+    "rvc_estimated_backlog_seconds",
+    "Estimated seconds of the jobs running and waiting for memory",
+)
+reserved_bytes = metrics.Gauge(
+    "rvc_admission_reserved_bytes", "Estimated peak memory of the running jobs"
+)
+estimated_seconds = metrics.Histogram(
+    "rvc_job_estimated_seconds",
+    "Estimated conversion seconds of admitted jobs",
+    buckets=(1, 2.5, 5, 10, 25, 60, 120, 300, 600, 1200),
+)
+
+
+def costs():
+    """The bundled cost model, loaded once."""
+    global _costs
+    if _costs is None:
+        with open(COST_MODEL) as f:
+            _costs = json.load(f)
+    return _costs
+
+
+def _eval(fit, seconds):
+    c, b, a = fit
+    return max(c * seconds * seconds + b * seconds + a, 0.0)
+
+
+def _model_cost(version, sr):
+    models = costs()["models"]
+    key = f"{version}-{sr}"
+    if key in models:
+        return [models[key]]
+    same = [k for k in models if k.split("-")[0] == version]
+    if sr and same:
+        # the calibrated sample rate closest to ``sr``
+        return [models[min(same, key=lambda k: abs(int(k.split("-")[1]) - sr))]]
+    # unknown model: the most expensive of the candidates
+    return [models[k] for k in same] or list(models.values())
+
+
+def f0_methods(f0_method):
+    """The methods a ``hybrid[a+b]`` stack runs, or ``[f0_method]``."""
+    if "hybrid" not in f0_method:
+        return [f0_method]
+    s = f0_method.split("hybrid")[1].replace("[", "").replace("]", "")
+    return [m for m in s.split("+") if m]
+
+
+def _f0_costs(f0_method):
+    f0 = costs()["f0"]
+    # an unknown method is assumed to be as expensive as the worst one
+    worst = max(f0.values(), key=lambda c: _eval(c["seconds"], 60))
+    return [f0.get(m, worst) for m in f0_methods(f0_method)]
+
+
+def estimate(
+    seconds, f0_method, version=None, sr=None, speed=1.0, segment_seconds=None
+):
+    """Predicted ``Estimate(seconds, memory_bytes)`` of converting ``seconds``
+    of audio in segments of ``segment_seconds``; an unknown ``version`` or
+    ``sr`` gives the worst case."""
+    # the fits hold up to the longest calibrated segment
+    longest = costs()["segment_seconds"]
+    segment = min(seconds, segment_seconds or longest, longest)
+    model_seconds = model_memory = 0.0
+    for model in _model_cost(version, sr):
+        # segments cost the same, the time grows with their number
+        per_segment = _eval(model["seconds"], segment)
+        if segment > 0:
+            model_seconds = max(model_seconds, per_segment * seconds / segment)
+        model_memory = max(model_memory, _eval(model["memory"], segment))
+    f0 = _f0_costs(f0_method)
+    f0_seconds = sum(_eval(c["seconds"], seconds) for c in f0)
+    f0_memory = max(_eval(c["memory"], seconds) for c in f0)
+    return Estimate(
+        (model_seconds + f0_seconds) / speed, int(max(model_memory, f0_memory))
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _checkpoint_info(path, size, mtime_ns):
+    # keyed by size and mtime, so a replaced checkpoint is read again
+    import torch
+
+    try:
+        # only the pickled config is read, the tensors stay on disk
+        cpt = torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+    except RuntimeError:
+        # saved in the legacy format, which cannot be memory-mapped
+        cpt = torch.load(path, map_location="cpu", weights_only=False)
+    return cpt.get("version", "v1"), cpt["config"][-1]
+
+
+def model_info(model_dir, is_half=False):
+    """``(version, sample rate)`` of the voice model in ``model_dir``, read
+    from its inference artifact or else its checkpoint, or ``(None, None)``
+    if neither can be read."""
+    try:
+        pth = [f for f in os.listdir(model_dir) if f.endswith(".pth")]
+        if not pth:
+            return None, None
+        model_path = os.path.join(model_dir, pth[0])
+        path = find_artifact(model_path, is_half)
+        if path:
+            meta = read_metadata(path)
+            return meta["version"], json.loads(meta["config"])[-1]
+        st = os.stat(model_path)
+        return _checkpoint_info(model_path, st.st_size, st.st_mtime_ns)
+    except Exception:
+        # e.g. a truncated download; the worst case is assumed
+        return None, None
+
+
+def measure_speed(device):
+    """Speed of this worker relative to the calibration machine."""
+    if SPEED:
+        return float(SPEED)
+    if str(device).startswith("cuda"):
+        # the calibration is a CPU workload, it says nothing about GPUs
+        return 1.0
+    from benchmarks.pipeline import calibrate
+
+    return costs()["calibration_seconds"] / calibrate()
+
+
+class Controller:
+    """Admits jobs while their estimated peak memory fits the worker."""
+
+    def __init__(self, device="cpu", memory_bytes=MEMORY_BYTES):
+        if not memory_bytes:
+            c = costs()
+            # the models are loaded by the first jobs, after this measurement
+            weights = c["hubert_bytes"] + c["rmvpe_bytes"]
+            weights += max(m["weights_bytes"] for m in c["models"].values())
+            memory_bytes = autotune.available_memory(device) * autotune.SAFETY
+            memory_bytes -= weights
+        self.memory_bytes = int(memory_bytes)
+        self.device = device
+        self._speed = None
+        self._speed_lock = threading.Lock()
+        self.reserved = 0
+        self.backlog = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def speed(self):
+        # measured at the first decision, once the worker has pinned its
+        # threads, so the calibration runs the way the jobs will
+        with self._speed_lock:
+            if self._speed is None:
+                self._speed = measure_speed(self.device)
+            return self._speed
+
+    def _fits(self, est):
+        if est.memory_bytes > self.memory_bytes:
+            return False
+        return not MAX_SECONDS or est.seconds <= MAX_SECONDS
+
+    def decide(self, seconds, f0_method, version=None, sr=None, segment_seconds=None):
+        """Return the ``Decision`` for a job converting ``seconds`` of audio
+        in segments of ``segment_seconds``, see ``estimate``."""
+        est = estimate(seconds, f0_method, version, sr, self.speed, segment_seconds)
+        if self._fits(est):
+            with self._cond:
+                busy = self.reserved + est.memory_bytes > self.memory_bytes
+            decision = Decision("queue" if busy else "admit", est, f0_method, "")
+        else:
+            limits = [f"{self.memory_bytes >> 20} MiB"]
+            if MAX_SECONDS:
+                limits.insert(0, f"{MAX_SECONDS:.0f} s")
+            reason = (
+                f"estimated {est.seconds:.0f} s and {est.memory_bytes >> 20} MiB, "
+                f"the worker allows {' and '.join(limits)}"
+            )
+            decision = Decision("reject", est, f0_method, reason)
+            if DOWNGRADE:
+                for method in DOWNGRADE_TO:
+                    if method == f0_method:
+                        continue
+                    cheaper = estimate(
+                        seconds, method, version, sr, self.speed, segment_seconds
+                    )
+                    if self._fits(cheaper):
+                        reason = f"{f0_method} {reason}, using {method}"
+                        decision = Decision("downgrade", cheaper, method, reason)
+                        break
+        decisions_total.inc(action=decision.action)
+        return decision
+
+    @contextmanager
+    def reserve(self, decision):
+        """Hold the estimated memory of an admitted job while it runs.
+
+        Waits up to ``RVC_ADMIT_QUEUE_SECONDS`` for the running jobs to
+        leave room, then raises ``RuntimeError``. Without a ``decision``
+        the job runs unaccounted for.
+        """
+        if decision is None:
+            yield
+            return
+        need = decision.estimate.memory_bytes
+        seconds = decision.estimate.seconds
+        with self._cond:
+            self._add(0, seconds)
+            deadline = time.monotonic() + QUEUE_SECONDS
+            # a job always runs once nothing else does
+            while self.reserved and self.reserved + need > self.memory_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._add(0, -seconds)
+                    raise RuntimeError(
+                        f"No capacity for the job within {QUEUE_SECONDS:.0f} s"
+                    )
+                self._cond.wait(remaining)
+            self._add(need, 0)
+        estimated_seconds.observe(seconds)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._add(-need, -seconds)
+                self._cond.notify_all()
+
+    def _add(self, memory_bytes, seconds):
+        # called with the condition held
+        self.reserved += memory_bytes
+        # rounded, so the gauge returns to 0 when the worker is idle
+        self.backlog = max(0.0, round(self.backlog + seconds, 6))
+        reserved_bytes.set(self.reserved)
+        backlog_seconds.set(self.backlog)
@@ -0,0 +1,97 @@
+"""Encode int16 audio to MP3, Opus or FLAC through an ffmpeg pipe.
+
+``StreamEncoder`` writes raw PCM to ffmpeg's stdin and ffmpeg writes the
+output file itself, so no intermediate WAV is written or decoded again and
+ffmpeg can seek back to finish the headers (FLAC STREAMINFO, MP3 Xing/LAME).
+
+    with StreamEncoder("opus", 40000, "out.opus") as encoder:
+        encoder.write(audio)
+"""
+
+import os
+import threading
+
+import ffmpeg
+import numpy as np
+
+# ffmpeg output options per format
+FORMATS = {
+    "mp3": {"format": "mp3", "acodec": "libmp3lame", "audio_bitrate": "128k"},
+    # libopus only takes 8, 12, 16, 24 or 48 kHz
+    "opus": {"format": "ogg", "acodec": "libopus", "audio_bitrate": "64k", "ar": 48000},
+    "flac": {"format": "flac", "acodec": "flac"},
+}
+CHUNK_SAMPLES = 1 << 16
+
+
+class StreamEncoder:
+    def __init__(self, fmt, sr, output_path):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported output format {fmt}")
+        self.fmt = fmt
+        self.output_path = output_path
+        self._err = b""
+        self._proc = (
+            ffmpeg.input("pipe:", format="s16le", ac=1, ar=sr)
+            .output(output_path, **FORMATS[fmt])
+            .global_args("-loglevel", "error")
+            .overwrite_output()
+            .run_async(pipe_stdin=True, pipe_stderr=True)
+        )
+        self._stderr = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr.start()
+
+    def _read_stderr(self):
+        self._err = self._proc.stderr.read()
+
+    def write(self, audio):
+        """Encode int16 samples; can be called once per finished segment."""
+        audio = np.ascontiguousarray(audio, dtype=np.int16)
+        try:
+            for i in range(0, len(audio), CHUNK_SAMPLES):
+                self._proc.stdin.write(audio[i : i + CHUNK_SAMPLES].tobytes())
+        except BrokenPipeError:
+            self.close()
+
+    def close(self):
+        """Finish the stream; raises ``RuntimeError`` if ffmpeg failed, and
+        removes the partial output."""
+        if self._proc.stdin.closed:
+            return
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._stderr.join()
+        if self._proc.wait() != 0:
+            self._remove_output()
+            raise RuntimeError(
+                f"Encoding to {self.fmt} failed: {self._err.decode(errors='replace')}"
+            )
+
+    def _remove_output(self):
+        try:
+            os.remove(self.output_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self._proc.kill()
+            try:
+                self.close()
+            except RuntimeError:
+                pass
+            # killed before it finished the file
+            self._remove_output()
+
+
+def encode(audio, sr, fmt, output_path):
+    with StreamEncoder(fmt, sr, output_path) as encoder:
+        encoder.write(audio)
+    return output_path
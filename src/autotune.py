@@ -0,0 +1,369 @@
+"""Memory-aware segment sizing.
+
+``VC.pipeline`` cuts long inputs into segments of ``x_center`` seconds with
+``x_pad`` seconds of context per side. ``probe`` measures how peak memory
+and latency of the HuBERT, attention (text encoder) and decoder stages grow
+with segment length on a device. Probing takes minutes, so it only runs
+from the command line, e.g. when the image is built for its device, and
+stores the profiles per device, dtype, model version and sample rate in
+``RVC_AUTOTUNE_CACHE``. ``tune`` only reads them: with a profile it picks
+the segment length with the lowest compute per second of audio that still
+fits the memory available to each concurrent job, without one the fixed
+table of ``rvc.get_config`` stays. Segments stay within ``EXTRAPOLATION``
+times the longest probe, as the fits are not trusted far beyond it.
+
+    python src/autotune.py --device cuda:0 --half
+"""
+
+import argparse
+import ctypes
+import dataclasses
+import json
+import os
+import threading
+from time import perf_counter
+
+import numpy as np
+import torch
+
+ENABLED = os.getenv("RVC_AUTOTUNE", "1") != "0"
+CACHE_PATH = os.getenv(
+    "RVC_AUTOTUNE_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "rvc", "segment_profiles.json"),
+)
+# more lengths than the three coefficients of the fits
+PROBE_SECONDS = (2, 4, 8, 16, 32)
+MIN_CENTER, MAX_CENTER = 5, 90
+EXTRAPOLATION = 2  # longest padded segment, in multiples of the longest probe
+SAFETY = 0.8  # fraction of the free memory the segments may use
+
+_profiles = {}
+_lock = threading.Lock()
+
+
+class _MallInfo2(ctypes.Structure):
+    _fields_ = [
+        (name, ctypes.c_size_t)
+        for name in (
+            "arena",
+            "ordblks",
+            "smblks",
+            "hblks",
+            "hblkhd",
+            "usmblks",
+            "fsmblks",
+            "uordblks",
+            "fordblks",
+            "keepcost",
+        )
+    ]
+
+
+try:
+    _libc = ctypes.CDLL("libc.so.6")
+    _libc.mallinfo2.restype = _MallInfo2
+except (OSError, AttributeError):
+    _libc = None
+
+
+def heap_in_use():
+    """Bytes currently allocated on the C heap, or the RSS without glibc.
+
+    Unlike the RSS this drops again when tensors are freed, so consecutive
+    measurements do not include memory the allocator merely kept around.
+    """
+    if _libc is not None:
+        info = _libc.mallinfo2()
+        return info.uordblks + info.hblkhd
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _PeakHeap:
+    # samples heap_in_use() in a background thread
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.base = self.peak = heap_in_use()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, heap_in_use())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, heap_in_use())
+
+
+def measure(fn, device):
+    """Run ``fn`` and return ``(result, peak bytes, seconds)``.
+
+    The peak is the memory allocated on top of what was in use before the
+    call: the CUDA allocator high-water mark on GPUs, ``heap_in_use`` sampled
+    in a background thread elsewhere.
+    """
+    cuda = str(device).startswith("cuda")
+    if cuda:
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        t0 = perf_counter()
+        result = fn()
+        torch.cuda.synchronize(device)
+        elapsed = perf_counter() - t0
+        return result, torch.cuda.max_memory_allocated(device) - base, elapsed
+    with _PeakHeap() as heap:
+        t0 = perf_counter()
+        result = fn()
+        elapsed = perf_counter() - t0
+    return result, heap.peak - heap.base, elapsed
+
+
+def available_memory(device):
+    if str(device).startswith("cuda"):
+        return torch.cuda.mem_get_info(torch.device(device))[0]
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def _probe_stages(hubert_model, net_g, version, device, is_half, seconds):
+    dtype = torch.float16 if is_half else torch.float32
+    frames = seconds * 100
+    source = torch.randn(1, seconds * 16000, device=device, dtype=dtype) * 0.1
+    padding_mask = torch.zeros_like(source, dtype=torch.bool)
+    if_f0 = hasattr(net_g.dec, "m_source")
+    pitch = torch.randint(1, 255, (1, frames), device=device) if if_f0 else None
+    pitchf = torch.full((1, frames), 200.0, device=device) if if_f0 else None
+    p_len = torch.tensor([frames], device=device).long()
+    sid = torch.tensor([0], device=device).long()
+
+    def hubert():
+        logits = hubert_model.extract_features(
+            source=source,
+            padding_mask=padding_mask,
+            output_layer=9 if version == "v1" else 12,
+        )
+        return logits[0].shape[-1]
+
+    channels = 256 if version == "v1" else 768
+    feats = torch.randn(1, frames, channels, device=device, dtype=dtype)
+    g = net_g.emb_g(sid).unsqueeze(-1)
+
+    def attention():
+        return net_g.enc_p(feats, pitch, p_len)
+
+    def decoder(m_p, logs_p, x_mask):
+        z_p = (m_p + torch.exp(logs_p) * torch.randn_like(m_p) * 0.66666) * x_mask
+        z = net_g.flow(z_p, x_mask, g=g, reverse=True)
+        if if_f0:
+            return net_g.dec(z * x_mask, pitchf, g=g)
+        return net_g.dec(z * x_mask, g=g)
+
+    stats = {}
+    with torch.no_grad():
+        _, stats["hubert"], hubert_s = measure(hubert, device)
+        enc, stats["attention"], attention_s = measure(attention, device)
+        _, stats["decoder"], decoder_s = measure(lambda: decoder(*enc), device)
+    return stats, hubert_s + attention_s + decoder_s
+
+
+def _fit(seconds, values):
+    # quadratic least squares whose growth terms are not negative: a line if
+    # the curvature is, a parabola without linear term if the slope is
+    seconds = np.asarray(seconds, dtype=np.float64)
+    c, b, a = np.polyfit(seconds, values, 2)
+    if c < 0:
+        c = 0.0
+        b, a = np.polyfit(seconds, values, 1)
+        b = max(b, 0.0)
+    elif b < 0:
+        b = 0.0
+        basis = np.stack([seconds**2, np.ones_like(seconds)], axis=1)
+        (c, a), *_ = np.linalg.lstsq(basis, np.asarray(values, np.float64), rcond=None)
+        c = max(c, 0.0)
+    return [float(c), float(b), float(a)]
+
+
+def probe(hubert_model, net_g, version, device, is_half):
+    """Measure per-stage peak memory and total latency for a few lengths.
+
+    Returns a profile with quadratic ``memory`` coefficients per stage (bytes
+    as a function of seconds) and quadratic ``latency`` coefficients.
+    """
+    # warm-up so lazy allocations do not count towards the first probe
+    _probe_stages(hubert_model, net_g, version, device, is_half, 1)
+    peaks = {"hubert": [], "attention": [], "decoder": []}
+    latencies = []
+    for seconds in PROBE_SECONDS:
+        stats, elapsed = _probe_stages(
+            hubert_model, net_g, version, device, is_half, seconds
+        )
+        for stage, peak in stats.items():
+            peaks[stage].append(peak)
+        latencies.append(elapsed)
+    return {
+        "probe_seconds": list(PROBE_SECONDS),
+        "memory": {
+            stage: _fit(PROBE_SECONDS, values) for stage, values in peaks.items()
+        },
+        "latency": _fit(PROBE_SECONDS, latencies),
+    }
+
+
+def segment_params(profile, budget, x_pad=None):
+    """Derive ``(x_pad, x_query, x_center, x_max)`` from a probe profile.
+
+    Picks the segment length with the lowest latency per second of output
+    among those whose padded segment fits ``budget`` bytes in every stage
+    and ``EXTRAPOLATION`` times the longest probe of the profile. A given
+    ``x_pad`` is kept, otherwise it grows with the segment length.
+    """
+    best = None
+    fixed_pad = x_pad
+    longest = EXTRAPOLATION * max(profile.get("probe_seconds", PROBE_SECONDS))
+    for x_center in range(MIN_CENTER, MAX_CENTER + 1):
+        x_pad = fixed_pad or min(3, max(1, round(x_center / 20)))
+        seconds = x_center + 2 * x_pad
+        if seconds > longest and x_center > MIN_CENTER:
+            break
+        peak = max(np.polyval(c, seconds) for c in profile["memory"].values())
+        if peak > budget and x_center > MIN_CENTER:
+            break
+        cost = np.polyval(profile["latency"], seconds) / x_center
+        if best is None or cost <= best[0]:
+            best = (cost, x_pad, x_center)
+    _, x_pad, x_center = best
+    x_query = max(1, round(x_center / 6))
+    return x_pad, x_query, x_center, x_center + x_pad + 2
+
+
+def _device_name(device):
+    if str(device).startswith("cuda"):
+        return torch.cuda.get_device_name(torch.device(device))
+    return str(device)
+
+
+def profile_key(device, is_half, version, tgt_sr):
+    dtype = "fp16" if is_half else "fp32"
+    return "|".join([_device_name(device), dtype, version, str(tgt_sr)])
+
+
+def _load_cache():
+    try:
+        with open(CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _store_cache(key, profile):
+    cache = _load_cache()
+    cache[key] = profile
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        tmp = "%s.%d.tmp" % (CACHE_PATH, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp, CACHE_PATH)
+    except OSError as e:
+        # read-only images still get the in-process profile
+        print("Could not store segment profile:", e)
+
+
+def tune(config, version, tgt_sr, concurrency=None):
+    """Return a copy of ``config`` with segment sizes fitted to this device,
+    or ``config`` itself if the device has not been probed.
+
+    The chosen values are also recorded in ``config.segment_params`` along
+    with where they came from (``profile``).
+    """
+    if not ENABLED:
+        return config
+    key = profile_key(config.device, config.is_half, version, tgt_sr)
+    with _lock:
+        if key not in _profiles:
+            # read once per process, None included
+            profile = _load_cache().get(key)
+            if profile is not None and profile.get("probe_seconds") != list(
+                PROBE_SECONDS
+            ):
+                # measured with other lengths by an earlier version
+                profile = None
+            _profiles[key] = profile
+        profile = _profiles[key]
+    if profile is None:
+        return config
+
+    concurrency = concurrency or int(os.getenv("RVC_CONCURRENCY", "1"))
+    budget = available_memory(config.device) * SAFETY / concurrency
+    params = segment_params(
+        profile, budget, config.x_pad if config.x_pad_fixed else None
+    )
+    x_pad, x_query, x_center, x_max = params
+    tuned = dataclasses.replace(
+        config,
+        x_pad=x_pad,
+        x_query=x_query,
+        x_center=x_center,
+        x_max=x_max,
+        segment_params={
+            "x_pad": x_pad,
+            "x_query": x_query,
+            "x_center": x_center,
+            "x_max": x_max,
+            "source": "profile",
+            "budget_bytes": int(budget),
+        },
+    )
+    print("Segment sizing:", tuned.segment_params)
+    return tuned
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Probe the segment costs of every voice model config on a "
+        "device and store the profiles that tune reads in RVC_AUTOTUNE_CACHE."
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--half", action="store_true", help="probe fp16")
+    parser.add_argument("--models", nargs="+", help="keys of benchmarks.synthetic")
+    args = parser.parse_args()
+
+    from benchmarks import synthetic
+    from model_artifacts import build_synthesizer
+
+    # the costs depend on the architecture only, random weights will do
+    dtype = torch.float16 if args.half else torch.float32
+    hubert_model = synthetic.hubert().to(args.device, dtype)
+    for name in args.models or list(synthetic.MODELS):
+        cpt = synthetic.synthesizer_cpt(name)
+        tgt_sr = cpt["config"][-1]
+        net_g = build_synthesizer(cpt, args.half).eval().to(args.device, dtype)
+        key = profile_key(args.device, args.half, cpt["version"], tgt_sr)
+        profile = probe(hubert_model, net_g, cpt["version"], args.device, args.half)
+        with _lock:
+            _store_cache(key, profile)
+            _profiles[key] = profile
+        print(key, json.dumps(profile))
+    print(f"Profiles written to {CACHE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
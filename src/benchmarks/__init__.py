@@ -0,0 +1,7 @@
+"""Micro-benchmarks for the inference pipeline.
+
+Run the modules from the ``src`` directory, e.g. ``python -m benchmarks.pipeline``.
+``benchmarks.pipeline`` needs no checkpoints: it times every stage with the
+random-weight models of ``benchmarks.synthetic`` and compares the results
+with the baseline stored in ``benchmarks/baselines``.
+"""
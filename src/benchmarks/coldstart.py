@@ -0,0 +1,100 @@
+"""Cold-start import profile for the worker entry points.
+
+Imports each entry point in a fresh interpreter with ``python -X importtime``,
+prints the most expensive modules and fails if the total import time goes
+over the budget or if any module listed in ``--forbid`` gets imported.
+
+    python -m benchmarks.coldstart --budget 4
+    python -m benchmarks.coldstart --entry rp_handler --forbid faiss torchcrepe
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_DIR = os.path.dirname(SRC_DIR)
+
+# entry point -> directory it is imported from
+ENTRIES = {
+    "rvc": SRC_DIR,
+    "main": SRC_DIR,
+    "rp_handler": BASE_DIR,
+}
+# modules that only specific requests need
+LAZY_MODULES = ["faiss", "fairseq", "parselmouth", "pyworld", "torchcrepe"]
+
+
+def import_profile(entry, cwd):
+    """Return ``{module: (self_us, cumulative_us)}`` for ``import entry``."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % entry],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(
+            "import %s failed:\n%s" % (entry, proc.stderr.strip().splitlines()[-1])
+        )
+    profile = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--entry", nargs="+", default=list(ENTRIES), choices=ENTRIES)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=float(os.getenv("RVC_COLDSTART_BUDGET", "0")),
+        help="seconds of import time allowed per entry point, 0 disables",
+    )
+    parser.add_argument("--forbid", nargs="*", default=LAZY_MODULES)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="write the per-module profile to this file")
+    args = parser.parse_args()
+
+    failed = False
+    report = {}
+    for entry in args.entry:
+        profile = import_profile(entry, ENTRIES[entry])
+        total = profile[entry][1] / 1e6
+        report[entry] = profile
+        # top-level packages, ranked by their cumulative time
+        packages = {
+            name: cumulative
+            for name, (_, cumulative) in profile.items()
+            if "." not in name and name != entry
+        }
+        print(f"{entry}: {total:.2f} s, {len(profile)} modules")
+        for name, cumulative in sorted(packages.items(), key=lambda kv: -kv[1])[
+            : args.top
+        ]:
+            print(f"  {cumulative / 1e6:7.3f} s  {name}")
+
+        eager = sorted(m for m in args.forbid if m in profile)
+        if eager:
+            print(f"  FAIL imported at startup: {', '.join(eager)}")
+            failed = True
+        if args.budget and total > args.budget:
+            print(f"  FAIL {total:.2f} s exceeds the {args.budget:.2f} s budget")
+            failed = True
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Run conversions concurrently in one process and compare with serial runs.
+
+Every job converts its own variant of the input (shifted in time and
+scaled) in its own workspace, under the same file names as the others. The
+jobs run once one after the other and once on ``--threads`` threads sharing
+the loaded models. The synthesizer samples noise, so outputs are compared
+by their relative RMS difference: each concurrent output must be within
+``--tolerance`` of its own serial output and closer to it than to the
+serial output of any other job, which a mix-up between jobs would break.
+With ``--synthetic`` the model is a random-weight one of
+``benchmarks.synthetic`` and the input defaults to its synthetic speech.
+
+    python -m benchmarks.concurrency --model Obama --input speech.wav \\
+        --jobs 8 --threads 4 --f0-method harvest
+    python -m benchmarks.concurrency --synthetic --model 40k --jobs 4
+"""
+
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+import soundfile as sf
+
+from benchmarks import synthetic
+from my_utils import load_audio
+from rvc import get_config, rvc_infer
+from vc_infer_pipeline import VC
+from worker_pool import ModelRegistry
+from workspace import Workspace
+
+
+def synthetic_registry(names):
+    """A ``ModelRegistry`` holding the synthetic models ``names``."""
+    registry = ModelRegistry("cpu", False)
+    registry._hubert = synthetic.hubert()
+    registry._rmvpe = synthetic.rmvpe()
+    config = get_config("cpu", False)
+    for name in names:
+        net_g, cpt, tgt_sr = synthetic.synthesizer(name)
+        vc = VC(tgt_sr, config)
+        vc.model_rmvpe = registry._rmvpe
+        registry._models[name] = (cpt, cpt["version"], net_g, tgt_sr, vc)
+    return registry
+
+
+def run_job(registry, job, audio):
+    cpt, version, net_g, tgt_sr, vc = registry.get(job["rvc_model"])
+    with Workspace(f"job{job['id']}") as ws:
+        input_path = ws.path("input.wav")
+        output_path = ws.path("output.wav")
+        sf.write(input_path, audio, 16000)
+        rvc_infer(
+            "",
+            0.5,
+            input_path,
+            output_path,
+            job["pitch"],
+            job["f0_method"],
+            cpt,
+            version,
+            net_g,
+            3,
+            tgt_sr,
+            0.25,
+            0.33,
+            160,
+            vc,
+            registry.hubert(),
+        )
+        output, _ = sf.read(output_path, dtype="int16")
+    return output
+
+
+def _error(a, b):
+    n = min(len(a), len(b))
+    a, b = a[:n].astype(np.float64), b[:n].astype(np.float64)
+    return float(np.sqrt(np.mean((a - b) ** 2) / max(np.mean(a**2), 1e-9)))
+
+
+def compare(registry, model, source, jobs=8, threads=4, f0_method="harvest"):
+    """Run the jobs serially and on ``threads`` threads; returns the timings
+    and the relative errors of the concurrent outputs."""
+    specs, inputs = [], []
+    for i in range(jobs):
+        specs.append(
+            {"id": i, "rvc_model": model, "pitch": (i % 3) * 2, "f0_method": f0_method}
+        )
+        inputs.append(np.roll(source, i * 1600) * (1 - 0.05 * (i % 4)))
+
+    t0 = perf_counter()
+    serial = [run_job(registry, job, audio) for job, audio in zip(specs, inputs)]
+    serial_seconds = perf_counter() - t0
+
+    t0 = perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        concurrent = list(pool.map(lambda a: run_job(registry, *a), zip(specs, inputs)))
+    concurrent_seconds = perf_counter() - t0
+
+    return {
+        "jobs": jobs,
+        "threads": threads,
+        "serial_seconds": serial_seconds,
+        "concurrent_seconds": concurrent_seconds,
+        "lengths_match": [len(a) == len(b) for a, b in zip(serial, concurrent)],
+        "errors": [_error(a, b) for a, b in zip(serial, concurrent)],
+        "closest_other_job": [
+            min(
+                (_error(serial[j], out) for j in range(jobs) if j != i),
+                default=float("inf"),
+            )
+            for i, out in enumerate(concurrent)
+        ],
+    }
+
+
+def matches(result, tolerance):
+    """Whether every concurrent output matches its own serial output."""
+    return all(
+        match and e <= tolerance and e < other
+        for match, e, other in zip(
+            result["lengths_match"], result["errors"], result["closest_other_job"]
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", required=True, help="voice model folder name")
+    parser.add_argument("--input", help="input audio file")
+    parser.add_argument(
+        "--synthetic", action="store_true", help="use a synthetic voice model"
+    )
+    parser.add_argument("--seconds", type=float, default=4, help="synthetic input")
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--f0-method", default="harvest")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="largest allowed relative RMS difference between the runs",
+    )
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        registry = synthetic_registry([args.model])
+    else:
+        registry = ModelRegistry("cpu", False)
+        registry.preload([args.model])
+    if args.input:
+        source = load_audio(args.input, 16000)
+    elif args.synthetic:
+        source = synthetic.speech(args.seconds)
+    else:
+        parser.error("--input is required without --synthetic")
+
+    result = compare(
+        registry, args.model, source, args.jobs, args.threads, args.f0_method
+    )
+    result["ok"] = ok = matches(result, args.tolerance)
+    print(
+        f"serial {result['serial_seconds']:.2f} s, {args.threads} threads "
+        f"{result['concurrent_seconds']:.2f} s\n"
+        f"relative error per job {np.round(result['errors'], 4).tolist()}, "
+        f"against other jobs {np.round(result['closest_other_job'], 4).tolist()}"
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if not ok:
+        print("Concurrent outputs differ from the serial ones")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Calibration run for the cost model of ``admission``.
+
+Every voice model config of ``benchmarks.synthetic`` converts synthetic
+speech of several durations with the ``pm`` f0 method, the cheapest one, as
+a single segment. The seconds and peak memory of everything but the f0
+stage are fitted against the duration, per model version and sample rate.
+The durations reach about the segments of the fixed CPU table. The longest
+one is recorded as ``segment_seconds``, and ``admission`` estimates longer
+segments as segments of that length instead of extrapolating the fits.
+Every f0 method is then timed and measured on its own, as ``VC.get_f0``
+runs it on the whole input before the segments are converted, on inputs of
+up to a few minutes; methods slower than ``F0_SLOW_SECONDS`` per run stop
+after three durations, and all of them at a duration they fail on, such as
+one that does not fit in memory. Every run is measured in a process of its
+own. The fits (quadratic, as in ``autotune``, for the models; linear for
+the f0 methods) and the size of the weights are written to
+``benchmarks/baselines/cost_model.json`` along with the calibration time of
+``benchmarks.pipeline``, so ``admission`` can scale the estimates to a
+faster or slower worker.
+
+    python -m benchmarks.costs
+    python -m benchmarks.costs --models 48k_v2 --f0-methods pm rmvpe --out costs.json
+"""
+
+import argparse
+import dataclasses
+import gc
+import json
+import multiprocessing
+import os
+import platform
+from time import perf_counter
+
+import numpy as np
+import torch
+
+import tracing
+from autotune import _fit, measure
+from benchmarks import synthetic
+from benchmarks.memory import Stages, Timeline, stage_peaks
+from benchmarks.pipeline import calibrate
+from rvc import get_config
+from vc_infer_pipeline import VC
+
+OUT = os.path.join(os.path.dirname(__file__), "baselines", "cost_model.json")
+F0_METHODS = (
+    "pm",
+    "harvest",
+    "dio",
+    "crepe",
+    "crepe-tiny",
+    "mangio-crepe",
+    "mangio-crepe-tiny",
+    "rmvpe",
+)
+CREPE_HOP_LENGTH = 160  # what main.voice_conversion passes
+# up to about the segments of the fixed CPU table (41 s); the longer GPU
+# segments do not fit the memory of a 6 GB calibration machine
+DURATIONS = (4, 8, 16, 24, 32, 40)
+# towards the inputs admitted by input_fetcher, the f0 fits are lines
+F0_DURATIONS = (4, 16, 64, 256)
+F0_SLOW_SECONDS = 120
+
+
+def model_key(version, sr):
+    return f"{version}-{sr}"
+
+
+def _bytes(module):
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def convert(vc, hubert, net_g, cpt, tgt_sr, audio, stages, interval=0.001):
+    """Convert ``audio`` with ``pm``; returns ``(seconds, peak bytes)``
+    without the f0 stage."""
+    gc.collect()
+    stages.intervals = []
+    with Timeline("cpu", interval) as timeline:
+        t0 = perf_counter()
+        vc.pipeline(
+            hubert,
+            net_g,
+            0,
+            audio.copy(),
+            "calibration.wav",
+            [0, 0, 0],
+            0,
+            "pm",
+            "",
+            0,
+            cpt["f0"],
+            3,
+            tgt_sr,
+            0,
+            0.25,
+            cpt["version"],
+            0.33,
+            CREPE_HOP_LENGTH,
+        )
+        seconds = perf_counter() - t0
+    intervals, stages.intervals = stages.intervals, None
+    f0_seconds = sum((end - start) / 1e9 for n, start, end in intervals if n == "f0")
+    run = [("total", timeline.samples[0][0], timeline.samples[-1][0])]
+    peaks = stage_peaks(timeline.samples, intervals + run)
+    return seconds - f0_seconds, peaks["total"]["heap"]
+
+
+def _line(seconds, values):
+    # f0 methods work frame by frame, a quadratic term would only fit noise
+    b, a = np.polyfit(seconds, values, 1)
+    return [0.0, max(float(b), 0.0), float(a)]
+
+
+def f0_cost(vc, method, audio):
+    """``(seconds, peak bytes)`` of ``method`` on ``audio``, padded as in
+    ``VC.pipeline``."""
+    x = np.pad(audio, (vc.t_pad, vc.t_pad), mode="reflect")
+    p_len = x.shape[0] // vc.window
+    # a path of its own, harvest results are cached by path within a job
+    path = f"calibration-{perf_counter()}.wav"
+    gc.collect()
+    _, peak, seconds = measure(
+        lambda: vc.get_f0(path, x, p_len, 0, method, 3, CREPE_HOP_LENGTH),
+        "cpu",
+    )
+    return seconds, peak
+
+
+def _convert_run(vc, hubert, net_g, cpt, tgt_sr, audio, stages):
+    # warm-up so one-time allocations do not count towards the run
+    convert(vc, hubert, net_g, cpt, tgt_sr, synthetic.speech(1), stages, 0.01)
+    return convert(vc, hubert, net_g, cpt, tgt_sr, audio, stages)
+
+
+def _f0_run(vc, method, audio):
+    f0_cost(vc, method, synthetic.speech(1))
+    return f0_cost(vc, method, audio)
+
+
+def _forked(fn, *args):
+    """Return ``fn(*args)``, run in a forked process.
+
+    The allocator keeps freed memory for later runs, fragmented, so runs one
+    after another in one process add up to more than the largest one needs:
+    every model and f0 method on every duration starts from the parent.
+    """
+    ctx = multiprocessing.get_context("fork")
+    reader, writer = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=lambda: writer.send(fn(*args)))
+    process.start()
+    writer.close()
+    try:
+        return reader.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(
+            f"{fn.__name__} failed, exit code {process.exitcode}"
+        ) from None
+    finally:
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--models", nargs="+", default=list(synthetic.MODELS))
+    parser.add_argument("--f0-methods", nargs="+", default=list(F0_METHODS))
+    parser.add_argument("--durations", nargs="+", type=float, default=list(DURATIONS))
+    parser.add_argument(
+        "--f0-durations", nargs="+", type=float, default=list(F0_DURATIONS)
+    )
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--out", default=OUT, help="where to write the cost model")
+    args = parser.parse_args()
+    if not tracing.ENABLED:
+        parser.error("the f0 stage is timed by its tracing span, unset RVC_TRACE=0")
+    if len(set(args.durations)) <= 3:
+        parser.error("fit three coefficients to more than three durations")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    calibration = calibrate()
+    print(f"calibration {calibration * 1000:.1f} ms, {torch.get_num_threads()} threads")
+    longest = max(args.durations)
+    # every input is converted as one segment, whatever its duration
+    config = get_config("cpu", False)
+    config = dataclasses.replace(
+        config, x_center=longest, x_max=longest + 2 * config.x_pad + 1
+    )
+    hubert = synthetic.hubert()
+    rmvpe = synthetic.rmvpe()
+    stages = Stages()
+    inputs = {d: synthetic.speech(d) for d in {*args.durations, *args.f0_durations}}
+
+    models = {}
+    for name in args.models:
+        net_g, cpt, tgt_sr = synthetic.synthesizer(name)
+        vc = VC(tgt_sr, config)
+        runs = [
+            _forked(_convert_run, vc, hubert, net_g, cpt, tgt_sr, inputs[d], stages)
+            for d in args.durations
+        ]
+        key = model_key(cpt["version"], tgt_sr)
+        models[key] = {
+            "seconds": _fit(args.durations, [s for s, _ in runs]),
+            "memory": _fit(args.durations, [m for _, m in runs]),
+            "weights_bytes": _bytes(net_g),
+        }
+        del net_g
+        print(
+            f"{key:10} "
+            + "  ".join(
+                f"{d:.0f} s: {s:.2f} s {m / (1 << 20):.0f} MiB"
+                for d, (s, m) in zip(args.durations, runs)
+            )
+        )
+
+    vc = VC(40000, config)
+    vc.model_rmvpe = rmvpe
+    f0 = {}
+    for method in args.f0_methods:
+        runs = []
+        for d in sorted(args.f0_durations):
+            if len(runs) >= 3 and runs[-1][0] > F0_SLOW_SECONDS:
+                break
+            try:
+                runs.append(_forked(_f0_run, vc, method, inputs[d]))
+            except RuntimeError as e:
+                # most likely out of memory, longer inputs would be too
+                print(f"{method} on {d:.0f} s: {e}")
+                if len(runs) < 2:
+                    raise
+                break
+        durations = sorted(args.f0_durations)[: len(runs)]
+        f0[method] = {
+            "durations": durations,
+            "seconds": _line(durations, [s for s, _ in runs]),
+            "memory": _line(durations, [m for _, m in runs]),
+        }
+        print(
+            f"{method:18} "
+            + "  ".join(
+                f"{d:.0f} s: {s:.2f} s {m / (1 << 20):.0f} MiB"
+                for d, (s, m) in zip(durations, runs)
+            )
+        )
+
+    results = {
+        "calibration_seconds": calibration,
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "threads": torch.get_num_threads(),
+        "durations": args.durations,
+        # the longest segment the fits describe
+        "segment_seconds": longest,
+        "hubert_bytes": _bytes(hubert),
+        "rmvpe_bytes": _bytes(rmvpe.model),
+        "models": models,
+        "f0": f0,
+    }
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Cost model written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
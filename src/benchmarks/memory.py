@@ -0,0 +1,255 @@
+"""Peak memory of every pipeline stage as a function of input duration.
+
+Synthetic speech of increasing duration is written to a WAV file, decoded
+with ``load_audio`` and converted by ``VC.pipeline`` with the random-weight
+models of ``benchmarks.synthetic``. A background thread samples the C heap
+in use (``autotune.heap_in_use``), the RSS and, on GPUs, the memory held by
+the CUDA allocator. The stages are delimited by the tracing spans (decode,
+highpass, f0, hubert, retrieval, synthesizer, rms_mix) and by forward hooks
+on the attention (text encoder), flow and decoder. For each stage the peak
+above the memory in use when the stage started is reported, and a quadratic
+memory-versus-duration model is fitted per stage, like ``autotune`` does
+for its probes.
+
+By default the input is cut into segments as in serving, which bounds the
+per-segment stages; ``--unsegmented`` converts every input as one segment
+to expose the raw growth. ``--budget`` prints the longest input each stage
+allows within that many MiB.
+
+    python -m benchmarks.memory --durations 5 10 20 40 --json memory.json
+    python -m benchmarks.memory --model 48k_v2 --unsegmented --budget 4096
+"""
+
+import argparse
+import dataclasses
+import gc
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+
+import tracing
+from autotune import _fit, heap_in_use
+from benchmarks import synthetic
+from my_utils import load_audio
+from rvc import get_config
+from vc_infer_pipeline import VC
+
+MIB = 1 << 20
+
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class Timeline:
+    """Samples the memory in use from a background thread."""
+
+    def __init__(self, device, interval=0.001):
+        self.cuda = str(device).startswith("cuda")
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        device = torch.cuda.memory_allocated() if self.cuda else 0
+        self.samples.append((time.time_ns(), heap_in_use(), rss(), device))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+class Stages:
+    """The ``(name, start_ns, end_ns)`` of every stage that ran."""
+
+    def __init__(self):
+        self.intervals = None
+        self._started = {}
+        tracing.add_listener(self._on_span)
+
+    def _on_span(self, s):
+        if self.intervals is not None:
+            self.intervals.append((s.name, s.start_ns, s.end_ns))
+
+    def watch(self, modules):
+        handles = []
+        for name, module in modules.items():
+
+            def start(module, args):
+                self._started[id(module)] = time.time_ns()
+
+            def stop(module, args, output, name=name):
+                if self.intervals is not None:
+                    start_ns = self._started.pop(id(module))
+                    self.intervals.append((name, start_ns, time.time_ns()))
+
+            handles.append(module.register_forward_pre_hook(start))
+            handles.append(module.register_forward_hook(stop))
+        return handles
+
+
+def stage_peaks(samples, intervals):
+    """Peak bytes above the start of each stage, the max over its calls.
+
+    Returns ``{stage: {"heap": bytes, "rss": bytes, "device": bytes}}``.
+    Stages shorter than the sampling interval can be under-measured.
+    """
+    times = np.array([s[0] for s in samples])
+    values = np.array([s[1:] for s in samples], dtype=np.int64)
+    peaks = {}
+    for name, start, end in intervals:
+        first = max(int(np.searchsorted(times, start, "right")) - 1, 0)
+        last = max(int(np.searchsorted(times, end, "right")), first + 2)
+        window = values[first:last]
+        delta = window.max(axis=0) - window[0]
+        old = peaks.get(name, np.zeros(3, dtype=np.int64))
+        peaks[name] = np.maximum(old, delta)
+    return {
+        name: dict(zip(("heap", "rss", "device"), map(int, delta)))
+        for name, delta in peaks.items()
+    }
+
+
+def measure(vc, hubert, net_g, cpt, tgt_sr, path, device, stages, interval):
+    """Decode and convert ``path`` once; returns the peaks per stage."""
+    gc.collect()
+    stages.intervals = []
+    with Timeline(device, interval) as timeline:
+        with tracing.span("decode"):
+            audio = load_audio(path, 16000)
+        vc.pipeline(
+            hubert,
+            net_g,
+            0,
+            audio,
+            path,
+            [0, 0, 0],
+            0,
+            "rmvpe",
+            "",
+            0,
+            cpt["f0"],
+            3,
+            tgt_sr,
+            0,
+            0.25,
+            cpt["version"],
+            0.33,
+            160,
+        )
+    intervals, stages.intervals = stages.intervals, None
+    run = [("total", timeline.samples[0][0], timeline.samples[-1][0])]
+    return stage_peaks(timeline.samples, intervals + run)
+
+
+def max_seconds(fit, budget):
+    """The longest duration whose fitted memory stays within ``budget``."""
+    c, b, a = fit
+    if c > 0:
+        return max((-b + np.sqrt(b * b + 4 * c * (budget - a))) / (2 * c), 0.0)
+    if b > 0:
+        return max((budget - a) / b, 0.0)
+    return float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", default="48k_v2", help="synthetic model config")
+    parser.add_argument("--durations", nargs="+", type=float, default=[5, 10, 20, 40])
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument(
+        "--unsegmented",
+        action="store_true",
+        help="convert each input as a single segment",
+    )
+    parser.add_argument(
+        "--memory",
+        choices=["heap", "rss", "device"],
+        help="which measure the fits use (default: device on GPUs, else heap)",
+    )
+    parser.add_argument("--interval", type=float, default=0.001)
+    parser.add_argument("--budget", type=float, help="memory budget in MiB")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    if not tracing.ENABLED:
+        parser.error("stages are delimited by the tracing spans, unset RVC_TRACE=0")
+    memory = args.memory or ("device" if args.device.startswith("cuda") else "heap")
+
+    config = get_config(args.device, False)
+    if args.unsegmented:
+        longest = int(max(args.durations)) + 1
+        config = dataclasses.replace(
+            config, x_pad=1, x_query=1, x_center=longest, x_max=longest + 1
+        )
+    net_g, cpt, tgt_sr = synthetic.synthesizer(args.model)
+    net_g = net_g.to(args.device)
+    hubert = synthetic.hubert().to(args.device)
+    vc = VC(tgt_sr, config)
+    vc.model_rmvpe = synthetic.rmvpe(device=args.device)
+    stages = Stages()
+    stages.watch({"attention": net_g.enc_p, "flow": net_g.flow, "decoder": net_g.dec})
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "input.wav")
+        # warm-up so one-time allocations do not count towards the first run
+        sf.write(path, synthetic.speech(1), 16000)
+        measure(vc, hubert, net_g, cpt, tgt_sr, path, args.device, stages, 0.01)
+        for seconds in args.durations:
+            sf.write(path, synthetic.speech(seconds), 16000)
+            peaks = measure(
+                vc, hubert, net_g, cpt, tgt_sr, path, args.device, stages, args.interval
+            )
+            runs.append(peaks)
+            print(
+                f"{seconds:6.1f} s  "
+                + "  ".join(f"{k} {v[memory] / MIB:.0f}" for k, v in peaks.items())
+                + " MiB"
+            )
+
+    names = [name for name in runs[-1] if all(name in run for run in runs)]
+    results = {"model": args.model, "memory": memory, "stages": {}}
+    print(f"\n{'stage':12} {'MiB':>8} {'MiB/s':>8} {'MiB/s^2':>8}", end="")
+    print(f" {'max s':>8}" if args.budget else "")
+    for name in names:
+        values = [run[name][memory] for run in runs]
+        fit = _fit(args.durations, values) if len(args.durations) >= 3 else None
+        results["stages"][name] = {
+            "durations": args.durations,
+            "peaks": [run[name] for run in runs],
+            "fit": fit,
+        }
+        if fit is None:
+            continue
+        c, b, a = fit
+        line = f"{name:12} {a / MIB:8.1f} {b / MIB:8.2f} {c / MIB:8.4f}"
+        if args.budget:
+            line += f" {max_seconds(fit, args.budget * MIB):8.0f}"
+        print(line)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Per-stage timing of ``VC.pipeline`` on CPU with synthetic models.
+
+Every combination of voice model config, test signal, input length and f0
+method is converted with the random-weight models of
+``benchmarks.synthetic``, so no checkpoint has to be downloaded. Stage times
+come from the tracing spans of the pipeline (highpass, segmentation, f0,
+hubert, retrieval, synthesizer, rms_mix); the synthesizer is further split
+into its attention (text encoder), flow and decoder.
+
+Before the cases, a fixed calibration workload is timed. With ``--baseline``
+every stage is compared with a stored run after scaling by the ratio of the
+two calibration times, so a baseline from a somewhat faster or slower
+machine still applies. The check fails if a stage is more than
+``--tolerance`` slower.
+
+    python -m benchmarks.pipeline --json results.json
+    python -m benchmarks.pipeline --baseline
+    python -m benchmarks.pipeline --models 48k_v2 --signals speech --lengths 30
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from time import perf_counter
+
+import torch
+
+import tracing
+from benchmarks import synthetic
+from rvc import get_config
+from vc_infer_pipeline import VC
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "pipeline_cpu.json")
+
+
+class StageTimer:
+    """Sums the seconds of every pipeline stage while ``stages`` is a dict."""
+
+    def __init__(self):
+        self.stages = None
+        self._started = {}
+        tracing.add_listener(self._on_span)
+
+    def _on_span(self, s):
+        if self.stages is not None:
+            self.stages[s.name] = self.stages.get(s.name, 0.0) + s.seconds
+
+    def watch(self, modules):
+        """Time the forward calls of ``{name: module}``; returns hook handles."""
+        handles = []
+        for name, module in modules.items():
+
+            def start(module, args):
+                self._started[id(module)] = perf_counter()
+
+            def stop(module, args, output, name=name):
+                if self.stages is not None:
+                    seconds = perf_counter() - self._started.pop(id(module))
+                    self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+            handles.append(module.register_forward_pre_hook(start))
+            handles.append(module.register_forward_hook(stop))
+        return handles
+
+
+def calibrate(repeats=5):
+    """Median seconds of a fixed matmul and convolution workload."""
+    torch.manual_seed(0)
+    a = torch.randn(512, 512)
+    conv = torch.nn.Conv1d(192, 192, 7, padding=3)
+    x = torch.randn(1, 192, 4000)
+    times = []
+    with torch.no_grad():
+        for _ in range(repeats + 1):
+            t0 = perf_counter()
+            for _ in range(10):
+                a @ a
+            conv(x)
+            times.append(perf_counter() - t0)
+    return statistics.median(times[1:])
+
+
+def run_case(vc, hubert, net_g, cpt, tgt_sr, audio, f0_method, index_path, timer):
+    """Convert ``audio`` once; returns ``(seconds, {stage: seconds})``."""
+    torch.manual_seed(0)
+    timer.stages = {}
+    t0 = perf_counter()
+    vc.pipeline(
+        hubert,
+        net_g,
+        0,
+        audio.copy(),
+        "benchmark.wav",
+        [0, 0, 0],
+        0,
+        f0_method,
+        index_path,
+        0.5 if index_path else 0,
+        cpt["f0"],
+        3,
+        tgt_sr,
+        0,
+        0.25,
+        cpt["version"],
+        0.33,
+        160,
+    )
+    seconds = perf_counter() - t0
+    stages, timer.stages = timer.stages, None
+    return seconds, stages
+
+
+def case_key(case):
+    return (case["model"], case["signal"], case["seconds"], case["f0_method"])
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """Return ``(rows compared, regressions)`` of ``results`` against ``baseline``.
+
+    Stages that took less than ``min_seconds`` in the baseline are skipped,
+    their times are mostly noise.
+    """
+    scale = results["calibration_seconds"] / baseline["calibration_seconds"]
+    base = {case_key(case): case for case in baseline["cases"]}
+    compared, regressions = 0, []
+    for case in results["cases"]:
+        old = base.get(case_key(case))
+        if old is None:
+            continue
+        pairs = [("total", case["total"], old["total"])]
+        pairs += [
+            (stage, seconds, old["stages"].get(stage))
+            for stage, seconds in case["stages"].items()
+        ]
+        for stage, seconds, was in pairs:
+            if was is None or was < min_seconds:
+                continue
+            compared += 1
+            ratio = seconds / (was * scale)
+            if ratio > 1 + tolerance:
+                regressions.append((case_key(case), stage, was * scale, seconds, ratio))
+    return compared, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=list(synthetic.MODELS) + ["48k_nono", "48k_v2_nono"],
+        help="config names, with a _nono suffix for models without pitch",
+    )
+    parser.add_argument(
+        "--signals",
+        nargs="+",
+        default=list(synthetic.SIGNALS),
+        choices=synthetic.SIGNALS,
+    )
+    parser.add_argument("--lengths", nargs="+", type=float, default=[1, 4])
+    parser.add_argument("--f0-methods", nargs="+", default=["rmvpe"])
+    parser.add_argument("--repeats", type=int, default=1, help="runs per case")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--no-index", action="store_true", help="skip retrieval")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument(
+        "--baseline",
+        nargs="?",
+        const=BASELINE,
+        help="stored results to compare with (default: the bundled baseline)",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.05,
+        help="ignore stages faster than this in the baseline",
+    )
+    args = parser.parse_args()
+    if not tracing.ENABLED:
+        parser.error("stage times come from the tracing spans, unset RVC_TRACE=0")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    calibration = calibrate()
+    print(f"calibration {calibration * 1000:.1f} ms, {torch.get_num_threads()} threads")
+    config = get_config("cpu", False)
+    hubert = synthetic.hubert()
+    rmvpe = synthetic.rmvpe()
+    timer = StageTimer()
+    cases = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for model in args.models:
+            net_g, cpt, tgt_sr = synthetic.synthesizer(model)
+            vc = VC(tgt_sr, config)
+            vc.model_rmvpe = rmvpe
+            index_path = ""
+            if not args.no_index:
+                dim = 768 if cpt["version"] == "v2" else 256
+                index_path = os.path.join(tmp, f"{dim}.index")
+                if not os.path.exists(index_path):
+                    synthetic.index(index_path, dim)
+            handles = timer.watch(
+                {"attention": net_g.enc_p, "flow": net_g.flow, "decoder": net_g.dec}
+            )
+            # warm up the allocator and the f0 method
+            run_case(
+                vc,
+                hubert,
+                net_g,
+                cpt,
+                tgt_sr,
+                synthetic.signal("speech", 1),
+                args.f0_methods[0],
+                index_path,
+                timer,
+            )
+            for f0_method in args.f0_methods:
+                for kind in args.signals:
+                    for seconds in args.lengths:
+                        audio = synthetic.signal(kind, seconds)
+                        runs = [
+                            run_case(
+                                vc,
+                                hubert,
+                                net_g,
+                                cpt,
+                                tgt_sr,
+                                audio,
+                                f0_method,
+                                index_path,
+                                timer,
+                            )
+                            for _ in range(args.repeats)
+                        ]
+                        # the fastest run is the least disturbed one
+                        total, stages = min(runs, key=lambda run: run[0])
+                        case = {
+                            "model": model,
+                            "signal": kind,
+                            "seconds": seconds,
+                            "f0_method": f0_method,
+                            "total": total,
+                            "real_time_factor": total / seconds,
+                            "stages": stages,
+                        }
+                        cases.append(case)
+                        print(
+                            f"{model:12} {kind:8} {seconds:5.1f} s {f0_method:8} "
+                            f"{total:7.2f} s  "
+                            + " ".join(f"{k} {v:.2f}" for k, v in stages.items())
+                        )
+            for handle in handles:
+                handle.remove()
+
+    results = {
+        "calibration_seconds": calibration,
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "threads": torch.get_num_threads(),
+        "cases": cases,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        compared, regressions = compare(
+            results, baseline, args.tolerance, args.min_seconds
+        )
+        for key, stage, was, seconds, ratio in regressions:
+            print(
+                f"REGRESSION {' '.join(map(str, key))} {stage}: "
+                f"{was:.3f} s -> {seconds:.3f} s ({ratio:.2f}x)"
+            )
+        print(f"{compared} stage times compared, {len(regressions)} regressions")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
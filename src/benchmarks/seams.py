@@ -0,0 +1,165 @@
+"""Quality vs compute sweep over segment context (x_pad) and crossfade length.
+
+Every configuration converts the same input with short segments so that it
+has many seams. The output is compared against a reference converted as a
+single segment. The log-mel L1 distance is measured in a window around each
+seam. Because the synthesizer is stochastic, the same distance at random
+positions away from the seams is reported as a noise floor.
+
+    python -m benchmarks.seams --model Obama --input speech.wav
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+from time import perf_counter
+
+import librosa
+import numpy as np
+import torch
+from scipy import signal
+
+from my_utils import load_audio
+from rvc import get_config, get_vc, load_hubert
+from segmentation import find_split_points
+from vc_infer_pipeline import VC, ah, bh
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+rvc_models_dir = os.path.join(BASE_DIR, "rvc_models")
+
+
+def convert(vc, hubert, net_g, cpt, version, tgt_sr, audio, args):
+    torch.manual_seed(0)
+    t0 = perf_counter()
+    out = vc.pipeline(
+        hubert,
+        net_g,
+        0,
+        audio.copy(),
+        args.input,
+        [0, 0, 0],
+        0,
+        args.f0_method,
+        "",
+        0,
+        cpt.get("f0", 1),
+        3,
+        tgt_sr,
+        0,
+        1,
+        version,
+        0.33,
+        160,
+    )
+    return out.astype(np.float32) / 32768, perf_counter() - t0
+
+
+def log_mel(y, sr):
+    y = y / (np.sqrt(np.mean(y**2)) + 1e-9)
+    mel = librosa.feature.melspectrogram(
+        y=y, sr=sr, n_fft=2048, hop_length=sr // 100, n_mels=80
+    )
+    return np.log(mel + 1e-5)
+
+
+def distance_at(ref_mel, mel, times, radius):
+    frames = min(ref_mel.shape[1], mel.shape[1])
+    d = np.abs(ref_mel[:, :frames] - mel[:, :frames]).mean(0)
+    values = [
+        d[max(int(t * 100) - radius, 0) : int(t * 100) + radius].mean()
+        for t in times
+        if int(t * 100) < frames
+    ]
+    return float(np.mean(values)) if values else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", required=True, help="voice model folder name")
+    parser.add_argument("--input", required=True, help="input audio file")
+    parser.add_argument("--f0-method", default="rmvpe")
+    parser.add_argument("--x-center", type=float, default=8.0)
+    parser.add_argument("--pads", type=float, nargs="+", default=[3, 1, 0.5, 0.25])
+    parser.add_argument("--fades", type=float, nargs="+", default=[0, 0.05, 0.2])
+    parser.add_argument("--radius-ms", type=int, default=100)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    is_half = device != "cpu"
+    base_config = get_config(device, is_half)
+    hubert = load_hubert(
+        device, is_half, os.path.join(rvc_models_dir, "hubert_base.pt")
+    )
+    model_dir = os.path.join(rvc_models_dir, args.model)
+    pth = next(f for f in os.listdir(model_dir) if f.endswith(".pth"))
+    cpt, version, net_g, tgt_sr, _ = get_vc(
+        device, is_half, base_config, os.path.join(model_dir, pth)
+    )
+    audio = load_audio(args.input, 16000)
+    duration = len(audio) / 16000
+
+    def make_config(x_pad, x_center, x_crossfade):
+        return dataclasses.replace(
+            base_config,
+            x_pad=x_pad,
+            x_center=x_center,
+            x_crossfade=x_crossfade,
+            x_query=max(x_center / 6, 1),
+            x_max=x_center + x_pad + 1,
+        )
+
+    ref_config = make_config(base_config.x_pad, duration + 1, 0)
+    ref, ref_time = convert(
+        VC(tgt_sr, ref_config), hubert, net_g, cpt, version, tgt_sr, audio, args
+    )
+    ref_mel = log_mel(ref, tgt_sr)
+
+    seam_config = make_config(1, args.x_center, 0)
+    vc = VC(tgt_sr, seam_config)
+    seams = [
+        t // vc.window * vc.window / 16000
+        for t in find_split_points(
+            signal.filtfilt(bh, ah, audio), vc.window, vc.t_center, vc.t_query
+        )
+    ]
+    rng = np.random.default_rng(0)
+    controls = rng.uniform(0, duration, size=max(len(seams), 8) * 4)
+    controls = [t for t in controls if all(abs(t - s) > 0.5 for s in seams)]
+    radius = args.radius_ms // 10
+
+    print(f"{len(seams)} seams in {duration:.1f} s, reference {ref_time:.2f} s")
+    results = []
+    for x_pad in args.pads:
+        for x_crossfade in args.fades:
+            if x_crossfade / 2 > x_pad:
+                continue
+            config = make_config(x_pad, args.x_center, x_crossfade)
+            out, elapsed = convert(
+                VC(tgt_sr, config), hubert, net_g, cpt, version, tgt_sr, audio, args
+            )
+            mel = log_mel(out, tgt_sr)
+            r = {
+                "x_pad": x_pad,
+                "x_crossfade": x_crossfade,
+                "padding_overhead": 2 * x_pad / args.x_center,
+                "seconds": elapsed,
+                "seam_mel_l1": distance_at(ref_mel, mel, seams, radius),
+                "floor_mel_l1": distance_at(ref_mel, mel, controls, radius),
+            }
+            results.append(r)
+            print(
+                f"x_pad {x_pad:5.2f}  fade {x_crossfade:5.2f}  "
+                f"overhead {r['padding_overhead'] * 100:5.1f}%  {elapsed:7.2f} s  "
+                f"seam {r['seam_mel_l1']:.3f}  floor {r['floor_mel_l1']:.3f}"
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Split-point search benchmark: loop reference vs segmentation.find_split_points."""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+from scipy import signal
+
+from segmentation import find_split_points
+from vc_infer_pipeline import ah, bh
+
+
+def reference_split_points(audio, window, t_center, t_query):
+    # the loop VC.pipeline used before segmentation.find_split_points
+    audio_pad = np.pad(audio, (window // 2, window // 2), mode="reflect")
+    opt_ts = []
+    audio_sum = np.zeros_like(audio)
+    for i in range(window):
+        audio_sum += audio_pad[i : i - window]
+    for t in range(t_center, audio.shape[0], t_center):
+        opt_ts.append(
+            t
+            - t_query
+            + np.where(
+                np.abs(audio_sum[t - t_query : t + t_query])
+                == np.abs(audio_sum[t - t_query : t + t_query]).min()
+            )[0][0]
+        )
+    return opt_ts
+
+
+def speech_like(seconds, sr=16000, seed=0):
+    rng = np.random.default_rng(seed)
+    audio = rng.standard_normal(int(seconds * sr)) * 0.1
+    # syllable-rate envelope with pauses
+    env = np.repeat(rng.random(int(seconds * 4) + 1) > 0.3, sr // 4)
+    return audio * env[: audio.shape[0]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--minutes", type=float, default=60.0)
+    parser.add_argument("--x-center", type=int, default=60)
+    parser.add_argument("--x-query", type=int, default=10)
+    args = parser.parse_args()
+
+    sr, window = 16000, 160
+    # high-passed like in VC.pipeline, quiet passages are then not exactly 0
+    audio = signal.filtfilt(bh, ah, speech_like(args.minutes * 60, sr))
+    t_center, t_query = sr * args.x_center, sr * args.x_query
+
+    t0 = perf_counter()
+    ref = reference_split_points(audio, window, t_center, t_query)
+    t1 = perf_counter()
+    new = find_split_points(audio, window, t_center, t_query)
+    t2 = perf_counter()
+    print(f"input {args.minutes:g} min, {len(ref)} split points")
+    print(f"reference loop {t1 - t0:8.3f} s")
+    print(f"query windows  {t2 - t1:8.3f} s  x{(t1 - t0) / (t2 - t1):.1f}")
+    print("identical opt_ts:", [int(t) for t in ref] == new)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Random-weight models and deterministic test signals for benchmarks.
+
+The real checkpoints (``hubert_base.pt``, ``rmvpe.pt`` and voice ``.pth``
+files) are not needed: every model is built with the architecture of the
+real one, from ``src/configs/*.json`` for the synthesizers, and initialized
+from a fixed seed. Timings match the real models; the output audio is noise.
+
+    net_g, cpt, tgt_sr = synthesizer("48k_v2")
+    audio = signal("speech", seconds=4)
+"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+import torch
+from scipy import signal as sps
+
+from hubert import HubertBase
+from model_artifacts import build_synthesizer
+from rmvpe import E2E, RMVPE
+
+CONFIGS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "configs")
+# voice model name -> config file; the ``_nono`` variants have no pitch input
+MODELS = {
+    "32k": "32k.json",
+    "40k": "40k.json",
+    "48k": "48k.json",
+    "32k_v2": "32k_v2.json",
+    "48k_v2": "48k_v2.json",
+}
+SIGNALS = ("sweep", "speech", "silence")
+SR = 16000
+
+
+def _parse(name):
+    nono = name.endswith("_nono")
+    base = name[: -len("_nono")] if nono else name
+    if base not in MODELS:
+        raise ValueError(f"Unknown model {name}, expected one of {sorted(MODELS)}")
+    return base, nono
+
+
+def synthesizer_cpt(name):
+    """A checkpoint dict without weights for the voice model ``name``.
+
+    ``name`` is a key of ``MODELS``, optionally with a ``_nono`` suffix.
+    """
+    base, nono = _parse(name)
+    with open(os.path.join(CONFIGS_DIR, MODELS[base])) as f:
+        hps = json.load(f)
+    data, model = hps["data"], hps["model"]
+    config = [
+        data["filter_length"] // 2 + 1,
+        hps["train"]["segment_size"] // data["hop_length"],
+        model["inter_channels"],
+        model["hidden_channels"],
+        model["filter_channels"],
+        model["n_heads"],
+        model["n_layers"],
+        model["kernel_size"],
+        model["p_dropout"],
+        model["resblock"],
+        model["resblock_kernel_sizes"],
+        model["resblock_dilation_sizes"],
+        model["upsample_rates"],
+        model["upsample_initial_channel"],
+        model["upsample_kernel_sizes"],
+        model["spk_embed_dim"],
+        model["gin_channels"],
+        data["sampling_rate"],
+    ]
+    version = "v2" if base.endswith("_v2") else "v1"
+    return {"config": config, "f0": 0 if nono else 1, "version": version}
+
+
+def synthesizer(name, seed=0):
+    """Return ``(net_g, cpt, tgt_sr)`` for ``name``, prepared like ``get_vc``."""
+    cpt = synthesizer_cpt(name)
+    torch.manual_seed(seed)
+    net_g = build_synthesizer(cpt, is_half=False)
+    net_g.dec.remove_weight_norm()
+    net_g.flow.remove_weight_norm()
+    return net_g.eval().float(), cpt, cpt["config"][-1]
+
+
+def hubert(seed=0):
+    """A randomly initialized HuBERT base encoder."""
+    torch.manual_seed(seed)
+    return HubertBase().eval().float()
+
+
+def rmvpe(seed=0, device="cpu"):
+    """An ``RMVPE`` wrapping a randomly initialized ``E2E`` network."""
+    torch.manual_seed(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "rmvpe.pt")
+        torch.save(E2E(4, 1, (2, 2)).state_dict(), path)
+        return RMVPE(path, is_half=False, device=device)
+
+
+def index(path, dim, n=2048, seed=0):
+    """Write a flat faiss index of ``n`` random ``dim``-d vectors to ``path``."""
+    import faiss
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    flat = faiss.IndexFlatL2(dim)
+    flat.add(vectors)
+    faiss.write_index(flat, path)
+    return path
+
+
+def sweep(seconds, sr=SR, f0=80.0, f1=1000.0):
+    """A logarithmic sine sweep from ``f0`` to ``f1`` Hz."""
+    t = np.arange(int(seconds * sr)) / sr
+    return (
+        0.5 * sps.chirp(t, f0, max(seconds, 1e-3), f1, method="logarithmic")
+    ).astype(np.float32)
+
+
+def speech(seconds, sr=SR, seed=0):
+    """Speech-like noise: a glottal pulse train through changing formants.
+
+    The pitch glides around 90-250 Hz, a vowel (three formant resonators)
+    changes every 150-300 ms, syllables are shaped by a 3-5 Hz envelope and
+    about a fifth of the time is short pauses, as in read speech.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    vowels = [(730, 1090, 2440), (270, 2290, 3010), (530, 1840, 2480), (300, 870, 2240)]
+
+    # pitch contour and pulse train
+    knots = np.linspace(0, n, max(2, int(seconds * 4)) + 1)
+    f0 = np.interp(np.arange(n), knots, rng.uniform(90, 250, len(knots)))
+    phase = np.cumsum(f0 / sr)
+    pulses = np.diff(np.floor(phase), prepend=0.0)
+    excitation = pulses + 0.05 * rng.standard_normal(n)
+
+    out = np.zeros(n)
+    start = 0
+    while start < n:
+        end = min(n, start + int(rng.uniform(0.15, 0.3) * sr))
+        formants = vowels[rng.integers(len(vowels))]
+        part = excitation[max(0, start - 512) : end]
+        y = np.zeros_like(part)
+        for freq in formants:
+            b, a = sps.iirpeak(freq, Q=8, fs=sr)
+            y += sps.lfilter(b, a, part)
+        out[start:end] = y[start - max(0, start - 512) :]
+        start = end
+
+    t = np.arange(n) / sr
+    envelope = 0.5 - 0.5 * np.cos(2 * np.pi * rng.uniform(3, 5) * t)
+    for _ in range(int(seconds)):
+        # pauses of 100-300 ms
+        at = int(rng.uniform(0, max(seconds - 0.3, 0)) * sr)
+        envelope[at : at + int(rng.uniform(0.1, 0.3) * sr)] = 0
+    out *= envelope
+    return (0.5 * out / (np.abs(out).max() + 1e-9)).astype(np.float32)
+
+
+def silence(seconds, sr=SR, seed=0):
+    """Near-silence: a noise floor at -80 dBFS."""
+    rng = np.random.default_rng(seed)
+    return (1e-4 * rng.standard_normal(int(seconds * sr))).astype(np.float32)
+
+
+def signal(kind, seconds, sr=SR, seed=0):
+    """The test signal ``kind`` (one of ``SIGNALS``), ``seconds`` long."""
+    if kind == "sweep":
+        return sweep(seconds, sr)
+    if kind == "speech":
+        return speech(seconds, sr, seed)
+    if kind == "silence":
+        return silence(seconds, sr, seed)
+    raise ValueError(f"Unknown signal {kind}, expected one of {SIGNALS}")
@@ -0,0 +1,90 @@
+"""CPU throughput sweep over worker process counts and thread splits.
+
+Each configuration is given as ``PROCESSESxTHREADS`` (``0`` threads means one
+per physical core of the worker's share). The same batch of conversion jobs
+runs once per configuration on a pool with shared weights. The report has
+the audio seconds converted per wall-clock second and the job latencies.
+
+    python -m benchmarks.throughput --model Obama --input speech.wav \\
+        --configs 1x0 2x0 4x0 8x1 --jobs 16
+"""
+
+import argparse
+import json
+import os
+from time import perf_counter
+
+import numpy as np
+import soundfile as sf
+
+from worker_pool import ModelRegistry, WorkerPool, cpu_topology
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", required=True, help="voice model folder name")
+    parser.add_argument("--input", required=True, help="input audio file")
+    parser.add_argument("--configs", nargs="+", default=["1x0", "2x0", "4x0"])
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--f0-method", default="rmvpe")
+    parser.add_argument("--no-pin", action="store_true")
+    parser.add_argument("--output-dir", default="/tmp/rvc_throughput")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    sockets = cpu_topology()
+    cores = sum(len(socket) for socket in sockets)
+    cpus = sum(len(core) for socket in sockets for core in socket)
+    print(f"{len(sockets)} sockets, {cores} cores, {cpus} CPUs")
+    seconds = sf.info(args.input).duration
+
+    registry = ModelRegistry("cpu", False)
+    registry.preload([args.model])
+    results = []
+    for config in args.configs:
+        processes, threads = (int(v) for v in config.split("x"))
+        jobs = [
+            {
+                "id": i,
+                "input_audio": args.input,
+                "rvc_model": args.model,
+                "f0_method": args.f0_method,
+                "output_path": os.path.join(args.output_dir, f"{config}_{i}.wav"),
+            }
+            for i in range(args.jobs)
+        ]
+        with WorkerPool(
+            registry, processes, threads or None, pin=not args.no_pin
+        ) as pool:
+            # one warm-up job per worker, not timed
+            list(pool.map(jobs[: pool.processes]))
+            latencies = []
+            t0 = perf_counter()
+            for result in pool.map(jobs):
+                if "error" in result:
+                    raise RuntimeError(result["error"])
+                latencies.append(result["seconds"])
+            wall = perf_counter() - t0
+        r = {
+            "config": config,
+            "processes": pool.processes,
+            "intra_op": [worker["intra_op"] for worker in pool.plan],
+            "wall_seconds": wall,
+            "audio_seconds_per_second": args.jobs * seconds / wall,
+            "latency_p50": float(np.percentile(latencies, 50)),
+            "latency_p95": float(np.percentile(latencies, 95)),
+        }
+        results.append(r)
+        print(
+            f"{config:>6}  {r['audio_seconds_per_second']:7.2f} audio s/s  "
+            f"p50 {r['latency_p50']:6.2f} s  p95 {r['latency_p95']:6.2f} s"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Background delivery of webhooks with retries and an on-disk outbox.
+
+``Dispatcher.post`` writes the webhook to the outbox directory and returns
+at once; worker threads deliver it over a pooled ``httpx.Client``. Failed
+deliveries are retried with exponential backoff and jitter. A record is
+removed from the outbox only once delivered or rejected by the receiver
+(4xx other than 408 and 429), so deliveries pending when the process stops
+are sent by the next one that uses the same ``RVC_OUTBOX_DIR``.
+
+The outbox defaults to the network volume of RunPod serverless endpoints
+when one is mounted, as a worker's own disk goes away with it. Processes
+sharing an outbox claim a record by renaming it to ``.claimed`` before
+sending it; a claim older than ``CLAIM_SECONDS`` is left by a process that
+stopped and is returned to the outbox.
+
+``with_retries`` runs other calls, e.g. uploads, with the same backoff.
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+import httpx
+
+VOLUME_DIR = "/runpod-volume"
+OUTBOX_DIR = os.getenv(
+    "RVC_OUTBOX_DIR",
+    os.path.join(
+        (
+            VOLUME_DIR
+            if os.path.isdir(VOLUME_DIR)
+            else os.path.join(os.path.expanduser("~"), ".cache")
+        ),
+        "rvc",
+        "outbox",
+    ),
+)
+QUEUE_SIZE = int(os.getenv("RVC_DISPATCH_QUEUE", "64"))
+WORKERS = int(os.getenv("RVC_DISPATCH_WORKERS", "4"))
+MAX_ATTEMPTS = int(os.getenv("RVC_DISPATCH_ATTEMPTS", "8"))
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 300.0
+SCAN_SECONDS = 1.0
+# longer than a delivery can take with the client's timeouts
+CLAIM_SECONDS = 120.0
+
+logger = logging.getLogger(__name__)
+
+
+def backoff(attempt, base=BACKOFF_SECONDS, cap=MAX_BACKOFF_SECONDS):
+    """Delay before retry ``attempt`` (1-based), with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def with_retries(fn, attempts=3, base=BACKOFF_SECONDS):
+    """Call ``fn()`` until it succeeds, at most ``attempts`` times."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = backoff(attempt, base)
+            logger.warning(f"Attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _write_record(path, record):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(record, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        outbox=OUTBOX_DIR,
+        maxsize=QUEUE_SIZE,
+        workers=WORKERS,
+        max_attempts=MAX_ATTEMPTS,
+        client=None,
+    ):
+        self.outbox = outbox
+        self.max_attempts = max_attempts
+        self.stats = {"delivered": 0, "retried": 0, "failed": 0}
+        self._queue = queue.Queue(maxsize)
+        self._workers = workers
+        self._client = client or httpx.Client(
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=workers, max_keepalive_connections=workers
+            ),
+        )
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+        os.makedirs(os.path.join(self.outbox, "failed"), exist_ok=True)
+        threads = [threading.Thread(target=self._scan_loop, daemon=True)]
+        threads += [
+            threading.Thread(target=self._work_loop, daemon=True)
+            for _ in range(self._workers)
+        ]
+        for t in threads:
+            t.start()
+        return self
+
+    def post(self, url, payload):
+        """Queue a JSON POST of ``payload`` to ``url``; returns the record id."""
+        self.start()
+        record_id = "%d-%s" % (time.time_ns(), uuid.uuid4().hex[:8])
+        path = os.path.join(self.outbox, record_id + ".json")
+        _write_record(
+            path,
+            {"url": url, "payload": payload, "attempts": 0, "next_at": 0},
+        )
+        self._enqueue(path)
+        return record_id
+
+    def _enqueue(self, path):
+        with self._lock:
+            if path in self._in_flight:
+                return
+            try:
+                # when the queue is full the record waits for the next scan
+                self._queue.put_nowait(path)
+            except queue.Full:
+                return
+            self._in_flight.add(path)
+
+    def _scan_loop(self):
+        while True:
+            now = time.time()
+            for name in sorted(os.listdir(self.outbox)):
+                path = os.path.join(self.outbox, name)
+                if name.endswith(".claimed"):
+                    self._release_stale(path, now)
+                    continue
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(path) as f:
+                        due = json.load(f)["next_at"] <= now
+                except (OSError, ValueError, KeyError):
+                    continue
+                if due:
+                    self._enqueue(path)
+            time.sleep(SCAN_SECONDS)
+
+    def _release_stale(self, claimed, now):
+        try:
+            if os.stat(claimed).st_mtime > now - CLAIM_SECONDS:
+                return
+            os.rename(claimed, claimed[: -len(".claimed")] + ".json")
+        except OSError:
+            # delivered, or released by another process, in the meantime
+            return
+        logger.warning(f"Released the stale claim {claimed}")
+
+    def _work_loop(self):
+        while True:
+            path = self._queue.get()
+            try:
+                self._deliver(path)
+            except Exception:
+                logger.exception(f"Delivering {path} failed")
+            finally:
+                with self._lock:
+                    self._in_flight.discard(path)
+                    self._idle.notify_all()
+
+    def _deliver(self, path):
+        claimed = path[: -len(".json")] + ".claimed"
+        try:
+            with open(path) as f:
+                if json.load(f)["next_at"] > time.time():
+                    return
+            # only one of the processes sharing the outbox wins the rename
+            os.rename(path, claimed)
+            # the claim's age starts now, not when the record was written
+            os.utime(claimed)
+            with open(claimed) as f:
+                record = json.load(f)
+        except (OSError, ValueError, KeyError):
+            return
+        try:
+            response = self._client.post(record["url"], json=record["payload"])
+            status = response.status_code
+            error = None if response.is_success else f"HTTP {status}"
+        except httpx.HTTPError as e:
+            status, error = None, str(e)
+        if error is None:
+            logger.info(f"[+] Webhook sent {status}")
+            # counted first, so the stats are final once flush returns
+            self._count("delivered")
+            os.remove(claimed)
+            return
+        record["attempts"] += 1
+        permanent = (
+            status is not None and 400 <= status < 500 and status not in (408, 429)
+        )
+        if permanent or record["attempts"] >= self.max_attempts:
+            logger.error(f"Giving up on webhook to {record['url']}: {error}")
+            record["error"] = error
+            _write_record(claimed, record)
+            self._count("failed")
+            os.replace(
+                claimed, os.path.join(self.outbox, "failed", os.path.basename(path))
+            )
+            return
+        delay = backoff(record["attempts"])
+        logger.warning(
+            f"Webhook to {record['url']} failed ({error}), retry in {delay:.1f}s"
+        )
+        record["next_at"] = time.time() + delay
+        _write_record(claimed, record)
+        os.rename(claimed, path)
+        self._count("retried")
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def pending(self):
+        """Names of the records not delivered yet, claimed ones included."""
+        if not os.path.isdir(self.outbox):
+            return []
+        return sorted(
+            n for n in os.listdir(self.outbox) if n.endswith((".json", ".claimed"))
+        )
+
+    def flush(self, timeout=None):
+        """Wait until the outbox is empty; returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.pending():
+            if deadline is not None and time.time() > deadline:
+                return False
+            with self._lock:
+                self._idle.wait(0.1)
+        return True
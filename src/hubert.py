@@ -0,0 +1,236 @@
+"""HuBERT-base feature extractor that loads fairseq checkpoints without fairseq.
+
+Only what ``VC.pipeline`` needs is implemented: ``extract_features`` with an
+optional early exit after ``output_layer`` transformer layers, and
+``final_proj`` for v1 models. Parameter names follow fairseq, so the
+``model`` entry of ``hubert_base.pt`` loads as is.
+"""
+
+import pickle
+import types
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+
+class ConvFeatureExtractor(nn.Module):
+    # seven strided convolutions from 16 kHz samples to 50 Hz frames
+    def __init__(self, dim=512):
+        super().__init__()
+        self.conv_layers = nn.ModuleList()
+        self.shapes = [(10, 5)] + [(3, 2)] * 4 + [(2, 2)] * 2
+        for i, (k, stride) in enumerate(self.shapes):
+            block = [
+                nn.Conv1d(1 if i == 0 else dim, dim, k, stride, bias=False),
+                nn.Dropout(0.0),
+            ]
+            if i == 0:
+                block.append(nn.GroupNorm(dim, dim))
+            block.append(nn.GELU())
+            self.conv_layers.append(nn.Sequential(*block))
+
+    def output_lengths(self, lengths):
+        """Frames computed from ``lengths`` samples alone."""
+        for k, stride in self.shapes:
+            lengths = torch.div(lengths - k, stride, rounding_mode="floor") + 1
+        return lengths
+
+    def forward(self, x, lengths=None):
+        x = x.unsqueeze(1)
+        for block in self.conv_layers:
+            x = block[0](x)
+            if len(block) == 4:
+                # fairseq runs this group norm in fp32
+                norm = block[2]
+                if lengths is None:
+                    x = F.group_norm(
+                        x.float(),
+                        norm.num_groups,
+                        norm.weight.float(),
+                        norm.bias.float(),
+                        norm.eps,
+                    ).type_as(x)
+                else:
+                    k, stride = self.shapes[0]
+                    valid = torch.div(lengths - k, stride, rounding_mode="floor") + 1
+                    x = _masked_instance_norm(x, valid, norm).type_as(x)
+            x = F.gelu(x)
+        return x
+
+
+def _masked_instance_norm(x, lengths, norm):
+    # the group norm with one channel per group, over the first lengths frames
+    mask = (torch.arange(x.size(-1), device=x.device) < lengths[:, None])[:, None]
+    x = x.float()
+    n = lengths[:, None, None].float()
+    mean = (x * mask).sum(-1, keepdim=True) / n
+    var = ((x - mean) ** 2 * mask).sum(-1, keepdim=True) / n
+    x = (x - mean) * torch.rsqrt(var + norm.eps)
+    return x * norm.weight.float()[:, None] + norm.bias.float()[:, None]
+
+
+class SelfAttention(nn.Module):
+    def __init__(self, dim, n_heads):
+        super().__init__()
+        self.n_heads = n_heads
+        self.k_proj = nn.Linear(dim, dim)
+        self.v_proj = nn.Linear(dim, dim)
+        self.q_proj = nn.Linear(dim, dim)
+        self.out_proj = nn.Linear(dim, dim)
+
+    def forward(self, x, key_padding_mask=None):
+        b, t, c = x.shape
+        q, k, v = [
+            proj(x).view(b, t, self.n_heads, -1).transpose(1, 2)
+            for proj in (self.q_proj, self.k_proj, self.v_proj)
+        ]
+        attn_mask = None
+        if key_padding_mask is not None:
+            attn_mask = ~key_padding_mask[:, None, None, :]
+        x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+        return self.out_proj(x.transpose(1, 2).reshape(b, t, c))
+
+
+class EncoderLayer(nn.Module):
+    # post-norm transformer layer
+    def __init__(self, dim, ffn_dim, n_heads):
+        super().__init__()
+        self.self_attn = SelfAttention(dim, n_heads)
+        self.self_attn_layer_norm = nn.LayerNorm(dim)
+        self.fc1 = nn.Linear(dim, ffn_dim)
+        self.fc2 = nn.Linear(ffn_dim, dim)
+        self.final_layer_norm = nn.LayerNorm(dim)
+
+    def forward(self, x, key_padding_mask=None):
+        x = self.self_attn_layer_norm(x + self.self_attn(x, key_padding_mask))
+        return self.final_layer_norm(x + self.fc2(F.gelu(self.fc1(x))))
+
+
+class SamePad(nn.Module):
+    def __init__(self, kernel_size):
+        super().__init__()
+        self.remove = 1 if kernel_size % 2 == 0 else 0
+
+    def forward(self, x):
+        return x[:, :, : -self.remove] if self.remove else x
+
+
+class TransformerEncoder(nn.Module):
+    def __init__(self, n_layers, dim, ffn_dim, n_heads, pos_kernel=128, pos_groups=16):
+        super().__init__()
+        self.pos_conv = nn.Sequential(
+            nn.Conv1d(dim, dim, pos_kernel, padding=pos_kernel // 2, groups=pos_groups),
+            SamePad(pos_kernel),
+            nn.GELU(),
+        )
+        self.layer_norm = nn.LayerNorm(dim)
+        self.layers = nn.ModuleList(
+            [EncoderLayer(dim, ffn_dim, n_heads) for _ in range(n_layers)]
+        )
+
+    def forward(self, x, padding_mask=None, n_layers=None):
+        if padding_mask is not None:
+            x = x.masked_fill(padding_mask.unsqueeze(-1), 0)
+        x = x + self.pos_conv(x.transpose(1, 2)).transpose(1, 2)
+        x = self.layer_norm(x)
+        for layer in self.layers[:n_layers]:
+            x = layer(x, padding_mask)
+        return x
+
+
+class HubertBase(nn.Module):
+    def __init__(
+        self,
+        n_layers=12,
+        dim=768,
+        ffn_dim=3072,
+        n_heads=12,
+        final_dim=256,
+        conv_dim=512,
+    ):
+        super().__init__()
+        self.feature_extractor = ConvFeatureExtractor(conv_dim)
+        self.layer_norm = nn.LayerNorm(conv_dim)
+        self.post_extract_proj = nn.Linear(conv_dim, dim)
+        self.encoder = TransformerEncoder(n_layers, dim, ffn_dim, n_heads)
+        self.final_proj = nn.Linear(dim, final_dim)
+
+    def extract_features(self, source, padding_mask=None, output_layer=None):
+        """Return ``(features [B, T, dim], frame padding mask)`` like fairseq.
+
+        Only the first ``output_layer`` transformer layers are run. Padding
+        is taken to be at the end of each row. Unlike fairseq, each row of a
+        padded batch gets the features it would get alone: the group norm
+        only sees its samples, and a frame is padding if any of its samples
+        is.
+        """
+        lengths = None
+        if padding_mask is not None and padding_mask.any():
+            lengths = (~padding_mask).sum(-1)
+        x = self.feature_extractor(source, lengths)
+        x = self.layer_norm(x.transpose(1, 2))
+        padding_mask = None
+        if lengths is not None:
+            frames = self.feature_extractor.output_lengths(lengths)
+            padding_mask = torch.arange(x.size(1), device=x.device) >= frames[:, None]
+        x = self.post_extract_proj(x)
+        x = self.encoder(x, padding_mask, output_layer)
+        return x, padding_mask
+
+
+class _Stub:
+    # stands in for the fairseq and omegaconf objects pickled with the weights
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        self.__dict__["_state"] = state
+
+
+class _Unpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module.split(".")[0] in ("fairseq", "omegaconf"):
+            return type(name, (_Stub,), {"__module__": module})
+        return super().find_class(module, name)
+
+
+_stub_pickle = types.ModuleType("hubert_pickle")
+_stub_pickle.Unpickler = _Unpickler
+_stub_pickle.load = lambda f, **kwargs: _Unpickler(f, **kwargs).load()
+
+
+def load_hubert_base(model_path):
+    """Build a ``HubertBase`` from a fairseq HuBERT checkpoint."""
+    try:
+        cpt = torch.load(
+            model_path,
+            map_location="cpu",
+            pickle_module=_stub_pickle,
+            weights_only=False,
+        )
+    except TypeError:
+        # older PyTorch versions don't have the weights_only parameter
+        cpt = torch.load(model_path, map_location="cpu", pickle_module=_stub_pickle)
+    state = cpt["model"]
+
+    # fold the weight norm of the positional convolution
+    g = state.pop("encoder.pos_conv.0.weight_g")
+    v = state.pop("encoder.pos_conv.0.weight_v")
+    state["encoder.pos_conv.0.weight"] = v * (g / v.norm(dim=(0, 1), keepdim=True))
+
+    dim = state["post_extract_proj.weight"].shape[0]
+    model = HubertBase(
+        n_layers=len(
+            {k.split(".")[2] for k in state if k.startswith("encoder.layers.")}
+        ),
+        dim=dim,
+        ffn_dim=state["encoder.layers.0.fc1.weight"].shape[0],
+        n_heads=dim // 64,
+        final_dim=state["final_proj.weight"].shape[0],
+        conv_dim=state["layer_norm.weight"].shape[0],
+    )
+    missing, _ = model.load_state_dict(state, strict=False)
+    if missing:
+        raise ValueError(f"Incomplete HuBERT checkpoint {model_path}: {missing}")
+    return model
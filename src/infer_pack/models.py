@@ -370,6 +370,42 @@ class SineGen(torch.nn.Module):
             sine_waves = sine_waves * uv + noise
         return sine_waves, uv, noise
 
+    def infer(self, f0, upp):
+        """sine_tensor, uv = infer(f0, upp)
+        Inference-only variant of forward with a constant number of
+        audio-rate buffers. The phase is accumulated at frame rate in float64
+        and expanded to audio rate with a single multiply-add.
+        input F0: tensor(batchsize=1, length)
+        output sine_tensor: tensor(batchsize=1, length * upp, dim)
+        output uv: tensor(batchsize=1, length, 1), at frame rate
+        """
+        with torch.no_grad():
+            upp = int(upp)
+            # mps has no float64
+            acc = torch.float32 if f0.device.type == "mps" else torch.float64
+            f0 = f0.unsqueeze(-1)
+            harmonics = torch.arange(1, self.dim + 1, device=f0.device, dtype=acc)
+            rad = (f0.to(acc) * harmonics / self.sampling_rate) % 1  # cycles/sample
+            phase = torch.rand(f0.shape[0], self.dim, device=f0.device, dtype=acc)
+            phase[:, 0] = 0
+            frame_end = torch.cumsum(rad * upp, dim=1) + phase.unsqueeze(1)
+            frame_start = (frame_end - rad * upp) % 1
+
+            steps = torch.arange(1, upp + 1, device=f0.device, dtype=torch.float32)
+            sine_waves = torch.addcmul(
+                frame_start.float().unsqueeze(2),
+                rad.float().unsqueeze(2),
+                steps.view(1, 1, -1, 1),
+            )  # [b, length, upp, dim]
+            sine_waves.mul_(2 * np.pi).sin_()
+
+            uv = self._f02uv(f0).float()
+            noise_amp = uv * self.noise_std + (1 - uv) * self.sine_amp / 3
+            noise = torch.randn_like(sine_waves).mul_(noise_amp.unsqueeze(2))
+            sine_waves.mul_((uv * self.sine_amp).unsqueeze(2)).add_(noise)
+            del noise
+        return sine_waves.view(f0.shape[0], -1, self.dim), uv
+
 
 class SourceModuleHnNSF(torch.nn.Module):
     """SourceModule for hn-nsf
@@ -413,7 +449,10 @@ class SourceModuleHnNSF(torch.nn.Module):
         self.l_tanh = torch.nn.Tanh()
 
     def forward(self, x, upp=None):
-        sine_wavs, uv, _ = self.l_sin_gen(x, upp)
+        if self.training:
+            sine_wavs, uv, _ = self.l_sin_gen(x, upp)
+        else:
+            sine_wavs, uv = self.l_sin_gen.infer(x, upp)
         if self.is_half:
             sine_wavs = sine_wavs.half()
         sine_merge = self.l_tanh(self.l_linear(sine_wavs))
@@ -0,0 +1,302 @@
+"""Download and decode input audio at the same time.
+
+``fetch_audio`` asks for the first ``FIRST_PART_BYTES`` of the URL with a
+range request. If the server answers with ``206``, the rest of the file is
+split into ranges that are downloaded in parallel; otherwise the body is
+streamed in one request. Bytes are fed in order into an ffmpeg process that
+decodes to 16 kHz mono float32 as they arrive, so the network and the
+decoder overlap. The size limit is checked against the announced length
+before anything is downloaded, and the duration limit while decoding.
+
+Containers that ffmpeg cannot decode from a pipe (e.g. MP4 with the index at
+the end) are decoded again from the spooled copy of the download.
+"""
+
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+import httpx
+import numpy as np
+
+import tracing
+from my_utils import load_audio
+
+MAX_BYTES = int(os.getenv("RVC_INPUT_MAX_BYTES", str(200 << 20)))
+MAX_SECONDS = float(os.getenv("RVC_INPUT_MAX_SECONDS", "900"))
+PARTS = int(os.getenv("RVC_INPUT_PARTS", "4"))
+FIRST_PART_BYTES = 1 << 20
+MIN_PART_BYTES = 1 << 20
+CHUNK_BYTES = 64 << 10
+# downloaded bytes each range may hold ahead of the decoder
+BUFFER_BYTES = 4 << 20
+RETRIES = 3
+
+FetchedAudio = namedtuple("FetchedAudio", ["path", "audio", "sha256"])
+
+
+def _client():
+    return httpx.Client(
+        follow_redirects=True, timeout=httpx.Timeout(30.0, connect=10.0)
+    )
+
+
+def _total_size(response):
+    total = response.headers.get("content-range", "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def _put(out, item, stop):
+    # blocks while the decoder is behind, gives up once the fetch is stopped
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _stream_range(client, url, start, end, validator, out, stop, response=None):
+    """Put the bytes ``start..end`` of ``url`` on ``out``, resuming after drops.
+
+    Ends with ``None`` on success or the exception on failure. A range whose
+    queue is full waits, so its connection can sit idle and be dropped; only
+    attempts that made no progress count towards ``RETRIES``.
+    """
+    pos = start
+    try:
+        failures = 0
+        while failures < RETRIES:
+            resumed_at = pos
+            if response is None:
+                headers = {"Range": f"bytes={pos}-{end}"}
+                if validator:
+                    # fail instead of mixing two versions of the file
+                    headers["If-Range"] = validator
+                response = client.send(
+                    client.build_request("GET", url, headers=headers), stream=True
+                )
+            try:
+                if response.status_code != 206:
+                    raise RuntimeError(
+                        f"Range request failed with status {response.status_code}"
+                    )
+                for chunk in response.iter_bytes(CHUNK_BYTES):
+                    chunk = chunk[: end + 1 - pos]
+                    if not _put(out, chunk, stop):
+                        return
+                    pos += len(chunk)
+            except httpx.TransportError:
+                pass
+            finally:
+                response.close()
+                response = None
+            if pos > end:
+                _put(out, None, stop)
+                return
+            if pos == resumed_at:
+                failures += 1
+                time.sleep(0.5 * 2**failures)
+            else:
+                failures = 0
+        raise RuntimeError(f"Download truncated at byte {pos} of {end + 1}")
+    except Exception as e:
+        _put(out, e, stop)
+
+
+def _drain(source):
+    while True:
+        item = source.get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+class _Decoder:
+    """ffmpeg reading the input from stdin, with its output read on a thread."""
+
+    def __init__(self, sr, max_samples):
+        self.max_samples = max_samples
+        self.too_long = False
+        self._out = []
+        self._err = []
+        self._proc = (
+            ffmpeg.input("pipe:", threads=0)
+            .output("-", format="f32le", acodec="pcm_f32le", ac=1, ar=sr)
+            .global_args("-loglevel", "error")
+            .run_async(pipe_stdin=True, pipe_stdout=True, pipe_stderr=True)
+        )
+        self._threads = [
+            threading.Thread(target=self._read_stdout, daemon=True),
+            threading.Thread(
+                target=lambda: self._err.append(self._proc.stderr.read()),
+                daemon=True,
+            ),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _read_stdout(self):
+        samples = 0
+        for data in iter(lambda: self._proc.stdout.read(CHUNK_BYTES), b""):
+            self._out.append(data)
+            samples += len(data) // 4
+            if samples > self.max_samples:
+                self.too_long = True
+                self._proc.kill()
+                return
+
+    def write(self, data):
+        """Feed ``data``; returns False once ffmpeg stopped reading."""
+        try:
+            self._proc.stdin.write(data)
+            return True
+        except (BrokenPipeError, ValueError):
+            return False
+
+    def finish(self):
+        """Return the decoded audio, or None if ffmpeg failed."""
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        for t in self._threads:
+            t.join()
+        if self._proc.wait() != 0:
+            return None
+        return np.frombuffer(b"".join(self._out), np.float32)
+
+    def kill(self):
+        self._proc.kill()
+        self.finish()
+
+
+def fetch_audio(
+    url, sr=16000, max_bytes=None, max_seconds=None, parts=None, directory=None
+):
+    """Download ``url`` and decode it to mono float32 at ``sr``.
+
+    Returns ``FetchedAudio(path, audio, sha256)``: a temporary copy of the
+    downloaded file in ``directory`` (the caller removes it), the samples and
+    the SHA-256 of the downloaded bytes. Raises ``ValueError`` if the input
+    exceeds ``max_bytes`` or ``max_seconds``.
+    """
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    max_seconds = MAX_SECONDS if max_seconds is None else max_seconds
+    parts = PARTS if parts is None else parts
+    extension = os.path.splitext(urllib.parse.urlparse(url).path)[1] or ".wav"
+    spool = tempfile.NamedTemporaryFile(suffix=extension, dir=directory, delete=False)
+    stop = threading.Event()
+    client = _client()
+    pool = ThreadPoolExecutor(parts + 1)
+    decoder = None
+    try:
+        with tracing.span("download") as download:
+            first = client.send(
+                client.build_request(
+                    "GET", url, headers={"Range": f"bytes=0-{FIRST_PART_BYTES - 1}"}
+                ),
+                stream=True,
+            )
+            first.raise_for_status()
+            if first.status_code == 206 and _total_size(first) is None:
+                # a range of unknown total length: fall back to one request
+                first.close()
+                first = client.send(client.build_request("GET", url), stream=True)
+                first.raise_for_status()
+            if first.status_code == 206:
+                size = _total_size(first)
+            else:
+                size = first.headers.get("content-length")
+                size = int(size) if size and size.isdigit() else None
+            if size is not None and size > max_bytes:
+                first.close()
+                raise ValueError(
+                    f"Input audio is {size} bytes, the limit is {max_bytes}"
+                )
+
+            if first.status_code == 206:
+                validator = first.headers.get("etag") or first.headers.get(
+                    "last-modified"
+                )
+                bounds = [(0, min(size, FIRST_PART_BYTES) - 1)]
+                rest = size - FIRST_PART_BYTES
+                if rest > 0:
+                    n = max(1, min(parts, rest // MIN_PART_BYTES))
+                    edges = [FIRST_PART_BYTES + rest * i // n for i in range(n + 1)]
+                    bounds += [(a, b - 1) for a, b in zip(edges, edges[1:])]
+                sources = []
+                for i, (start, end) in enumerate(bounds):
+                    source = queue.Queue(max(1, BUFFER_BYTES // CHUNK_BYTES))
+                    pool.submit(
+                        _stream_range,
+                        client,
+                        url,
+                        start,
+                        end,
+                        validator,
+                        source,
+                        stop,
+                        first if i == 0 else None,
+                    )
+                    sources.append(source)
+                chunks = (chunk for source in sources for chunk in _drain(source))
+                ranges = len(bounds)
+            else:
+                # no range support: one streamed request
+                chunks = first.iter_bytes(CHUNK_BYTES)
+                ranges = 0
+
+            decoder = _Decoder(sr, int(max_seconds * sr))
+            digest = hashlib.sha256()
+            received = 0
+            piped = True
+            for chunk in chunks:
+                received += len(chunk)
+                if received > max_bytes:
+                    raise ValueError(
+                        f"Input audio exceeds the limit of {max_bytes} bytes"
+                    )
+                digest.update(chunk)
+                spool.write(chunk)
+                if piped:
+                    piped = decoder.write(chunk)
+                if decoder.too_long:
+                    break
+            first.close()
+            spool.close()
+            download.set(bytes=received, ranges=ranges)
+        # the rest of the decoding, after the last byte arrived
+        with tracing.span("decode", piped=piped):
+            audio = decoder.finish()
+            if decoder.too_long:
+                raise ValueError(f"Input audio is longer than {max_seconds} seconds")
+            if audio is None:
+                # not decodable from a pipe, try again with a seekable file
+                audio = load_audio(spool.name, sr)
+                if len(audio) > max_seconds * sr:
+                    raise ValueError(
+                        f"Input audio is longer than {max_seconds} seconds"
+                    )
+        return FetchedAudio(spool.name, audio, digest.hexdigest())
+    except BaseException:
+        stop.set()
+        if decoder is not None:
+            decoder.kill()
+        spool.close()
+        os.remove(spool.name)
+        raise
+    finally:
+        # closing the client first unblocks range downloads still waiting
+        client.close()
+        pool.shutdown(wait=True)
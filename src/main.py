@@ -1,13 +1,13 @@
+import argparse
+import json
 import os
-import shutil
-import sys
-import urllib.parse
-import urllib.request
-import zipfile
+from collections import Counter
 
 import torch
 
-from rvc import Config, get_vc, load_hubert, rvc_infer
+import model_fetcher
+import profiling
+from rvc import get_config, get_vc, load_hubert, rvc_infer
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 rvc_models_dir = os.path.join(BASE_DIR, "rvc_models")
@@ -25,42 +25,19 @@ if device != "cpu":
 
 
 def download_online_model(url, dir_name, overwrite=False):
-    try:
-        # Parse the URL and extract the filename
-        parsed_url = urllib.parse.urlparse(url)
-        zip_name = os.path.basename(parsed_url.path)
-
-        # Remove any query parameters from the filename
-        zip_name = zip_name.split("?")[0]
+    """Fetch the model zip at ``url`` into ``rvc_models/dir_name``.
 
-        extraction_folder = os.path.join(rvc_models_dir, dir_name)
-        if os.path.exists(extraction_folder):
-            if overwrite:
-                print(
-                    f"[!] Voice model directory {dir_name} already exists. Overwriting..."
-                )
-                shutil.rmtree(extraction_folder)
-            else:
-                print(
-                    f"[!] Voice model directory {dir_name} already exists. Using existing model."
-                )
-                return f"[+] Using existing model: {dir_name}"
-
-        # Download the file
-        print(f"[*] Downloading model from {url}...")
-        urllib.request.urlretrieve(url, zip_name)
-
-        # Extract the zip file
-        print(f"[*] Extracting model to {extraction_folder}...")
-        with zipfile.ZipFile(zip_name, "r") as zip_ref:
-            zip_ref.extractall(extraction_folder)
-
-        # Remove the zip file
-        os.remove(zip_name)
-
-        return f"[+] {dir_name} Model successfully downloaded and extracted!"
+    An existing folder is reused; with ``overwrite`` it is revalidated against
+    ``url`` and replaced only if the remote file changed.
+    """
+    try:
+        status = model_fetcher.fetch_model(url, dir_name, revalidate=overwrite)
     except Exception as e:
         raise Exception(f"Error downloading model: {str(e)}")
+    if status == "downloaded":
+        return f"[+] {dir_name} Model successfully downloaded and extracted!"
+    print(f"[!] Voice model directory {dir_name} is up to date. Using existing model.")
+    return f"[+] Using existing model: {dir_name}"
 
 
 def get_rvc_model(voice_model):
@@ -81,23 +58,48 @@ def voice_conversion(
     filter_radius=3,
     rms_mix_rate=0.25,
     protect=0.33,
+    skip_silence=False,
+    audio=None,
+    output_format="wav",
+    output_path=None,
+    profile=False,
+    registry=None,
+    stats=None,
 ):
+    """Convert ``input_audio`` and return the output path.
+
+    ``audio`` may hold ``input_audio`` already decoded to 16 kHz mono float32.
+    ``output_format`` is ``wav``, ``mp3``, ``opus`` or ``flac``. Without
+    ``output_path`` the output goes to ``voice_output/converted_<input>``;
+    concurrent jobs should pass a path of their own. With ``profile`` a
+    profiler capture is written to ``profiling.profile_dir(output_path)``.
+    With ``registry``, a ``worker_pool.ModelRegistry``, the models loaded by
+    previous calls are reused instead of loaded again. A ``stats`` dict
+    receives the statistics of the conversion, e.g. ``skipped_ratio``, the
+    fraction of the input skipped as silence.
+    """
     try:
-        hubert_model = load_hubert(
-            device, is_half, os.path.join(rvc_models_dir, "hubert_base.pt")
-        )
-        model_path = get_rvc_model(rvc_model)
-        cpt, version, net_g, tgt_sr, vc = get_vc(
-            device, is_half, Config(device, is_half), model_path
-        )
+        if registry is not None:
+            hubert_model = registry.hubert()
+            cpt, version, net_g, tgt_sr, vc = registry.get(rvc_model)
+        else:
+            hubert_model = load_hubert(
+                device, is_half, os.path.join(rvc_models_dir, "hubert_base.pt")
+            )
+            model_path = get_rvc_model(rvc_model)
+            cpt, version, net_g, tgt_sr, vc = get_vc(
+                device, is_half, get_config(device, is_half), model_path
+            )
 
-        output_filename = os.path.join(
-            output_dir, f"converted_{os.path.basename(input_audio)}"
-        )
-        output_filename = os.path.splitext(output_filename)[0] + ".wav"
-        os.makedirs(output_dir, exist_ok=True)
+        output_filename = output_path
+        if output_filename is None:
+            output_filename = os.path.join(
+                output_dir, f"converted_{os.path.basename(input_audio)}"
+            )
+            output_filename = os.path.splitext(output_filename)[0] + "." + output_format
+            os.makedirs(output_dir, exist_ok=True)
 
-        rvc_infer(
+        infer_stats = rvc_infer(
             "",
             index_rate,
             input_audio,
@@ -114,57 +116,167 @@ def voice_conversion(
             160,
             vc,
             hubert_model,
+            skip_silence=skip_silence,
+            audio=audio,
+            profile_dir=profiling.profile_dir(output_filename) if profile else None,
         )
+        if stats is not None:
+            stats.update(infer_stats)
 
         return output_filename
     except Exception as e:
         raise Exception(f"Voice conversion failed: {str(e)}")
 
 
-def print_example_usage():
-    print("\nUsage:")
-    print(
-        "python main.py <input_audio> <rvc_model> [pitch] [f0_method] [index_rate] [filter_radius] [rms_mix_rate] [protect]"
-    )
-    print("\nRequired arguments:")
-    print("  input_audio: path to input audio file")
-    print("  rvc_model: name of the RVC model to use")
-    print("\nOptional arguments:")
-    print("  pitch: pitch shift (default: 0)")
-    print("  f0_method: pitch extraction method (default: 'rmvpe')")
-    print("  index_rate: index rate (default: 0.5)")
-    print("  filter_radius: filter radius (default: 3)")
-    print("  rms_mix_rate: RMS mix rate (default: 0.25)")
-    print("  protect: protect rate (default: 0.33)")
+def load_manifest(path, output_dir=output_dir):
+    """Read a JSONL manifest of conversion jobs.
 
+    Each line has ``input_audio`` and ``rvc_model`` and optionally ``id``,
+    ``pitch``, ``f0_method``, ``index_rate``, ``filter_radius``,
+    ``rms_mix_rate``, ``protect``, ``skip_silence``, ``output_format`` and
+    ``output_path`` (default ``<output_dir>/<rvc_model>/<input name>.<format>``).
+    """
+    jobs = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            job.setdefault("id", line_no)
+            if "output_path" not in job:
+                name = os.path.splitext(os.path.basename(job["input_audio"]))[0]
+                job["output_path"] = os.path.join(
+                    output_dir,
+                    job["rvc_model"],
+                    f"{name}.{job.get('output_format', 'wav')}",
+                )
+            jobs.append(job)
+    outputs = Counter(job["output_path"] for job in jobs)
+    duplicates = [path for path, n in outputs.items() if n > 1]
+    if duplicates:
+        raise ValueError(f"Several jobs write to {duplicates[0]}, set output_path")
+    return jobs
 
-if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Error: Insufficient arguments.")
-        print_example_usage()
-        sys.exit(1)
 
-    try:
-        input_audio = sys.argv[1]
-        rvc_model = sys.argv[2]
-        pitch = int(sys.argv[3]) if len(sys.argv) > 3 else 0
-        f0_method = sys.argv[4] if len(sys.argv) > 4 else "rmvpe"
-        index_rate = float(sys.argv[5]) if len(sys.argv) > 5 else 0.5
-        filter_radius = int(sys.argv[6]) if len(sys.argv) > 6 else 3
-        rms_mix_rate = float(sys.argv[7]) if len(sys.argv) > 7 else 0.25
-        protect = float(sys.argv[8]) if len(sys.argv) > 8 else 0.33
-
-        output_path = voice_conversion(
-            input_audio,
-            rvc_model,
-            pitch,
-            f0_method,
-            index_rate,
-            filter_radius,
-            rms_mix_rate,
-            protect,
+def run_batch(
+    manifest,
+    results_path=None,
+    output_dir=output_dir,
+    workers=None,
+    threads=None,
+    overwrite=False,
+):
+    """Convert every job of ``manifest`` on a worker pool.
+
+    The voice models of the batch are loaded in the parent before the
+    workers start, so the workers share their weights. Jobs are grouped by
+    voice model. Jobs whose output already exists are skipped, which
+    makes an interrupted batch resumable. A line per job, with its status and
+    timing, is appended to ``results_path`` as it completes.
+    """
+    from worker_pool import ModelRegistry, WorkerPool
+
+    jobs = load_manifest(manifest, output_dir)
+    results_path = results_path or os.path.splitext(manifest)[0] + ".results.jsonl"
+    pending = []
+    with open(results_path, "a") as results:
+        for job in jobs:
+            if not overwrite and os.path.exists(job["output_path"]):
+                result = {"id": job["id"], "status": "skipped"}
+                result["output_path"] = job["output_path"]
+                results.write(json.dumps(result) + "\n")
+            else:
+                pending.append(job)
+        print(f"[*] {len(pending)} jobs to convert, {len(jobs) - len(pending)} done")
+        if not pending:
+            return
+
+        # stable sort: the jobs of a model stay in manifest order
+        pending.sort(key=lambda job: job["rvc_model"])
+        counts = Counter(job["rvc_model"] for job in pending)
+        registry = ModelRegistry(device, is_half)
+        pool = WorkerPool(registry, workers, threads)
+        # loaded before the fork, with segments sized for the pool, so every
+        # worker shares these weights instead of loading its own copy
+        for rvc_model in counts:
+            try:
+                registry.get(rvc_model)
+            except Exception as e:
+                # its jobs fail in the workers with the same error
+                print(f"[!] Could not load {rvc_model}: {e}")
+        failed = 0
+        with pool:
+            chunksize = max(1, min(counts.values()) // pool.processes)
+            for n, result in enumerate(pool.map(pending, chunksize), 1):
+                result["status"] = "error" if "error" in result else "done"
+                failed += result["status"] == "error"
+                results.write(json.dumps(result) + "\n")
+                results.flush()
+                print(
+                    f"[{n}/{len(pending)}] job {result['id']} {result['status']} "
+                    f"in {result['seconds']:.1f} s"
+                )
+    print(f"[+] Results written to {results_path}, {failed} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a voice with an RVC model, or a batch of jobs."
+    )
+    parser.add_argument("input_audio", nargs="?", help="path to input audio file")
+    parser.add_argument("rvc_model", nargs="?", help="name of the RVC model to use")
+    parser.add_argument("pitch", nargs="?", type=int, default=0)
+    parser.add_argument("f0_method", nargs="?", default="rmvpe")
+    parser.add_argument("index_rate", nargs="?", type=float, default=0.5)
+    parser.add_argument("filter_radius", nargs="?", type=int, default=3)
+    parser.add_argument("rms_mix_rate", nargs="?", type=float, default=0.25)
+    parser.add_argument("protect", nargs="?", type=float, default=0.33)
+    parser.add_argument(
+        "--output-format", default="wav", choices=["wav", "mp3", "opus", "flac"]
+    )
+    parser.add_argument("--batch", metavar="MANIFEST", help="JSONL manifest of jobs")
+    parser.add_argument(
+        "--results", help="results manifest (default: <manifest>.results.jsonl)"
+    )
+    parser.add_argument(
+        "--output-dir", default=output_dir, help="output folder of --batch jobs"
+    )
+    parser.add_argument("--workers", type=int, help="worker processes")
+    parser.add_argument("--threads", type=int, help="threads per worker")
+    parser.add_argument(
+        "--overwrite", action="store_true", help="convert jobs whose output exists"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="write a profiler capture"
+    )
+    args = parser.parse_args()
+
+    if args.batch:
+        run_batch(
+            args.batch,
+            args.results,
+            args.output_dir,
+            args.workers,
+            args.threads,
+            args.overwrite,
         )
-        print(f"Converted audio saved to: {output_path}")
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        print_example_usage()
+        return
+    if args.rvc_model is None:
+        parser.error("input_audio and rvc_model are required without --batch")
+    output_path = voice_conversion(
+        args.input_audio,
+        args.rvc_model,
+        pitch=args.pitch,
+        f0_method=args.f0_method,
+        index_rate=args.index_rate,
+        filter_radius=args.filter_radius,
+        rms_mix_rate=args.rms_mix_rate,
+        protect=args.protect,
+        output_format=args.output_format,
+        profile=args.profile,
+    )
+    print(f"Converted audio saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Prometheus metrics of the serving worker.
+
+Counters, gauges and histograms are kept in one registry per process and
+rendered in the Prometheus text format by ``exposition``. With
+``RVC_METRICS_PORT`` set, ``rp_handler.py`` and ``webui.py`` serve them on
+``http://<host>:<port>/metrics``.
+
+Stage latencies, request counts and the real-time factor are taken from the
+spans of ``tracing`` when they end, so they need ``RVC_TRACE`` left on.
+Cache hits, misses and evictions are read from the ``stats`` of every
+``ModelRegistry`` and ``ResultCache`` of the process at scrape time.
+Updating a metric is a dict update under a lock, cheap enough to keep on
+under full load.
+"""
+
+import bisect
+import os
+import resource
+import sys
+import threading
+import weakref
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tracing
+
+PORT = int(os.getenv("RVC_METRICS_PORT", "0"))
+
+_metrics = []
+_caches = []
+_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def samples(self):
+        """``(suffix, label names, label values, value)`` of every series."""
+        with self._lock:
+            values = dict(self._values)
+        return [("", self.labels, k, v) for k, v in sorted(values.items())]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class CallbackGauge(_Metric):
+    """A gauge whose value is returned by ``fn`` when it is scraped."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, fn):
+        super().__init__(name, documentation)
+        self.fn = fn
+
+    def samples(self):
+        return [("", (), (), self.fn())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # a count per bucket plus +Inf, then the sum
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {k: list(v) for k, v in self._values.items()}
+        out = []
+        names = self.labels + ("le",)
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), series):
+                cumulative += n
+                le = bound if bound == "+Inf" else repr(float(bound))
+                out.append(("_bucket", names, key + (le,), cumulative))
+            out.append(("_sum", self.labels, key, series[-1]))
+            out.append(("_count", self.labels, key, cumulative))
+        return out
+
+
+def watch_cache(name, cache):
+    """Report the ``stats`` hits, misses and evictions of ``cache``."""
+    with _lock:
+        _caches.append((name, weakref.ref(cache)))
+
+
+def _cache_samples():
+    totals = {}
+    with _lock:
+        _caches[:] = [(n, ref) for n, ref in _caches if ref() is not None]
+        caches = [(n, ref()) for n, ref in _caches]
+    for name, cache in caches:
+        for stat, value in cache.stats.items():
+            totals[stat, name] = totals.get((stat, name), 0) + value
+    return totals
+
+
+def exposition():
+    """All metrics in the Prometheus text format, version 0.0.4."""
+    lines = []
+    with _lock:
+        metrics = list(_metrics)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, names, values, value in metric.samples():
+            lines.append(f"{metric.name}{suffix}{_labels(names, values)} {value}")
+    totals = _cache_samples()
+    for stat in ("hits", "misses", "evictions"):
+        name = f"rvc_cache_{stat}_total"
+        lines.append(f"# HELP {name} Cache {stat} per cache")
+        lines.append(f"# TYPE {name} counter")
+        for (s, cache), value in sorted(totals.items()):
+            if s == stat:
+                lines.append(f'{name}{{cache="{_escape(cache)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+requests_total = Counter(
+    "rvc_requests_total", "Requests handled", ("f0_method", "status")
+)
+requests_in_progress = Gauge("rvc_requests_in_progress", "Requests being handled")
+stage_seconds = Histogram(
+    "rvc_stage_seconds",
+    "Duration of each stage of a request",
+    ("stage", "f0_method"),
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300),
+)
+real_time_factor = Histogram(
+    "rvc_real_time_factor",
+    "Conversion seconds per second of input audio",
+    ("f0_method",),
+    (0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10),
+)
+audio_seconds_total = Counter(
+    "rvc_audio_seconds_total", "Seconds of input audio converted", ("f0_method",)
+)
+job_peak_rss_bytes = Histogram(
+    "rvc_job_peak_rss_bytes",
+    "Peak resident memory of the process during a job",
+    buckets=[2**i for i in range(28, 37)],
+)
+job_peak_device_memory_bytes = Histogram(
+    "rvc_job_peak_device_memory_bytes",
+    "Peak CUDA memory allocated during a job",
+    buckets=[2**i for i in range(28, 37)],
+)
+
+
+def _on_span(s):
+    attributes = {**s.trace_attributes, **s.attributes}
+    f0_method = attributes.get("f0_method", "")
+    stage_seconds.observe(s.seconds, stage=s.name, f0_method=f0_method)
+    if s.name == "request":
+        failed = s.error is not None or attributes.get("failed")
+        requests_total.inc(f0_method=f0_method, status="error" if failed else "ok")
+    elif s.name == "convert" and s.error is None and attributes.get("audio_seconds"):
+        audio_seconds = attributes["audio_seconds"]
+        real_time_factor.observe(s.seconds / audio_seconds, f0_method=f0_method)
+        audio_seconds_total.inc(audio_seconds, f0_method=f0_method)
+
+
+tracing.add_listener(_on_span)
+
+
+def _cuda():
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        return torch.cuda
+    return None
+
+
+def _reset_peak_rss():
+    try:
+        # "5" resets the peak RSS (VmHWM) of the process, Linux only
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def track_job():
+    """Count the enclosed job as in progress and record its memory peaks.
+
+    The peaks are those of the whole process, so with concurrent jobs in one
+    process they include the memory of the others.
+    """
+    requests_in_progress.inc()
+    _reset_peak_rss()
+    cuda = _cuda()
+    if cuda is not None:
+        cuda.reset_peak_memory_stats()
+    try:
+        yield
+    finally:
+        requests_in_progress.dec()
+        job_peak_rss_bytes.observe(_peak_rss())
+        if cuda is not None:
+            job_peak_device_memory_bytes.observe(cuda.max_memory_allocated())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port=PORT, addr="0.0.0.0"):
+    """Serve ``/metrics`` on ``port`` from a background thread."""
+    server = ThreadingHTTPServer((addr, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{addr}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,194 @@
+"""Inference artifacts for voice models.
+
+A training checkpoint (``.pth``) holds the posterior encoder, weight-norm
+parameters and pickled Python objects. ``prepare`` converts it once into
+``<name>.<fp16|fp32>.safetensors`` next to it. The artifact holds only the
+inference weights in the target dtype, with weight norm removed, and a
+metadata header with the model config and a hash of the source checkpoint.
+``load_artifact`` copies a weightless (meta device) skeleton of the model,
+kept per architecture, and assigns the memory-mapped tensors to it, so
+switching voices neither initializes weights nor unpickles a checkpoint.
+
+    python src/model_artifacts.py rvc_models/Obama --dtype fp16 fp32
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import threading
+
+import torch
+
+from infer_pack.models import (
+    SynthesizerTrnMs256NSFsid,
+    SynthesizerTrnMs256NSFsid_nono,
+    SynthesizerTrnMs768NSFsid,
+    SynthesizerTrnMs768NSFsid_nono,
+)
+
+FORMAT = "rvc-infer-1"
+
+# weightless model skeletons per architecture, copied for every load
+_skeletons = {}
+_skeletons_lock = threading.Lock()
+
+
+def load_checkpoint(model_path):
+    try:
+        # First try with weights_only=False for PyTorch 2.6+ compatibility
+        cpt = torch.load(model_path, map_location="cpu", weights_only=False)
+    except TypeError:
+        # Fall back to default for older PyTorch versions that don't have weights_only parameter
+        cpt = torch.load(model_path, map_location="cpu")
+
+    if "config" not in cpt or "weight" not in cpt:
+        raise ValueError(
+            f"Incorrect format for {model_path}. Use a voice model trained using RVC v2 instead."
+        )
+    cpt["config"][-3] = cpt["weight"]["emb_g.weight"].shape[0]
+    return cpt
+
+
+def build_synthesizer(cpt, is_half):
+    """Instantiate the synthesizer for ``cpt`` without the posterior encoder."""
+    if_f0 = cpt.get("f0", 1)
+    version = cpt.get("version", "v1")
+    if version == "v1":
+        if if_f0 == 1:
+            net_g = SynthesizerTrnMs256NSFsid(*cpt["config"], is_half=is_half)
+        else:
+            net_g = SynthesizerTrnMs256NSFsid_nono(*cpt["config"])
+    elif version == "v2":
+        if if_f0 == 1:
+            net_g = SynthesizerTrnMs768NSFsid(*cpt["config"], is_half=is_half)
+        else:
+            net_g = SynthesizerTrnMs768NSFsid_nono(*cpt["config"])
+    else:
+        raise ValueError(f"Unknown model version {version}")
+    del net_g.enc_q
+    return net_g
+
+
+def _strip_weight_norm(net_g):
+    net_g.dec.remove_weight_norm()
+    net_g.flow.remove_weight_norm()
+
+
+def artifact_path(model_path, is_half):
+    stem = os.path.splitext(model_path)[0]
+    return "%s.%s.safetensors" % (stem, "fp16" if is_half else "fp32")
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def prepare(model_path, is_half, force=False):
+    """Write the inference artifact for ``model_path`` and return its path."""
+    from safetensors.torch import save_file
+
+    out_path = artifact_path(model_path, is_half)
+    if not force and find_artifact(model_path, is_half):
+        return out_path
+    cpt = load_checkpoint(model_path)
+    net_g = build_synthesizer(cpt, is_half)
+    net_g.load_state_dict(cpt["weight"], strict=False)
+    _strip_weight_norm(net_g)
+    net_g = net_g.half() if is_half else net_g.float()
+
+    st = os.stat(model_path)
+    metadata = {
+        "format": FORMAT,
+        "config": json.dumps(cpt["config"]),
+        "f0": str(cpt.get("f0", 1)),
+        "version": cpt.get("version", "v1"),
+        "dtype": "fp16" if is_half else "fp32",
+        "sha256": file_sha256(model_path),
+        "source_size": str(st.st_size),
+        "source_mtime_ns": str(st.st_mtime_ns),
+    }
+    state = {k: v.contiguous() for k, v in net_g.state_dict().items()}
+    tmp = "%s.%d.tmp" % (out_path, os.getpid())
+    save_file(state, tmp, metadata=metadata)
+    os.replace(tmp, out_path)
+    return out_path
+
+
+def read_metadata(path):
+    from safetensors import safe_open
+
+    with safe_open(path, framework="pt") as f:
+        return f.metadata() or {}
+
+
+def find_artifact(model_path, is_half):
+    """Return the artifact path if it exists and matches ``model_path``."""
+    path = artifact_path(model_path, is_half)
+    try:
+        meta = read_metadata(path)
+        st = os.stat(model_path)
+    except Exception:
+        return None
+    if (
+        meta.get("format") != FORMAT
+        or meta.get("source_size") != str(st.st_size)
+        or meta.get("source_mtime_ns") != str(st.st_mtime_ns)
+    ):
+        return None
+    return path
+
+
+def load_artifact(path):
+    """Return ``(cpt, net_g)`` where ``cpt`` has the checkpoint metadata only."""
+    from safetensors.torch import load_file
+
+    meta = read_metadata(path)
+    cpt = {
+        "config": json.loads(meta["config"]),
+        "f0": int(meta["f0"]),
+        "version": meta["version"],
+        "sha256": meta["sha256"],
+    }
+    key = (meta["config"], meta["f0"], meta["version"], meta["dtype"])
+    with _skeletons_lock:
+        if key not in _skeletons:
+            # built once on CPU: constructing on the meta device is slower
+            skeleton = build_synthesizer(cpt, meta["dtype"] == "fp16")
+            _strip_weight_norm(skeleton)
+            _skeletons[key] = skeleton.to("meta")
+        net_g = copy.deepcopy(_skeletons[key])
+    net_g.load_state_dict(load_file(path), assign=True)
+    return cpt, net_g
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("paths", nargs="+", help=".pth files or model folders")
+    parser.add_argument(
+        "--dtype", nargs="+", choices=["fp16", "fp32"], default=["fp16", "fp32"]
+    )
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if os.path.isdir(path):
+            pths = [
+                os.path.join(path, f) for f in os.listdir(path) if f.endswith(".pth")
+            ]
+        else:
+            pths = [path]
+        for pth in sorted(pths):
+            for dtype in args.dtype:
+                print(prepare(pth, dtype == "fp16", force=args.force))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Download voice models from URLs into ``rvc_models``.
+
+``fetch_model`` is safe to call from concurrent handlers and workers:
+
+-   one fetch per model folder at a time, across threads and processes
+    (a lock file under ``rvc_models/.downloads``)
+-   the URL, ETag and Last-Modified of a fetched model are kept in its
+    ``.source.json``; repeat requests reuse the folder, and after
+    ``RVC_MODEL_REVALIDATE_SECONDS`` a conditional request checks it without
+    downloading unless the remote file changed
+-   interrupted downloads resume with a ranged request
+-   only the ``.pth`` and ``.index`` members are extracted, into a temporary
+    folder that is swapped with the model folder in one rename, so readers
+    always find a complete folder
+"""
+
+import ctypes
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+import zipfile
+
+import httpx
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+rvc_models_dir = os.path.join(BASE_DIR, "rvc_models")
+
+SOURCE_FILE = ".source.json"
+REVALIDATE_SECONDS = float(os.getenv("RVC_MODEL_REVALIDATE_SECONDS", "3600"))
+RETRIES = 3
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+try:
+    _libc = ctypes.CDLL("libc.so.6", use_errno=True)
+    _renameat2 = _libc.renameat2
+except (OSError, AttributeError):
+    _renameat2 = None
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+class _ModelLock:
+    # per model folder: a threading lock plus an fcntl lock file
+    def __init__(self, name):
+        with _locks_lock:
+            self._lock = _locks.setdefault(name, threading.Lock())
+        lock_dir = os.path.join(rvc_models_dir, ".downloads")
+        os.makedirs(lock_dir, exist_ok=True)
+        self._path = os.path.join(lock_dir, name + ".lock")
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._file = open(self._path, "w")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._lock.release()
+
+
+def _validators(headers):
+    return {
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+    }
+
+
+def _not_modified(client, url, source):
+    headers = {}
+    if source.get("etag"):
+        headers["If-None-Match"] = source["etag"]
+    if source.get("last_modified"):
+        headers["If-Modified-Since"] = source["last_modified"]
+    if not headers:
+        return False
+    # a HEAD request is enough to revalidate, and downloads nothing either way
+    response = client.head(url, headers=headers)
+    if response.status_code == 304:
+        return True
+    response.raise_for_status()
+    validators = _validators(response.headers)
+    return any(
+        validators[k] and validators[k] == source.get(k)
+        for k in ("etag", "last_modified")
+    )
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def download(client, url, path):
+    """Download ``url`` to ``path``, resuming from ``path + ".part"``.
+
+    A part that turns out to be complete (416 with its size as the total) is
+    used as it is, one that does not match the remote file any more is
+    downloaded again. Returns the ETag and Last-Modified of the downloaded
+    file.
+    """
+    part = path + ".part"
+    meta_path = part + ".json"
+    for attempt in range(RETRIES):
+        meta = _read_json(meta_path) or {}
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {}
+        if offset and meta.get("url") == url:
+            headers["Range"] = f"bytes={offset}-"
+            if meta.get("etag") or meta.get("last_modified"):
+                # only resume if the remote file is still the same one
+                headers["If-Range"] = meta.get("etag") or meta["last_modified"]
+        try:
+            with client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 416 and "Range" in headers:
+                    # nothing after the part: complete, e.g. interrupted
+                    # before the rename, or longer than the remote file
+                    total = response.headers.get("content-range", "")
+                    if total.rpartition("/")[2] == str(offset):
+                        os.replace(part, path)
+                        os.remove(meta_path)
+                        return {k: meta.get(k) for k in ("etag", "last_modified")}
+                    _remove(part, meta_path)
+                    continue
+                response.raise_for_status()
+                validators = _validators(response.headers)
+                resumed = response.status_code == 206
+                _write_json(meta_path, {"url": url, **validators})
+                with open(part, "ab" if resumed else "wb") as f:
+                    for chunk in response.iter_bytes(1 << 20):
+                        f.write(chunk)
+            os.replace(part, path)
+            os.remove(meta_path)
+            return validators
+        except httpx.TransportError as e:
+            print(f"[!] Download interrupted ({e}), retrying...")
+            time.sleep(2**attempt)
+    raise RuntimeError(f"Failed to download {url} after {RETRIES} attempts")
+
+
+def extract_model(archive, folder, name_hint):
+    """Extract only the ``.pth`` and ``.index`` members of ``archive`` to ``folder``."""
+    if not zipfile.is_zipfile(archive):
+        if not name_hint.endswith(".pth"):
+            raise ValueError("The download is neither a zip file nor a .pth file")
+        shutil.copyfile(archive, os.path.join(folder, os.path.basename(name_hint)))
+        return
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            name = os.path.basename(info.filename)
+            if (
+                info.is_dir()
+                or info.filename.startswith("__MACOSX/")
+                or not name.lower().endswith((".pth", ".index"))
+            ):
+                continue
+            # flattened, so member paths cannot escape the folder
+            with zf.open(info) as src, open(os.path.join(folder, name), "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+    if not any(f.endswith(".pth") for f in os.listdir(folder)):
+        raise ValueError("No .pth file found in the downloaded archive")
+
+
+def _exchange(a, b):
+    # atomically swap two paths (Linux 3.15+); False where unsupported
+    if _renameat2 is None:
+        return False
+    if _renameat2(AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b), RENAME_EXCHANGE):
+        errno = ctypes.get_errno()
+        if errno in (22, 38, 95):  # EINVAL, ENOSYS, EOPNOTSUPP
+            return False
+        raise OSError(errno, os.strerror(errno), b)
+    return True
+
+
+def _replace_folder(tmp, folder):
+    if os.path.exists(folder) and _exchange(tmp, folder):
+        # tmp now holds the old model
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    # a rename cannot replace a non-empty folder, so move the old one aside
+    # first; readers in other processes may briefly find no folder
+    old = None
+    if os.path.exists(folder):
+        old = tempfile.mkdtemp(dir=rvc_models_dir, prefix=".old-")
+        os.rename(folder, os.path.join(old, "model"))
+    os.rename(tmp, folder)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def fetch_model(url, dir_name, revalidate=False):
+    """Make sure ``rvc_models/dir_name`` holds the model published at ``url``.
+
+    Returns ``"cached"``, ``"revalidated"`` or ``"downloaded"``. A folder that
+    was not fetched from a URL (e.g. a bundled model) is only replaced when
+    ``revalidate`` is set.
+    """
+    folder = os.path.join(rvc_models_dir, dir_name)
+    with _ModelLock(dir_name), httpx.Client(
+        follow_redirects=True, timeout=httpx.Timeout(30.0, read=300.0)
+    ) as client:
+        source = _read_json(os.path.join(folder, SOURCE_FILE))
+        if source is None and os.path.exists(folder) and not revalidate:
+            return "cached"
+        if source is not None and source.get("url") == url:
+            fresh = time.time() - source.get("checked_at", 0) < REVALIDATE_SECONDS
+            if fresh and not revalidate:
+                return "cached"
+            if _not_modified(client, url, source):
+                source["checked_at"] = time.time()
+                _write_json(os.path.join(folder, SOURCE_FILE), source)
+                return "revalidated"
+
+        downloads = os.path.join(rvc_models_dir, ".downloads")
+        archive = os.path.join(
+            downloads, hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        )
+        print(f"[*] Downloading model from {url}...")
+        validators = download(client, url, archive)
+
+        print(f"[*] Extracting model to {folder}...")
+        tmp = tempfile.mkdtemp(dir=rvc_models_dir, prefix=".tmp-")
+        try:
+            extract_model(
+                archive, tmp, urllib.parse.unquote(urllib.parse.urlparse(url).path)
+            )
+            now = time.time()
+            _write_json(
+                os.path.join(tmp, SOURCE_FILE),
+                {"url": url, **validators, "fetched_at": now, "checked_at": now},
+            )
+            _replace_folder(tmp, folder)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        finally:
+            os.remove(archive)
+        return "downloaded"
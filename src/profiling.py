@@ -0,0 +1,229 @@
+"""Profiler captures of single conversions.
+
+``capture`` runs a block under ``torch.profiler`` and a sampling profiler of
+the Python stack at once, then writes to its directory:
+
+* ``trace.json``, a Chrome trace (open in chrome://tracing or Perfetto)
+  where the tracing stages and the HuBERT, RMVPE, attention (text encoder),
+  flow and decoder modules show up as labelled ranges;
+* ``python.folded``, the sampled Python stacks in the folded format of
+  flamegraph.pl and speedscope;
+* ``summary.txt`` and ``summary.json``, the top operators and Python
+  functions by time.
+
+A request is profiled when it asks for it or, with ``RVC_PROFILE_SAMPLE_RATE``
+set, at that rate. Requests that are not profiled pay nothing. Two captures
+are compared with
+
+    python -m profiling before/trace.json after/trace.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import torch
+
+import tracing
+
+SAMPLE_RATE = float(os.getenv("RVC_PROFILE_SAMPLE_RATE", "0"))
+INTERVAL = float(os.getenv("RVC_PROFILE_INTERVAL", "0.005"))
+TOP = int(os.getenv("RVC_PROFILE_TOP", "30"))
+
+
+def should_profile(requested=False):
+    """Whether to profile a request, given whether it asked for it."""
+    return requested or (SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE)
+
+
+def profile_dir(output_path):
+    """The directory the capture of ``output_path`` is written to."""
+    return os.path.splitext(output_path)[0] + ".profile"
+
+
+class _Sampler:
+    # samples the Python stack of one thread in a background thread
+    def __init__(self, thread_id, interval=INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = os.path.basename(code.co_filename)
+                stack.append(f"{code.co_name} ({name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _label_modules(modules):
+    # record_function ranges around the forward of each module
+    local = threading.local()
+    handles = []
+
+    def enter(name):
+        def hook(module, args):
+            stack = local.__dict__.setdefault("stack", [])
+            stack.append(torch.profiler.record_function(name).__enter__())
+
+        return hook
+
+    def leave(module, args, output):
+        local.stack.pop().__exit__(None, None, None)
+
+    for name, module in modules.items():
+        if module is not None:
+            handles.append(module.register_forward_pre_hook(enter(name)))
+            handles.append(module.register_forward_hook(leave))
+    return handles
+
+
+@contextmanager
+def capture(directory, modules=None):
+    """Profile the enclosed block and write the results to ``directory``.
+
+    ``modules`` maps labels to the ``torch.nn.Module`` whose forward calls
+    should be marked in the trace, e.g. ``{"decoder": net_g.dec}``.
+    """
+    os.makedirs(directory, exist_ok=True)
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    handles = _label_modules(modules or {})
+    token = tracing.label_spans.set(True)
+    t0 = time.perf_counter()
+    try:
+        with torch.profiler.profile(activities=activities) as prof, _Sampler(
+            threading.get_ident()
+        ) as sampler:
+            yield
+    finally:
+        seconds = time.perf_counter() - t0
+        tracing.label_spans.reset(token)
+        for handle in handles:
+            handle.remove()
+    _write(directory, prof, sampler, seconds)
+    print(f"Profile written to {directory}")
+
+
+def _write(directory, prof, sampler, seconds):
+    prof.export_chrome_trace(os.path.join(directory, "trace.json"))
+    with open(os.path.join(directory, "python.folded"), "w") as f:
+        for stack, n in sampler.stacks.most_common():
+            f.write(f"{stack} {n}\n")
+
+    averages = prof.key_averages()
+    ops = sorted(averages, key=lambda e: e.self_cpu_time_total, reverse=True)
+    own = Counter()
+    total = Counter()
+    for stack, n in sampler.stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += n
+        for frame in set(frames):
+            total[frame] += n
+    summary = {
+        "seconds": seconds,
+        "sample_interval": sampler.interval,
+        "ops": [
+            {
+                "name": e.key,
+                "count": e.count,
+                "self_cpu_us": e.self_cpu_time_total,
+                "cpu_us": e.cpu_time_total,
+                "self_device_us": e.self_device_time_total,
+            }
+            for e in ops[:TOP]
+        ],
+        "python_self": own.most_common(TOP),
+        "python_total": total.most_common(TOP),
+    }
+    with open(os.path.join(directory, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    sort_by = "self_cpu_time_total"
+    if torch.cuda.is_available():
+        sort_by = "self_device_time_total"
+    table = averages.table(sort_by=sort_by, row_limit=TOP)
+    samples = max(1, sum(sampler.stacks.values()))
+    with open(os.path.join(directory, "summary.txt"), "w") as f:
+        f.write(f"{seconds:.3f} s profiled\n\n{table}\n")
+        f.write(f"Python functions by own samples ({samples} samples)\n")
+        for frame, n in own.most_common(TOP):
+            f.write(f"{100 * n / samples:6.1f}%  {frame}\n")
+        f.write("\nPython functions by total samples\n")
+        for frame, n in total.most_common(TOP):
+            f.write(f"{100 * n / samples:6.1f}%  {frame}\n")
+
+
+def load_trace(path):
+    """Total duration (us) and count per ``(category, name)`` of a Chrome trace."""
+    if os.path.isdir(path):
+        path = os.path.join(path, "trace.json")
+    with open(path) as f:
+        trace = json.load(f)
+    events = trace["traceEvents"] if isinstance(trace, dict) else trace
+    totals = {}
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        key = (event.get("cat", ""), event["name"])
+        duration, count = totals.get(key, (0.0, 0))
+        totals[key] = (duration + float(event.get("dur", 0)), count + 1)
+    return totals
+
+
+def diff(before, after, top=TOP):
+    """Rows ``(category, name, before us, after us, count before, count after)``
+    sorted by the largest change in total duration."""
+    a, b = load_trace(before), load_trace(after)
+    rows = []
+    for key in set(a) | set(b):
+        (da, na), (db, nb) = a.get(key, (0.0, 0)), b.get(key, (0.0, 0))
+        rows.append((*key, da, db, na, nb))
+    rows.sort(key=lambda r: abs(r[3] - r[2]), reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare two Chrome traces (or profile directories) by the "
+        "total time of each operator and labelled range."
+    )
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--top", type=int, default=TOP)
+    args = parser.parse_args()
+
+    print(f"{'before ms':>10} {'after ms':>10} {'change':>8}  calls  name")
+    for category, name, da, db, na, nb in diff(args.before, args.after, args.top):
+        change = f"{100 * (db - da) / da:+.0f}%" if da else "new"
+        calls = str(na) if na == nb else f"{na}->{nb}"
+        print(
+            f"{da / 1000:10.2f} {db / 1000:10.2f} {change:>8}  {calls:>5}  "
+            f"[{category}] {name}"
+        )
+
+
+if __name__ == "__main__":
+    main()
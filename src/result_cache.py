@@ -0,0 +1,247 @@
+"""Content-addressed cache of finished conversions.
+
+A result is keyed by the SHA-256 of the input audio bytes, of the voice
+model's ``.pth`` and ``.index`` files and of the normalized conversion
+parameters, including the name the output is uploaded under, so a retried
+or resubmitted request maps to the same entry whatever URL it came from.
+Entries hold the result dict (e.g. the upload URL). They live on local disk
+under ``RVC_RESULT_CACHE_DIR`` and are evicted least recently used first
+once they exceed ``RVC_RESULT_CACHE_BYTES`` or ``RVC_RESULT_CACHE_ENTRIES``;
+entries whose key is locked are skipped. Each process keeps the sizes of
+the entries in memory and only walks the directory again every
+``RESCAN_SECONDS``, to see the entries and hits of other processes.
+``single_flight`` serializes identical jobs across threads and processes
+so only the first one computes.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import metrics
+
+ENABLED = os.getenv("RVC_RESULT_CACHE", "1") != "0"
+CACHE_DIR = os.getenv(
+    "RVC_RESULT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "rvc", "results"),
+)
+MAX_BYTES = int(os.getenv("RVC_RESULT_CACHE_BYTES", str(2 << 30)))
+MAX_ENTRIES = int(os.getenv("RVC_RESULT_CACHE_ENTRIES", "100000"))
+RESCAN_SECONDS = 300
+# bump when a change to the pipeline changes its output
+VERSION = 1
+
+# parameters of RVCV2InputSchema that change the output, and where it is
+# uploaded: a hit returns the URL of the first upload
+PARAMS = (
+    "pitch_change",
+    "f0_method",
+    "index_rate",
+    "filter_radius",
+    "rms_mix_rate",
+    "protect",
+    "skip_silence",
+    "output_format",
+    "upload_filename",
+)
+# digests of the most recently hashed input and model files
+MAX_DIGESTS = 256
+
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+
+
+def file_sha256(path):
+    """SHA-256 of a file, memoized while its size and mtime do not change."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digests_lock:
+        if memo_key in _digests:
+            _digests.move_to_end(memo_key)
+            return _digests[memo_key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    with _digests_lock:
+        _digests[memo_key] = h.hexdigest()
+        while len(_digests) > MAX_DIGESTS:
+            _digests.popitem(last=False)
+    return h.hexdigest()
+
+
+def model_digests(model_dir):
+    return {
+        name: file_sha256(os.path.join(model_dir, name))
+        for name in sorted(os.listdir(model_dir))
+        if name.endswith((".pth", ".index"))
+    }
+
+
+def normalize_params(params):
+    normalized = {}
+    for name in PARAMS:
+        value = params[name]
+        if isinstance(value, float):
+            value = round(value, 6)
+        normalized[name] = value
+    return normalized
+
+
+def request_key(input_audio_path, model_dir, params, audio_sha256=None):
+    """Cache key for converting ``input_audio_path`` with a voice model folder.
+
+    ``audio_sha256`` skips hashing the input when the digest is already known.
+    """
+    payload = {
+        "version": VERSION,
+        "audio": audio_sha256 or file_sha256(input_audio_path),
+        "model": model_digests(model_dir),
+        "params": normalize_params(params),
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        # key -> bytes of the entries, least recently used first
+        self._index = None
+        self._bytes = 0
+        self._scanned = 0.0
+        self._index_lock = threading.Lock()
+        # key -> [thread lock, number of threads using it]
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        metrics.watch_cache("result", self)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, "entries", key[:2], key)
+
+    def _lock_path(self, key):
+        return os.path.join(self.root, "locks", key + ".lock")
+
+    def get(self, key):
+        """Return the cached result dict, or ``None``."""
+        entry = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry, "result.json")) as f:
+                result = json.load(f)
+            # the entry's mtime is its LRU position
+            os.utime(entry)
+        except (OSError, ValueError):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        with self._index_lock:
+            if self._index is not None and key in self._index:
+                self._index.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        """Store ``result`` under ``key``."""
+        entry = self._entry_dir(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=".tmp-")
+        try:
+            with open(os.path.join(tmp, "result.json"), "w") as f:
+                json.dump(result, f)
+            size = os.path.getsize(os.path.join(tmp, "result.json"))
+            if os.path.exists(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        with self._index_lock:
+            if self._index is not None:
+                self._bytes += size - self._index.pop(key, 0)
+                self._index[key] = size
+        self.evict()
+
+    def _scan(self):
+        # called with the index lock held
+        entries = []
+        for root, dirs, files in os.walk(os.path.join(self.root, "entries")):
+            if "result.json" not in files:
+                continue
+            size = sum(os.path.getsize(os.path.join(root, f)) for f in files)
+            entries.append((os.path.getmtime(root), os.path.basename(root), size))
+            dirs[:] = []
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._bytes = sum(self._index.values())
+        self._scanned = time.monotonic()
+
+    def evict(self):
+        """Remove the least recently used entries beyond ``max_bytes`` and
+        ``max_entries``."""
+        with self._index_lock:
+            if self._index is None or (
+                time.monotonic() - self._scanned > RESCAN_SECONDS
+            ):
+                self._scan()
+            if self._bytes <= self.max_bytes and len(self._index) <= self.max_entries:
+                return
+            os.makedirs(os.path.join(self.root, "locks"), exist_ok=True)
+            for key in list(self._index):
+                if (
+                    self._bytes <= self.max_bytes
+                    and len(self._index) <= self.max_entries
+                ):
+                    break
+                with open(self._lock_path(key), "a") as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        # a job holds this key and may be about to read or write it
+                        continue
+                    shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                    # removed while locked: waiters notice and lock the new file
+                    os.remove(self._lock_path(key))
+                self._bytes -= self._index.pop(key)
+                self.stats["evictions"] += 1
+
+    def _flock(self, key):
+        # lock the key's file; if eviction removed it while we waited, the
+        # lock is on a stale inode and the current file has to be locked
+        path = self._lock_path(key)
+        while True:
+            f = open(path, "a")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    @contextmanager
+    def single_flight(self, key):
+        """Hold the per-key lock; callers check ``get`` again inside it."""
+        with self._locks_lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            os.makedirs(os.path.join(self.root, "locks"), exist_ok=True)
+            with entry[0], self._flock(key) as f:
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            with self._locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
@@ -1,124 +1,119 @@
+import dataclasses
+import os
+from contextlib import nullcontext
+from functools import lru_cache
 from multiprocessing import cpu_count
-from pathlib import Path
+from typing import Optional
 
 import torch
-from fairseq import checkpoint_utils
-from scipy.io import wavfile
-
-from infer_pack.models import (
-    SynthesizerTrnMs256NSFsid,
-    SynthesizerTrnMs256NSFsid_nono,
-    SynthesizerTrnMs768NSFsid,
-    SynthesizerTrnMs768NSFsid_nono,
+
+import audio_encoder
+import autotune
+import profiling
+import tracing
+from hubert import load_hubert_base
+from model_artifacts import (
+    build_synthesizer,
+    find_artifact,
+    load_artifact,
+    load_checkpoint,
 )
 from my_utils import load_audio
 from vc_infer_pipeline import VC
 
-BASE_DIR = Path(__file__).resolve().parent.parent
+# seconds of context per segment side, may be fractional; unset: per device
+X_PAD = os.getenv("RVC_X_PAD")
+# seconds of crossfade between segments, at most 2 * x_pad
+X_CROSSFADE = float(os.getenv("RVC_X_CROSSFADE", "0"))
 
 
+@dataclasses.dataclass(frozen=True)
 class Config:
-    def __init__(self, device, is_half):
-        self.device = device
-        self.is_half = is_half
-        self.n_cpu = 0
-        self.gpu_name = None
-        self.gpu_mem = None
-        self.x_pad, self.x_query, self.x_center, self.x_max = self.device_config()
-
-    def device_config(self) -> tuple:
-        if torch.cuda.is_available():
-            i_device = int(self.device.split(":")[-1])
-            self.gpu_name = torch.cuda.get_device_name(i_device)
-            if (
-                ("16" in self.gpu_name and "V100" not in self.gpu_name.upper())
-                or "P40" in self.gpu_name.upper()
-                or "1060" in self.gpu_name
-                or "1070" in self.gpu_name
-                or "1080" in self.gpu_name
-            ):
-                print("16 series/10 series P40 forced single precision")
-                self.is_half = False
-                for config_file in ["32k.json", "40k.json", "48k.json"]:
-                    with open(BASE_DIR / "src" / "configs" / config_file, "r") as f:
-                        strr = f.read().replace("true", "false")
-                    with open(BASE_DIR / "src" / "configs" / config_file, "w") as f:
-                        f.write(strr)
-                with open(
-                    BASE_DIR / "src" / "trainset_preprocess_pipeline_print.py", "r"
-                ) as f:
-                    strr = f.read().replace("3.7", "3.0")
-                with open(
-                    BASE_DIR / "src" / "trainset_preprocess_pipeline_print.py", "w"
-                ) as f:
-                    f.write(strr)
-            else:
-                self.gpu_name = None
-            self.gpu_mem = int(
-                torch.cuda.get_device_properties(i_device).total_memory
-                / 1024
-                / 1024
-                / 1024
-                + 0.4
-            )
-            if self.gpu_mem <= 4:
-                with open(
-                    BASE_DIR / "src" / "trainset_preprocess_pipeline_print.py", "r"
-                ) as f:
-                    strr = f.read().replace("3.7", "3.0")
-                with open(
-                    BASE_DIR / "src" / "trainset_preprocess_pipeline_print.py", "w"
-                ) as f:
-                    f.write(strr)
-        elif torch.backends.mps.is_available():
-            print("No supported N-card found, use MPS for inference")
-            self.device = "mps"
-        else:
-            print("No supported N-card found, use CPU for inference")
-            self.device = "cpu"
-            self.is_half = True
-
-        if self.n_cpu == 0:
-            self.n_cpu = cpu_count()
-
-        if self.is_half:
-            # 6G memory config
-            x_pad = 3
-            x_query = 10
-            x_center = 60
-            x_max = 65
-        else:
-            # 5G memory config
-            x_pad = 1
-            x_query = 6
-            x_center = 38
-            x_max = 41
-
-        if self.gpu_mem != None and self.gpu_mem <= 4:
-            x_pad = 1
-            x_query = 5
-            x_center = 30
-            x_max = 32
-
-        return x_pad, x_query, x_center, x_max
+    """Runtime profile of a device, see ``get_config``."""
+
+    device: str
+    is_half: bool
+    n_cpu: int
+    gpu_name: Optional[str]
+    gpu_mem: Optional[int]
+    x_pad: float
+    x_query: float
+    x_center: float
+    x_max: float
+    # seconds of crossfade between segments, 0 keeps hard cuts
+    x_crossfade: float = 0
+    # x_pad was set by the user, autotune keeps it
+    x_pad_fixed: bool = False
+    segment_params: dict = dataclasses.field(default_factory=dict, compare=False)
+
+
+@lru_cache(maxsize=None)
+def get_config(device, is_half):
+    """Probe ``device`` once per process and return its ``Config``.
+
+    Nothing is written to disk.
+    """
+    gpu_name = gpu_mem = None
+    if torch.cuda.is_available():
+        i_device = int(device.split(":")[-1]) if ":" in device else 0
+        name = torch.cuda.get_device_name(i_device)
+        if (
+            ("16" in name and "V100" not in name.upper())
+            or "P40" in name.upper()
+            or "1060" in name
+            or "1070" in name
+            or "1080" in name
+        ):
+            print("16 series/10 series P40 forced single precision")
+            is_half = False
+            gpu_name = name
+        gpu_mem = int(
+            torch.cuda.get_device_properties(i_device).total_memory / 1024 / 1024 / 1024
+            + 0.4
+        )
+    elif torch.backends.mps.is_available():
+        print("No supported N-card found, use MPS for inference")
+        device = "mps"
+    else:
+        print("No supported N-card found, use CPU for inference")
+        device = "cpu"
+        is_half = False
+
+    if is_half:
+        # 6G memory config
+        x_pad, x_query, x_center, x_max = 3, 10, 60, 65
+    else:
+        # 5G memory config
+        x_pad, x_query, x_center, x_max = 1, 6, 38, 41
+    if gpu_mem is not None and gpu_mem <= 4:
+        x_pad, x_query, x_center, x_max = 1, 5, 30, 32
+    if X_PAD:
+        x_pad = float(X_PAD)
+
+    return Config(
+        device=device,
+        is_half=is_half,
+        n_cpu=cpu_count(),
+        gpu_name=gpu_name,
+        gpu_mem=gpu_mem,
+        x_pad=x_pad,
+        x_query=x_query,
+        x_center=x_center,
+        x_max=x_max,
+        x_crossfade=X_CROSSFADE,
+        x_pad_fixed=bool(X_PAD),
+        segment_params={
+            "x_pad": x_pad,
+            "x_query": x_query,
+            "x_center": x_center,
+            "x_max": x_max,
+            "source": "table",
+        },
+    )
 
 
 def load_hubert(device, is_half, model_path):
-    # Add safe globals for fairseq Dictionary class to handle PyTorch 2.6+ compatibility
-    try:
-        import torch.serialization
-        from fairseq.data.dictionary import Dictionary
-
-        torch.serialization.add_safe_globals([Dictionary])
-    except (ImportError, AttributeError):
-        # Older PyTorch versions don't have add_safe_globals
-        pass
-
-    models, saved_cfg, task = checkpoint_utils.load_model_ensemble_and_task(
-        [model_path],
-        suffix="",
-    )
-    hubert = models[0]
+    hubert = load_hubert_base(model_path)
     hubert = hubert.to(device)
 
     if is_half:
@@ -130,37 +125,21 @@ def load_hubert(device, is_half, model_path):
     return hubert
 
 
-def get_vc(device, is_half, config, model_path):
-    try:
-        # First try with weights_only=False for PyTorch 2.6+ compatibility
-        cpt = torch.load(model_path, map_location="cpu", weights_only=False)
-    except TypeError:
-        # Fall back to default for older PyTorch versions that don't have weights_only parameter
-        cpt = torch.load(model_path, map_location="cpu")
-
-    if "config" not in cpt or "weight" not in cpt:
-        raise ValueError(
-            f"Incorrect format for {model_path}. Use a voice model trained using RVC v2 instead."
-        )
-
+def get_vc(device, is_half, config, model_path, concurrency=None):
+    """Load a voice model; its segments are sized by ``autotune`` for
+    ``concurrency`` jobs sharing the device if the device was probed."""
+    artifact = find_artifact(model_path, is_half)
+    if artifact is not None:
+        cpt, net_g = load_artifact(artifact)
+    else:
+        cpt = load_checkpoint(model_path)
+        net_g = build_synthesizer(cpt, is_half)
+        print(net_g.load_state_dict(cpt["weight"], strict=False))
+        net_g.dec.remove_weight_norm()
+        net_g.flow.remove_weight_norm()
     tgt_sr = cpt["config"][-1]
-    cpt["config"][-3] = cpt["weight"]["emb_g.weight"].shape[0]
-    if_f0 = cpt.get("f0", 1)
     version = cpt.get("version", "v1")
 
-    if version == "v1":
-        if if_f0 == 1:
-            net_g = SynthesizerTrnMs256NSFsid(*cpt["config"], is_half=is_half)
-        else:
-            net_g = SynthesizerTrnMs256NSFsid_nono(*cpt["config"])
-    elif version == "v2":
-        if if_f0 == 1:
-            net_g = SynthesizerTrnMs768NSFsid(*cpt["config"], is_half=is_half)
-        else:
-            net_g = SynthesizerTrnMs768NSFsid_nono(*cpt["config"])
-
-    del net_g.enc_q
-    print(net_g.load_state_dict(cpt["weight"], strict=False))
     net_g.eval().to(device)
 
     if is_half:
@@ -168,6 +147,7 @@ def get_vc(device, is_half, config, model_path):
     else:
         net_g = net_g.float()
 
+    config = autotune.tune(config, version, tgt_sr, concurrency)
     vc = VC(tgt_sr, config)
     return cpt, version, net_g, tgt_sr, vc
 
@@ -189,28 +169,66 @@ def rvc_infer(
     crepe_hop_length,
     vc,
     hubert_model,
+    skip_silence=False,
+    audio=None,
+    profile_dir=None,
 ):
-    audio = load_audio(input_path, 16000)
-    times = [0, 0, 0]
-    if_f0 = cpt.get("f0", 1)
-    audio_opt = vc.pipeline(
-        hubert_model,
-        net_g,
-        0,
-        audio,
-        input_path,
-        times,
-        pitch_change,
-        f0_method,
-        index_path,
-        index_rate,
-        if_f0,
-        filter_radius,
-        tgt_sr,
-        0,
-        rms_mix_rate,
-        version,
-        protect,
-        crepe_hop_length,
-    )
-    wavfile.write(output_path, tgt_sr, audio_opt)
+    with tracing.span("convert", model_version=version):
+        if audio is None:
+            with tracing.span("decode"):
+                audio = load_audio(input_path, 16000)
+        tracing.set_trace_attributes(
+            f0_method=f0_method,
+            audio_seconds=len(audio) / 16000,
+            device=str(vc.device),
+            dtype="fp16" if vc.is_half else "fp32",
+        )
+        times = [0, 0, 0]
+        stats = {}
+        if_f0 = cpt.get("f0", 1)
+        profiler = nullcontext()
+        if profile_dir is not None:
+            rmvpe = getattr(vc, "model_rmvpe", None)
+            profiler = profiling.capture(
+                profile_dir,
+                {
+                    "hubert": hubert_model,
+                    "rmvpe": rmvpe.model if rmvpe is not None else None,
+                    "attention": net_g.enc_p,
+                    "flow": net_g.flow,
+                    "decoder": net_g.dec,
+                },
+            )
+        with profiler:
+            audio_opt = vc.pipeline(
+                hubert_model,
+                net_g,
+                0,
+                audio,
+                input_path,
+                times,
+                pitch_change,
+                f0_method,
+                index_path,
+                index_rate,
+                if_f0,
+                filter_radius,
+                tgt_sr,
+                0,
+                rms_mix_rate,
+                version,
+                protect,
+                crepe_hop_length,
+                skip_silence=skip_silence,
+                stats=stats,
+            )
+        fmt = os.path.splitext(output_path)[1][1:].lower()
+        with tracing.span("encode", format=fmt):
+            if fmt == "wav":
+                from scipy.io import wavfile
+
+                wavfile.write(output_path, tgt_sr, audio_opt)
+            else:
+                # mp3, opus or flac, encoded straight from the samples
+                audio_encoder.encode(audio_opt, tgt_sr, fmt, output_path)
+    return stats
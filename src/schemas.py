@@ -17,9 +17,11 @@ class RVCV2InputSchema(BaseModel):
     filter_radius: int = 3
     rms_mix_rate: float = 0.25
     protect: float = 0.33
+    skip_silence: bool = False
+    profile: bool = False
     webhook_url: str | None = None
 
-    output_format: Literal["mp3", "wav"] = "wav"
+    output_format: Literal["mp3", "wav", "opus", "flac"] = "wav"
 
     @field_validator("input_audio")
     def validate_input_audio(cls, v: str) -> str:
@@ -0,0 +1,122 @@
+"""Split-point search, silence detection and stitching for long inputs."""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+ROWS_PER_BLOCK = 8  # query windows summed at once, bounds the scratch memory
+
+
+def _argmin_moving_sum(windows, window):
+    # windows: [n, span + window - 1] -> argmin over |moving sum| for each row.
+    # The sum adds the ``window`` shifted rows one after the other, in the
+    # order and dtype of the loop VC.pipeline used to run over the whole
+    # input; a cumsum difference is faster but cancels in quiet passages and
+    # moves the cuts.
+    span = windows.shape[1] - window + 1
+    out = np.empty(windows.shape[0], dtype=np.int64)
+    for r in range(0, windows.shape[0], ROWS_PER_BLOCK):
+        block = windows[r : r + ROWS_PER_BLOCK]
+        sums = np.zeros((block.shape[0], span), dtype=windows.dtype)
+        for i in range(window):
+            sums += block[:, i : i + span]
+        out[r : r + block.shape[0]] = np.argmin(np.abs(sums), axis=1)
+    return out
+
+
+def find_split_points(audio, window, t_center, t_query):
+    """Pick the cut positions for ``audio``, one per multiple of ``t_center``.
+
+    Each cut is the sample within ``t_query`` of the nominal position where
+    the centered moving sum over ``window`` samples is closest to zero.
+    The moving sum is only evaluated inside the query windows, which give
+    the same cuts as summing over the whole input.
+    """
+    n = audio.shape[0]
+    centers = np.arange(t_center, n, t_center)
+    if centers.size == 0:
+        return []
+    audio_pad = np.pad(audio, (window // 2, window // 2), mode="reflect")
+
+    span = 2 * t_query
+    full = centers[centers + t_query <= n]
+    opt_ts = []
+    if full.size:
+        windows = sliding_window_view(audio_pad, span + window - 1)
+        windows = windows[full[0] - t_query :: t_center][: full.size]
+        idx = _argmin_moving_sum(windows, window)
+        opt_ts.extend((full - t_query + idx).tolist())
+    for t in centers[full.size :]:
+        # the last query window is cut short by the end of the input
+        seg = audio_pad[t - t_query : n + window - 1]
+        idx = _argmin_moving_sum(seg[None], window)[0]
+        opt_ts.append(int(t - t_query + idx))
+    return opt_ts
+
+
+def silent_spans(
+    audio, window, threshold_db=-50.0, min_silence=0.6, margin=0.15, sr=16000
+):
+    """Return the ``(start, end)`` sample spans of near-silence worth skipping.
+
+    Frames of ``window`` samples with an RMS below ``threshold_db`` dBFS count
+    as silent. Runs of silent frames are shrunk by ``margin`` seconds on the
+    sides that face audible audio, so onsets and decays still go through the
+    models, and are dropped if less than ``min_silence`` seconds remain.
+    """
+    n_frames = audio.shape[0] // window
+    frames = audio[: n_frames * window].reshape(n_frames, window)
+    power = np.einsum("ij,ij->i", frames, frames) / window
+    silent = (power < 10 ** (threshold_db / 10)).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], silent, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    margin_frames = int(margin * sr / window)
+    starts = np.where(starts > 0, starts + margin_frames, starts)
+    ends = np.where(ends < n_frames, ends - margin_frames, ends)
+    keep = ends - starts >= max(int(min_silence * sr / window), 1)
+    spans = [
+        (int(s) * window, int(e) * window) for s, e in zip(starts[keep], ends[keep])
+    ]
+    if spans and spans[-1][1] == n_frames * window:
+        # a silent ending also swallows the last partial frame
+        spans[-1] = (spans[-1][0], audio.shape[0])
+    return spans
+
+
+def stitch_segments(segments, pad, overlap=0):
+    """Join converted segments that carry ``pad`` samples of context per side.
+
+    With ``overlap == 0`` the context is cut off and the segments are butted
+    together. Otherwise every inner edge keeps ``overlap // 2`` samples of its
+    context (at most ``pad``), and neighbours are crossfaded over those samples
+    with complementary raised-cosine ramps. The output length is the same in
+    both cases.
+    """
+    half = min(overlap // 2, pad)
+    last = len(segments) - 1
+    trimmed = [
+        seg[(pad - half if i else pad) : len(seg) - (pad - half if i < last else pad)]
+        for i, seg in enumerate(segments)
+    ]
+    if half == 0 or last == 0:
+        return np.concatenate(trimmed)
+
+    fade = 2 * half
+    fade_in = np.sin(0.5 * np.pi * (np.arange(fade) + 0.5) / fade) ** 2
+    fade_out = 1 - fade_in
+    pieces = []
+    tail = None
+    for i, seg in enumerate(trimmed):
+        if tail is not None:
+            # the last segment can end inside the crossfade when the final
+            # cut is close to the end of the input, the rest of tail is dropped
+            n = min(fade, len(seg), len(tail))
+            pieces.append(seg[:n] * fade_in[:n] + tail[:n] * fade_out[:n])
+            seg = seg[n:]
+        if i < last:
+            tail = seg[-fade:]
+            seg = seg[:-fade]
+        pieces.append(seg)
+    return np.concatenate(pieces).astype(segments[0].dtype)
@@ -0,0 +1,290 @@
+"""Spans for the stages of a conversion, logged as JSON and exported to OTLP.
+
+    with tracing.span("request", job_id=job_id):
+        tracing.set_trace_attributes(device="cpu", dtype="fp32")
+        with tracing.span("f0", method="rmvpe"):
+            ...
+
+Spans nest through a context variable. Attributes given to
+``set_trace_attributes`` (audio duration, segment count, device, dtype) are
+added to every span of the trace that ends afterwards. Each finished span
+is logged as one JSON line on the ``tracing`` logger and, when
+``OTEL_EXPORTER_OTLP_ENDPOINT`` is set, sent in batches to
+``<endpoint>/v1/traces`` with the OTLP/HTTP JSON encoding, which any
+OpenTelemetry collector accepts. ``RVC_TRACE=0`` turns spans into no-ops.
+With ``RVC_TRACE_CUDA_SYNC=1`` a span waits for the GPU before it ends, so
+asynchronous CUDA work is counted in the stage that launched it.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED = os.getenv("RVC_TRACE", "1") != "0"
+CUDA_SYNC = os.getenv("RVC_TRACE_CUDA_SYNC", "0") == "1"
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "rvc-v2")
+
+logger = logging.getLogger("tracing")
+
+_current = contextvars.ContextVar("current_span", default=None)
+_listeners = []
+# set by profiling.capture: spans are also marked in the torch profiler trace
+label_spans = contextvars.ContextVar("label_spans", default=False)
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "trace_attributes",
+        "error",
+    )
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        if parent is None:
+            self.trace_id = os.urandom(16).hex()
+            self.parent_id = None
+            # shared by every span of the trace
+            self.trace_attributes = {}
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.trace_attributes = parent.trace_attributes
+        self.attributes = attributes
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def seconds(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "seconds": self.seconds,
+            "attributes": {**self.trace_attributes, **self.attributes},
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+_noop = _NoopSpan()
+
+
+def current_span():
+    return _current.get()
+
+
+def set_trace_attributes(**attributes):
+    """Attributes for the remaining spans of the current trace."""
+    span = _current.get()
+    if span is not None:
+        span.trace_attributes.update(attributes)
+
+
+def count(name, n=1):
+    """Add ``n`` to the trace attribute ``name``, e.g. the segment count."""
+    span = _current.get()
+    if span is not None:
+        span.trace_attributes[name] = span.trace_attributes.get(name, 0) + n
+
+
+def add_listener(fn):
+    """Call ``fn(span)`` for every span that ends, e.g. to update metrics."""
+    _listeners.append(fn)
+
+
+def _cuda_sync():
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the enclosed block as a child of the current span."""
+    if not ENABLED:
+        yield _noop
+        return
+    s = Span(name, _current.get(), attributes)
+    token = _current.set(s)
+    record = None
+    if label_spans.get():
+        record = sys.modules["torch"].profiler.record_function(name).__enter__()
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if record is not None:
+            record.__exit__(None, None, None)
+        if CUDA_SYNC:
+            _cuda_sync()
+        s.end_ns = time.time_ns()
+        _current.reset(token)
+        _finish(s)
+
+
+def _finish(s):
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(s.to_dict()))
+    if OTLP_ENDPOINT:
+        exporter().export(s)
+    for fn in _listeners:
+        fn(s)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_span(s):
+    """``s`` in the OTLP JSON encoding of a span."""
+    attributes = {**s.trace_attributes, **s.attributes}
+    return {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "parentSpanId": s.parent_id or "",
+        "name": s.name,
+        "kind": 1,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [
+            {"key": k, "value": _otlp_value(v)} for k, v in attributes.items()
+        ],
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+
+
+class OTLPExporter:
+    """Sends finished spans to an OTLP/HTTP endpoint from a background thread."""
+
+    def __init__(self, endpoint, batch_size=256, interval=2.0, maxsize=4096):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def export(self, s):
+        try:
+            self._queue.put_nowait(s)
+        except queue.Full:
+            # tracing must never slow a request down
+            self.dropped += 1
+
+    def _run(self):
+        import httpx
+
+        client = httpx.Client(timeout=5.0)
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._send(client, batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _send(self, client, batch):
+        body = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "rvc"},
+                            "spans": [otlp_span(s) for s in batch],
+                        }
+                    ],
+                }
+            ]
+        }
+        try:
+            client.post(self.url, json=body).raise_for_status()
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans: {e}")
+
+    def flush(self, timeout=5.0):
+        """Wait until the queued spans are sent; returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+
+_exporter = None
+_exporter_pid = None
+_exporter_lock = threading.Lock()
+
+
+def _reset_exporter_lock():
+    # a thread of the parent may have held it at the fork
+    global _exporter_lock
+    _exporter_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_exporter_lock)
+
+
+def exporter():
+    """The OTLP exporter of this process, or None without an endpoint."""
+    global _exporter, _exporter_pid
+    if OTLP_ENDPOINT and _exporter_pid != os.getpid():
+        with _exporter_lock:
+            if _exporter_pid != os.getpid():
+                # forked workers start their own sender thread
+                _exporter = OTLPExporter(OTLP_ENDPOINT)
+                _exporter_pid = os.getpid()
+    return _exporter
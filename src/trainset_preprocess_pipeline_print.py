@@ -12,6 +12,8 @@ sr = int(sys.argv[2])
 n_p = int(sys.argv[3])
 exp_dir = sys.argv[4]
 noparallel = sys.argv[5] == "True"
+# slice length in seconds
+per = float(sys.argv[6]) if len(sys.argv) > 6 else 3.0
 import multiprocessing
 import os
 import traceback
@@ -41,7 +43,7 @@ def println(strr):
 
 
 class PreProcess:
-    def __init__(self, sr, exp_dir):
+    def __init__(self, sr, exp_dir, per=3.0):
         self.slicer = Slicer(
             sr=sr,
             threshold=-42,
@@ -52,7 +54,7 @@ class PreProcess:
         )
         self.sr = sr
         self.bh, self.ah = signal.butter(N=5, Wn=48, btype="high", fs=self.sr)
-        self.per = 3.0
+        self.per = per
         self.overlap = 0.3
         self.tail = self.per + self.overlap
         self.max = 0.9
@@ -141,8 +143,8 @@ class PreProcess:
             println("Fail. %s" % traceback.format_exc())
 
 
-def preprocess_trainset(inp_root, sr, n_p, exp_dir):
-    pp = PreProcess(sr, exp_dir)
+def preprocess_trainset(inp_root, sr, n_p, exp_dir, per=3.0):
+    pp = PreProcess(sr, exp_dir, per)
     println("start preprocess")
     println(sys.argv)
     pp.pipeline_mp_inp_dir(inp_root, n_p)
@@ -150,4 +152,4 @@ def preprocess_trainset(inp_root, sr, n_p, exp_dir):
 
 
 if __name__ == "__main__":
-    preprocess_trainset(inp_root, sr, n_p, exp_dir)
+    preprocess_trainset(inp_root, sr, n_p, exp_dir, per)
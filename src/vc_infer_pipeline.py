@@ -1,32 +1,41 @@
+import contextvars
 import os
 import sys
+import threading
 import traceback
-from functools import lru_cache
 from time import time as ttime
 
-import faiss
-import librosa
 import numpy as np
-import parselmouth
-import pyworld
 import torch
 import torch.nn.functional as F
-import torchcrepe
 from scipy import signal
 from torch import Tensor
 
+import tracing
+from segmentation import find_split_points, silent_spans, stitch_segments
+
+# faiss, librosa, parselmouth, pyworld and torchcrepe are imported where they
+# are used, so workers only pay for the f0 methods and features they serve.
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 now_dir = os.path.join(BASE_DIR, "src")
 sys.path.append(now_dir)
 
 bh, ah = signal.butter(N=5, Wn=48, btype="high", fs=16000)
 
-input_audio_path2wav = {}
+# per-job state, set by VC.pipeline: concurrent jobs never share entries
+_job_harvest_cache = contextvars.ContextVar("job_harvest_cache", default=None)
+_rmvpe_lock = threading.Lock()
 
 
-@lru_cache(maxsize=None)
-def cache_harvest_f0(input_audio_path, fs, f0max, f0min, frame_period):
-    audio = input_audio_path2wav[input_audio_path]
+def cache_harvest_f0(input_audio_path, audio, fs, f0max, f0min, frame_period):
+    """Harvest f0, memoized by region within the current job only."""
+    cache = _job_harvest_cache.get()
+    key = (input_audio_path, fs, f0max, f0min, frame_period)
+    if cache is not None and key in cache:
+        return cache[key]
+    import pyworld
+
     f0, t = pyworld.harvest(
         audio,
         fs=fs,
@@ -35,10 +44,14 @@ def cache_harvest_f0(input_audio_path, fs, f0max, f0min, frame_period):
         frame_period=frame_period,
     )
     f0 = pyworld.stonemask(audio, f0, t, fs)
+    if cache is not None:
+        cache[key] = f0
     return f0
 
 
 def change_rms(data1, sr1, data2, sr2, rate):  # 1是输入音频，2是输出音频,rate是2的占比
+    import librosa
+
     # print(data1.max(),data2.max())
     rms1 = librosa.feature.rms(
         y=data1, frame_length=sr1 // 2 * 2, hop_length=sr1 // 2
@@ -71,12 +84,15 @@ class VC(object):
         )
         self.sr = 16000  # hubert输入采样率
         self.window = 160  # 每帧点数
-        self.t_pad = self.sr * self.x_pad  # 每条前后pad时间
-        self.t_pad_tgt = tgt_sr * self.x_pad
+        # 每条前后pad时间, whole frames so that x_pad may be fractional
+        self.t_pad = int(self.sr * self.x_pad) // self.window * self.window
+        self.t_pad_tgt = self.t_pad * tgt_sr // self.sr
+        # neighbouring segments are crossfaded over this many output samples
+        self.t_fade_tgt = int(tgt_sr * getattr(config, "x_crossfade", 0))
         self.t_pad2 = self.t_pad * 2
-        self.t_query = self.sr * self.x_query  # 查询切点前后查询时间
-        self.t_center = self.sr * self.x_center  # 查询切点位置
-        self.t_max = self.sr * self.x_max  # 免查询时长阈值
+        self.t_query = int(self.sr * self.x_query)  # 查询切点前后查询时间
+        self.t_center = int(self.sr * self.x_center)  # 查询切点位置
+        self.t_max = int(self.sr * self.x_max)  # 免查询时长阈值
         self.device = config.device
 
     # Fork Feature: Get the best torch device to use for f0 algorithms that require a torch device. Will return the type (torch.device)
@@ -102,6 +118,8 @@ class VC(object):
         hop_length=160,  # 512 before. Hop length changes the speed that the voice jumps to a different dramatic pitch. Lower hop lengths means more pitch accuracy but longer inference time.
         model="full",  # Either use crepe-tiny "tiny" or crepe "full". Default is full
     ):
+        import torchcrepe
+
         x = x.astype(
             np.float32
         )  # fixes the F.conv2D exception. We needed to convert double to float.
@@ -143,6 +161,8 @@ class VC(object):
         f0_max,
         model="full",
     ):
+        import torchcrepe
+
         # Pick a batch size that doesn't cause memory errors on your gpu
         batch_size = 512
         # Compute pitch using first gpu
@@ -166,6 +186,8 @@ class VC(object):
 
     # Fork Feature: Compute pYIN f0 method
     def get_f0_pyin_computation(self, x, f0_min, f0_max):
+        import librosa
+
         y, sr = librosa.load("saudio/Sidney.wav", self.sr, mono=True)
         f0, _, _ = librosa.pyin(y, sr=self.sr, fmin=f0_min, fmax=f0_max)
         f0 = f0[1:]  # Get rid of extra first frame
@@ -198,6 +220,8 @@ class VC(object):
         for method in methods:
             f0 = None
             if method == "pm":
+                import parselmouth
+
                 f0 = (
                     parselmouth.Sound(x, self.sr)
                     .to_pitch_ac(
@@ -228,11 +252,15 @@ class VC(object):
                     x, f0_min, f0_max, p_len, crepe_hop_length, "tiny"
                 )
             elif method == "harvest":
-                f0 = cache_harvest_f0(input_audio_path, self.sr, f0_max, f0_min, 10)
+                f0 = cache_harvest_f0(
+                    input_audio_path, x.astype(np.double), self.sr, f0_max, f0_min, 10
+                )
                 if filter_radius > 2:
                     f0 = signal.medfilt(f0, 3)
                 f0 = f0[1:]  # Get rid of first frame.
             elif method == "dio":  # Potentially buggy?
+                import pyworld
+
                 f0, t = pyworld.dio(
                     x.astype(np.double),
                     fs=self.sr,
@@ -270,13 +298,14 @@ class VC(object):
         crepe_hop_length,
         inp_f0=None,
     ):
-        global input_audio_path2wav
         time_step = self.window / self.sr * 1000
         f0_min = 50
         f0_max = 1100
         f0_mel_min = 1127 * np.log(1 + f0_min / 700)
         f0_mel_max = 1127 * np.log(1 + f0_max / 700)
         if f0_method == "pm":
+            import parselmouth
+
             f0 = (
                 parselmouth.Sound(x, self.sr)
                 .to_pitch_ac(
@@ -293,11 +322,14 @@ class VC(object):
                     f0, [[pad_size, p_len - len(f0) - pad_size]], mode="constant"
                 )
         elif f0_method == "harvest":
-            input_audio_path2wav[input_audio_path] = x.astype(np.double)
-            f0 = cache_harvest_f0(input_audio_path, self.sr, f0_max, f0_min, 10)
+            f0 = cache_harvest_f0(
+                input_audio_path, x.astype(np.double), self.sr, f0_max, f0_min, 10
+            )
             if filter_radius > 2:
                 f0 = signal.medfilt(f0, 3)
         elif f0_method == "dio":  # Potentially Buggy?
+            import pyworld
+
             f0, t = pyworld.dio(
                 x.astype(np.double),
                 fs=self.sr,
@@ -320,19 +352,19 @@ class VC(object):
                 x, f0_min, f0_max, p_len, crepe_hop_length, "tiny"
             )
         elif f0_method == "rmvpe":
-            if hasattr(self, "model_rmvpe") == False:
-                from rmvpe import RMVPE
+            with _rmvpe_lock:
+                if hasattr(self, "model_rmvpe") == False:
+                    from rmvpe import RMVPE
 
-                self.model_rmvpe = RMVPE(
-                    os.path.join(BASE_DIR, "rvc_models", "rmvpe.pt"),
-                    is_half=self.is_half,
-                    device=self.device,
-                )
+                    self.model_rmvpe = RMVPE(
+                        os.path.join(BASE_DIR, "rvc_models", "rmvpe.pt"),
+                        is_half=self.is_half,
+                        device=self.device,
+                    )
             f0 = self.model_rmvpe.infer_from_audio(x, thred=0.03)
 
         elif "hybrid" in f0_method:
             # Perform hybrid median pitch estimation
-            input_audio_path2wav[input_audio_path] = x.astype(np.double)
             f0 = self.get_f0_hybrid_computation(
                 f0_method,
                 input_audio_path,
@@ -355,10 +387,9 @@ class VC(object):
             replace_f0 = np.interp(
                 list(range(delta_t)), inp_f0[:, 0] * 100, inp_f0[:, 1]
             )
-            shape = f0[self.x_pad * tf0 : self.x_pad * tf0 + len(replace_f0)].shape[0]
-            f0[self.x_pad * tf0 : self.x_pad * tf0 + len(replace_f0)] = replace_f0[
-                :shape
-            ]
+            pad = self.t_pad // self.window
+            shape = f0[pad : pad + len(replace_f0)].shape[0]
+            f0[pad : pad + len(replace_f0)] = replace_f0[:shape]
         # with open("test_opt.txt","w")as f:f.write("\n".join([str(i)for i in f0.tolist()]))
         f0bak = f0.copy()
         f0_mel = 1127 * np.log(1 + f0 / 700)
@@ -403,7 +434,7 @@ class VC(object):
             "output_layer": 9 if version == "v1" else 12,
         }
         t0 = ttime()
-        with torch.no_grad():
+        with torch.no_grad(), tracing.span("hubert"):
             logits = model.extract_features(**inputs)
             feats = model.final_proj(logits[0]) if version == "v1" else logits[0]
         if protect < 0.5 and pitch != None and pitchf != None:
@@ -413,24 +444,25 @@ class VC(object):
             and isinstance(big_npy, type(None)) == False
             and index_rate != 0
         ):
-            npy = feats[0].cpu().numpy()
-            if self.is_half:
-                npy = npy.astype("float32")
-
-            # _, I = index.search(npy, 1)
-            # npy = big_npy[I.squeeze()]
-
-            score, ix = index.search(npy, k=8)
-            weight = np.square(1 / score)
-            weight /= weight.sum(axis=1, keepdims=True)
-            npy = np.sum(big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
-
-            if self.is_half:
-                npy = npy.astype("float16")
-            feats = (
-                torch.from_numpy(npy).unsqueeze(0).to(self.device) * index_rate
-                + (1 - index_rate) * feats
-            )
+            with tracing.span("retrieval"):
+                npy = feats[0].cpu().numpy()
+                if self.is_half:
+                    npy = npy.astype("float32")
+
+                # _, I = index.search(npy, 1)
+                # npy = big_npy[I.squeeze()]
+
+                score, ix = index.search(npy, k=8)
+                weight = np.square(1 / score)
+                weight /= weight.sum(axis=1, keepdims=True)
+                npy = np.sum(big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
+
+                if self.is_half:
+                    npy = npy.astype("float16")
+                feats = (
+                    torch.from_numpy(npy).unsqueeze(0).to(self.device) * index_rate
+                    + (1 - index_rate) * feats
+                )
 
         feats = F.interpolate(feats.permute(0, 2, 1), scale_factor=2).permute(0, 2, 1)
         if protect < 0.5 and pitch != None and pitchf != None:
@@ -453,7 +485,7 @@ class VC(object):
             feats = feats * pitchff + feats0 * (1 - pitchff)
             feats = feats.to(feats0.dtype)
         p_len = torch.tensor([p_len], device=self.device).long()
-        with torch.no_grad():
+        with torch.no_grad(), tracing.span("synthesizer"):
             if pitch != None and pitchf != None:
                 audio1 = (
                     (net_g.infer(feats, p_len, pitch, pitchf, sid)[0][0, 0])
@@ -495,6 +527,8 @@ class VC(object):
         protect,
         crepe_hop_length,
         f0_file=None,
+        skip_silence=False,
+        stats=None,
     ):
         if (
             file_index != ""
@@ -504,6 +538,8 @@ class VC(object):
             and index_rate != 0
         ):
             try:
+                import faiss
+
                 index = faiss.read_index(file_index)
                 # big_npy = np.load(file_big_npy)
                 big_npy = index.reconstruct_n(0, index.ntotal)
@@ -512,28 +548,9 @@ class VC(object):
                 index = big_npy = None
         else:
             index = big_npy = None
-        audio = signal.filtfilt(bh, ah, audio)
-        audio_pad = np.pad(audio, (self.window // 2, self.window // 2), mode="reflect")
-        opt_ts = []
-        if audio_pad.shape[0] > self.t_max:
-            audio_sum = np.zeros_like(audio)
-            for i in range(self.window):
-                audio_sum += audio_pad[i : i - self.window]
-            for t in range(self.t_center, audio.shape[0], self.t_center):
-                opt_ts.append(
-                    t
-                    - self.t_query
-                    + np.where(
-                        np.abs(audio_sum[t - self.t_query : t + self.t_query])
-                        == np.abs(audio_sum[t - self.t_query : t + self.t_query]).min()
-                    )[0][0]
-                )
-        s = 0
-        audio_opt = []
-        t = None
-        t1 = ttime()
-        audio_pad = np.pad(audio, (self.t_pad, self.t_pad), mode="reflect")
-        p_len = audio_pad.shape[0] // self.window
+        _job_harvest_cache.set({})
+        with tracing.span("highpass"):
+            audio = signal.filtfilt(bh, ah, audio)
         inp_f0 = None
         if hasattr(f0_file, "name") == True:
             try:
@@ -546,18 +563,122 @@ class VC(object):
             except:
                 traceback.print_exc()
         sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+        if skip_silence and inp_f0 is not None:
+            print("An f0 file was given, silence skipping disabled")
+            skip_silence = False
+        with tracing.span("segmentation", skip_silence=skip_silence):
+            spans = silent_spans(audio, self.window) if skip_silence else []
+        args = (
+            model,
+            net_g,
+            sid,
+            times,
+            f0_up_key,
+            f0_method,
+            index,
+            big_npy,
+            index_rate,
+            if_f0,
+            filter_radius,
+            version,
+            protect,
+            crepe_hop_length,
+        )
+        if not spans:
+            audio_opt = self.convert_region(audio, input_audio_path, inp_f0, *args)
+        else:
+            # convert the voiced regions only, keeping the original timing
+            bounds = [(0, 0)]
+            for silence_start, silence_end in spans + [(len(audio), len(audio))]:
+                bounds.append((silence_start, silence_end))
+            audio_opt = []
+            for (_, start), (end, silence_end) in zip(bounds, bounds[1:]):
+                tgt_start, tgt_end, tgt_silence_end = (
+                    i * tgt_sr // self.sr for i in (start, end, silence_end)
+                )
+                if end > start:
+                    region = self.convert_region(
+                        audio[start:end],
+                        "%s@%d" % (input_audio_path, start),
+                        None,
+                        *args,
+                    )[: tgt_end - tgt_start]
+                    audio_opt.append(region)
+                    audio_opt.append(
+                        np.zeros(tgt_end - tgt_start - len(region), np.float32)
+                    )
+                audio_opt.append(np.zeros(tgt_silence_end - tgt_end, np.float32))
+            audio_opt = np.concatenate(audio_opt)
+        skipped = sum(e - s for s, e in spans) / max(len(audio), 1)
+        if skip_silence:
+            print("Skipped %.1f%% of the input as silence" % (skipped * 100))
+        if stats is not None:
+            stats["skipped_ratio"] = skipped
+        if rms_mix_rate != 1:
+            with tracing.span("rms_mix"):
+                audio_opt = change_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
+        if resample_sr >= 16000 and tgt_sr != resample_sr:
+            import librosa
+
+            audio_opt = librosa.resample(
+                audio_opt, orig_sr=tgt_sr, target_sr=resample_sr
+            )
+        audio_max = np.abs(audio_opt).max() / 0.99
+        max_int16 = 32768
+        if audio_max > 1:
+            max_int16 /= audio_max
+        audio_opt = (audio_opt * max_int16).astype(np.int16)
+        del sid
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return audio_opt
+
+    def convert_region(
+        self,
+        audio,
+        input_audio_path,
+        inp_f0,
+        model,
+        net_g,
+        sid,
+        times,
+        f0_up_key,
+        f0_method,
+        index,
+        big_npy,
+        index_rate,
+        if_f0,
+        filter_radius,
+        version,
+        protect,
+        crepe_hop_length,
+    ):
+        opt_ts = []
+        if audio.shape[0] + self.window // 2 * 2 > self.t_max:
+            with tracing.span("segmentation"):
+                opt_ts = find_split_points(
+                    audio, self.window, self.t_center, self.t_query
+                )
+        tracing.count("segments", len(opt_ts) + 1)
+        s = 0
+        audio_opt = []
+        t = None
+        t1 = ttime()
+        audio_pad = np.pad(audio, (self.t_pad, self.t_pad), mode="reflect")
+        p_len = audio_pad.shape[0] // self.window
         pitch, pitchf = None, None
         if if_f0 == 1:
-            pitch, pitchf = self.get_f0(
-                input_audio_path,
-                audio_pad,
-                p_len,
-                f0_up_key,
-                f0_method,
-                filter_radius,
-                crepe_hop_length,
-                inp_f0,
-            )
+            with tracing.span("f0", method=f0_method):
+                pitch, pitchf = self.get_f0(
+                    input_audio_path,
+                    audio_pad,
+                    p_len,
+                    f0_up_key,
+                    f0_method,
+                    filter_radius,
+                    crepe_hop_length,
+                    inp_f0,
+                )
             pitch = pitch[:p_len]
             pitchf = pitchf[:p_len]
             if self.device == "mps":
@@ -583,7 +704,7 @@ class VC(object):
                         index_rate,
                         version,
                         protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
+                    )
                 )
             else:
                 audio_opt.append(
@@ -600,7 +721,7 @@ class VC(object):
                         index_rate,
                         version,
                         protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
+                    )
                 )
             s = t
         if if_f0 == 1:
@@ -618,7 +739,7 @@ class VC(object):
                     index_rate,
                     version,
                     protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
+                )
             )
         else:
             audio_opt.append(
@@ -635,21 +756,8 @@ class VC(object):
                     index_rate,
                     version,
                     protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
-            )
-        audio_opt = np.concatenate(audio_opt)
-        if rms_mix_rate != 1:
-            audio_opt = change_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
-        if resample_sr >= 16000 and tgt_sr != resample_sr:
-            audio_opt = librosa.resample(
-                audio_opt, orig_sr=tgt_sr, target_sr=resample_sr
+                )
             )
-        audio_max = np.abs(audio_opt).max() / 0.99
-        max_int16 = 32768
-        if audio_max > 1:
-            max_int16 /= audio_max
-        audio_opt = (audio_opt * max_int16).astype(np.int16)
-        del pitch, pitchf, sid
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        audio_opt = stitch_segments(audio_opt, self.t_pad_tgt, self.t_fade_tgt)
+        del pitch, pitchf
         return audio_opt
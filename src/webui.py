@@ -1,5 +1,6 @@
 import logging
 import os
+import shutil
 import urllib.parse
 import urllib.request
 import zipfile
@@ -7,7 +8,10 @@ import zipfile
 import gradio as gr
 import torch
 
-from rvc import Config, get_vc, load_hubert, rvc_infer
+import metrics
+import tracing
+import workspace
+from rvc import get_config, get_vc, load_hubert, rvc_infer
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -15,6 +19,8 @@ logger = logging.getLogger(__name__)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 rvc_models_dir = os.path.join(BASE_DIR, "rvc_models")
 output_dir = os.path.join(BASE_DIR, "voice_output")
+# converted files kept in output_dir, older ones are removed
+KEEP_OUTPUTS = int(os.getenv("RVC_WEBUI_KEEP_OUTPUTS", "20"))
 
 device = "cuda:0" if torch.cuda.is_available() else "cpu"
 is_half = False if device == "cpu" else True
@@ -32,7 +38,14 @@ print(f"Using device: {device}")
 def get_current_models(models_dir):
     models_list = os.listdir(models_dir)
     items_to_remove = ["hubert_base.pt", "MODELS.txt", "public_models.json", "rmvpe.pt"]
-    return [item for item in models_list if item not in items_to_remove]
+    # dot-entries are model_fetcher's staging folders (.downloads, .tmp-*, .old-*)
+    return [
+        item
+        for item in models_list
+        if item not in items_to_remove
+        and not item.startswith(".")
+        and os.path.isdir(os.path.join(models_dir, item))
+    ]
 
 
 def update_models_list():
@@ -109,7 +122,7 @@ def load_rvc_model(rvc_model):
                 f"No .pth file found in RVC model directory: {model_dir}"
             )
 
-    config = Config(device, is_half)
+    config = get_config(device, is_half)
     return get_vc(device, is_half, config, model_path)
 
 
@@ -123,43 +136,89 @@ def voice_conversion(
     rms_mix_rate,
     protect,
 ):
-    try:
-        hubert_model = load_hubert(
-            device, is_half, os.path.join(rvc_models_dir, "hubert_base.pt")
-        )
-        cpt, version, net_g, tgt_sr, vc = load_rvc_model(rvc_model)
-
-        output_filename = os.path.join(
-            output_dir, f"converted_{os.path.basename(input_audio)}"
-        )
-        output_filename = os.path.splitext(output_filename)[0] + ".wav"
-        os.makedirs(output_dir, exist_ok=True)
-
-        rvc_infer(
-            "",
-            index_rate,
+    with tracing.span("request"), metrics.track_job():
+        return _voice_conversion(
             input_audio,
-            output_filename,
+            rvc_model,
             pitch,
             f0_method,
-            cpt,
-            version,
-            net_g,
+            index_rate,
             filter_radius,
-            tgt_sr,
             rms_mix_rate,
             protect,
-            160,
-            vc,
-            hubert_model,
         )
 
+
+def _voice_conversion(
+    input_audio,
+    rvc_model,
+    pitch,
+    f0_method,
+    index_rate,
+    filter_radius,
+    rms_mix_rate,
+    protect,
+):
+    try:
+        hubert_model = load_hubert(
+            device, is_half, os.path.join(rvc_models_dir, "hubert_base.pt")
+        )
+        cpt, version, net_g, tgt_sr, vc = load_rvc_model(rvc_model)
+
+        # converted in a directory of its own, removed afterwards, so
+        # concurrent conversions of files with the same name do not collide
+        with workspace.Workspace() as job:
+            rvc_infer(
+                "",
+                index_rate,
+                input_audio,
+                job.path("output.wav"),
+                pitch,
+                f0_method,
+                cpt,
+                version,
+                net_g,
+                filter_radius,
+                tgt_sr,
+                rms_mix_rate,
+                protect,
+                160,
+                vc,
+                hubert_model,
+            )
+            # gradio serves the output after this returns
+            name = os.path.splitext(os.path.basename(input_audio))[0]
+            output_filename = os.path.join(
+                output_dir, f"converted_{name}-{job.job_id[:8]}.wav"
+            )
+            os.makedirs(output_dir, exist_ok=True)
+            shutil.move(job.path("output.wav"), output_filename)
+        _remove_old_outputs()
         return output_filename
     except Exception as e:
         raise gr.Error(f"Voice conversion failed: {str(e)}")
 
 
+def _remove_old_outputs(keep=KEEP_OUTPUTS):
+    outputs = []
+    for entry in os.scandir(output_dir):
+        if entry.name.startswith("converted_"):
+            try:
+                outputs.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                # removed by a concurrent conversion
+                pass
+    outputs.sort(reverse=True)
+    for _, path in outputs[keep:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
 if __name__ == "__main__":
+    if metrics.PORT:
+        metrics.start_http_server()
     voice_models = get_current_models(rvc_models_dir)
 
     with gr.Blocks(title="RVC Voice Changer") as app:
@@ -0,0 +1,367 @@
+"""Multi-process CPU serving with model weights shared between workers.
+
+The parent process loads HuBERT, RMVPE and the voice models once, moves
+their tensors to shared memory and then starts the workers. Forked workers
+reference the parent's pages instead of copying them, so each extra worker
+only costs its activations. ``plan_workers`` splits the physical cores into
+one set per worker; each worker is pinned to its set and sizes its thread
+pools to it, so concurrent conversions do not oversubscribe the cores.
+``python -m benchmarks.throughput`` compares splits on a given host.
+
+    registry = ModelRegistry("cpu", False)
+    registry.preload(["Obama"])
+    with WorkerPool(registry, processes=4) as pool:
+        for result in pool.map(jobs):
+            print(result)
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from time import perf_counter
+
+import torch
+import torch.multiprocessing as mp
+
+import autotune
+import metrics
+from main import get_rvc_model, output_dir, rvc_models_dir
+from rvc import get_config, get_vc, load_hubert, rvc_infer
+from vc_infer_pipeline import VC
+
+
+class ModelRegistry:
+    """Voice models loaded once per process and kept in LRU order.
+
+    ``stats`` counts cache hits, misses and evictions. ``max_models`` bounds
+    the number of voice models kept at once, ``None`` keeps all of them. A
+    model whose ``.pth`` changed on disk since it was loaded (e.g. replaced
+    by ``download_online_model``) is loaded again. Segments are sized for
+    ``concurrency`` jobs running at once on the device, see ``autotune.tune``.
+    """
+
+    def __init__(self, device, is_half, max_models=None, concurrency=None):
+        self.device = device
+        self.is_half = is_half
+        self.max_models = max_models
+        self.concurrency = concurrency
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._models = OrderedDict()
+        # name -> identity of the .pth file the entry was loaded from
+        self._stamps = {}
+        self._lock = threading.Lock()
+        self._hubert = None
+        self._rmvpe = None
+        metrics.watch_cache("model", self)
+
+    def hubert(self):
+        if self._hubert is None:
+            self._hubert = load_hubert(
+                self.device,
+                self.is_half,
+                os.path.join(rvc_models_dir, "hubert_base.pt"),
+            )
+        return self._hubert
+
+    def rmvpe(self):
+        path = os.path.join(rvc_models_dir, "rmvpe.pt")
+        if self._rmvpe is None and os.path.exists(path):
+            from rmvpe import RMVPE
+
+            self._rmvpe = RMVPE(path, is_half=self.is_half, device=self.device)
+        return self._rmvpe
+
+    @staticmethod
+    def _stamp(rvc_model):
+        # None for models that have no folder, e.g. synthetic ones
+        try:
+            path = get_rvc_model(rvc_model)
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return path, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, rvc_model):
+        """Return ``(cpt, version, net_g, tgt_sr, vc)`` for a voice model."""
+        with self._lock:
+            stamp = self._stamp(rvc_model)
+            if rvc_model in self._models:
+                if self._stamps.get(rvc_model) == stamp:
+                    self.stats["hits"] += 1
+                    self._models.move_to_end(rvc_model)
+                    return self._models[rvc_model]
+                # replaced on disk: the loaded weights are stale
+                del self._models[rvc_model]
+                self.stats["evictions"] += 1
+            self.stats["misses"] += 1
+            entry = get_vc(
+                self.device,
+                self.is_half,
+                get_config(self.device, self.is_half),
+                get_rvc_model(rvc_model),
+                self.concurrency,
+            )
+            if self.rmvpe() is not None:
+                entry[4].model_rmvpe = self._rmvpe
+            self._models[rvc_model] = entry
+            self._stamps[rvc_model] = stamp
+            if self.max_models is not None and len(self._models) > self.max_models:
+                evicted, _ = self._models.popitem(last=False)
+                self._stamps.pop(evicted, None)
+                self.stats["evictions"] += 1
+            return entry
+
+    def segment_seconds(self, rvc_model):
+        """``x_max`` the model is converted with if it is loaded, or ``None``."""
+        with self._lock:
+            if self._stamps.get(rvc_model, False) != self._stamp(rvc_model):
+                return None
+            return self._models[rvc_model][4].x_max
+
+    def set_concurrency(self, concurrency):
+        """Size the segments of loaded and later models for ``concurrency`` jobs."""
+        with self._lock:
+            self.concurrency = concurrency
+            config = get_config(self.device, self.is_half)
+            for name, entry in list(self._models.items()):
+                cpt, version, net_g, tgt_sr, vc = entry
+                # the profile is cached, this only picks new segment sizes
+                tuned = autotune.tune(config, version, tgt_sr, concurrency)
+                retuned = VC(tgt_sr, tuned)
+                if hasattr(vc, "model_rmvpe"):
+                    retuned.model_rmvpe = vc.model_rmvpe
+                self._models[name] = (cpt, version, net_g, tgt_sr, retuned)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def preload(self, rvc_models):
+        for rvc_model in rvc_models:
+            self.get(rvc_model)
+
+    def share_memory(self):
+        """Move every loaded weight to shared memory."""
+        modules = [self.hubert()]
+        if self.rmvpe() is not None:
+            modules += [self._rmvpe.model, self._rmvpe.mel_extractor]
+        modules += [entry[2] for entry in self._models.values()]
+        for module in modules:
+            module.share_memory()
+        return self
+
+
+_registry = None
+_plan = None  # the thread plan of this worker
+
+
+def cpu_topology():
+    """Group the CPUs this process may run on by socket and physical core.
+
+    Returns a list of sockets, each a list of cores, each a list of the
+    logical CPU ids (SMT siblings) of that core.
+    """
+    cores = {}
+    for cpu in sorted(os.sched_getaffinity(0)):
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology/"
+        try:
+            with open(topology + "physical_package_id") as f:
+                package = int(f.read())
+            with open(topology + "core_id") as f:
+                core = int(f.read())
+        except (OSError, ValueError):
+            package, core = 0, cpu
+        cores.setdefault((package, core), []).append(cpu)
+    sockets = {}
+    for (package, _), cpus in sorted(cores.items()):
+        sockets.setdefault(package, []).append(cpus)
+    return list(sockets.values())
+
+
+def plan_workers(processes=None, threads=None):
+    """Split the physical cores into one core set per worker process.
+
+    Each worker is pinned to whole cores (with their SMT siblings), taken in
+    socket order so that a worker stays on one socket where the split allows
+    it, and runs one intra-op thread per physical core unless ``threads`` is
+    given. Without ``processes``, each worker gets ``threads`` or 4 cores.
+    Returns a list of ``{"cpus", "intra_op", "inter_op"}`` dicts.
+    """
+    cores = [core for socket in cpu_topology() for core in socket]
+    if processes is None:
+        processes = max(1, len(cores) // (threads or 4))
+    plan = []
+    for i in range(processes):
+        if processes <= len(cores):
+            share = cores[
+                i * len(cores) // processes : (i + 1) * len(cores) // processes
+            ]
+        else:
+            # more workers than cores: they share cores round-robin
+            share = [cores[i % len(cores)]]
+        plan.append(
+            {
+                "cpus": sorted(cpu for core in share for cpu in core),
+                "intra_op": threads or len(share),
+                "inter_op": 1,
+            }
+        )
+    return plan
+
+
+def configure_threads(intra_op, inter_op=1, cpus=None):
+    """Pin this process to ``cpus`` and size the torch, OpenMP and BLAS pools."""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        # read by libraries that start their thread pools later on
+        os.environ[var] = str(intra_op)
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        # already set, or inter-op work happened in the parent before the fork
+        pass
+    if "faiss" in sys.modules:
+        sys.modules["faiss"].omp_set_num_threads(intra_op)
+
+
+def _init_worker(registry, plans, started):
+    global _registry, _plan
+    _registry = registry
+    # each worker takes the next plan; a queue read right after the fork can
+    # miss items its feeder thread has not written yet
+    with started.get_lock():
+        i = started.value
+        started.value += 1
+    if i < len(plans):
+        plan = plans[i]
+    else:
+        # a replacement worker: keep the inherited affinity
+        plan = {"cpus": None, "intra_op": torch.get_num_threads(), "inter_op": 1}
+    _plan = plan
+    configure_threads(plan["intra_op"], plan["inter_op"], plan["cpus"])
+
+
+def private_memory():
+    """Bytes this process does not share with others (Private_* in smaps)."""
+    total = 0
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                    total += int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return total
+
+
+def convert(job):
+    """Run one conversion job in a worker and return a result dict."""
+    result = {"id": job.get("id"), "pid": os.getpid()}
+    t0 = perf_counter()
+    tmp_path = None
+    try:
+        rvc_model = job["rvc_model"]
+        cpt, version, net_g, tgt_sr, vc = _registry.get(rvc_model)
+        output_path = job.get("output_path") or os.path.join(
+            output_dir,
+            os.path.splitext(f"converted_{os.path.basename(job['input_audio'])}")[0]
+            + ".wav",
+        )
+        out_dir, out_name = os.path.split(os.path.abspath(output_path))
+        os.makedirs(out_dir, exist_ok=True)
+        # written under a temporary name, so an interrupted job leaves no output
+        tmp_path = os.path.join(out_dir, f".{os.getpid()}.tmp-{out_name}")
+        result["stats"] = rvc_infer(
+            "",
+            job.get("index_rate", 0.5),
+            job["input_audio"],
+            tmp_path,
+            job.get("pitch", 0),
+            job.get("f0_method", "rmvpe"),
+            cpt,
+            version,
+            net_g,
+            job.get("filter_radius", 3),
+            tgt_sr,
+            job.get("rms_mix_rate", 0.25),
+            job.get("protect", 0.33),
+            160,
+            vc,
+            _registry.hubert(),
+            skip_silence=job.get("skip_silence", False),
+        )
+        os.replace(tmp_path, output_path)
+        result["output_path"] = output_path
+    except Exception as e:
+        result["error"] = str(e)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    result["seconds"] = perf_counter() - t0
+    result["private_bytes"] = private_memory()
+    return result
+
+
+class WorkerPool:
+    """Process pool whose workers share the weights held by ``registry``.
+
+    With the ``fork`` start method the workers inherit the registry
+    directly. With ``spawn`` it is sent to them through
+    ``torch.multiprocessing``, which passes shared tensors by handle. The
+    default is ``fork`` on CPUs and ``spawn`` on CUDA, which cannot be used
+    again in a process forked after the parent initialized it. The registry's
+    models, including those the workers load later, get segments sized for
+    ``processes`` conversions sharing the memory.
+    """
+
+    def __init__(self, registry, processes=None, threads=None, pin=True, method=None):
+        self.registry = registry
+        processes = processes or int(os.getenv("RVC_WORKERS", "0")) or None
+        threads = threads or int(os.getenv("RVC_THREADS", "0")) or None
+        self.plan = plan_workers(processes, threads)
+        if not pin:
+            for worker in self.plan:
+                worker["cpus"] = None
+        self.processes = len(self.plan)
+        registry.set_concurrency(self.processes)
+        if method is None:
+            cuda = str(registry.device).startswith("cuda")
+            method = "spawn" if cuda else "fork"
+        self.method = method
+        self._pool = None
+
+    def start(self):
+        self.registry.share_memory()
+        ctx = mp.get_context(self.method)
+        self._pool = ctx.Pool(
+            self.processes,
+            initializer=_init_worker,
+            initargs=(self.registry, self.plan, ctx.Value("i", 0)),
+        )
+        return self
+
+    def map(self, jobs, chunksize=1):
+        """Yield the results of ``jobs`` as they complete.
+
+        Each worker takes ``chunksize`` consecutive jobs at a time.
+        """
+        return self._pool.imap_unordered(convert, jobs, chunksize)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
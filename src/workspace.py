@@ -0,0 +1,43 @@
+"""Per-job working directories.
+
+Every job gets its own directory named after a unique job id, so concurrent
+jobs never share input, intermediate or output files. The directory is
+removed when the job ends, whether it succeeded or failed.
+
+    with Workspace() as ws:
+        output_path = ws.path("output.mp3")
+"""
+
+import os
+import shutil
+import tempfile
+import uuid
+
+WORK_DIR = os.getenv("RVC_WORK_DIR", os.path.join(tempfile.gettempdir(), "rvc-jobs"))
+
+
+class Workspace:
+    def __init__(self, job_id=None, root=WORK_DIR, keep=False):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.root = root
+        self.keep = keep
+        self.dir = None
+
+    def path(self, name):
+        """Path of ``name`` inside the workspace."""
+        return os.path.join(self.dir, os.path.basename(name))
+
+    def open(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.dir = tempfile.mkdtemp(dir=self.root, prefix=self.job_id + "-")
+        return self
+
+    def close(self):
+        if self.dir is not None and not self.keep:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,125 @@
+import pytest
+
+import admission
+
+MiB = 1 << 20
+
+COSTS = {
+    "calibration_seconds": 0.05,
+    "segment_seconds": 60,
+    "hubert_bytes": 100 * MiB,
+    "rmvpe_bytes": 100 * MiB,
+    "models": {
+        # 0.1 s and 10 MiB per second of segment, plus a quadratic term
+        "v2-40000": {
+            "seconds": [0.001, 0.1, 0.0],
+            "memory": [0.1 * MiB, 10 * MiB, 0.0],
+            "weights_bytes": 50 * MiB,
+        },
+        "v1-32000": {
+            "seconds": [0.0, 0.05, 0.0],
+            "memory": [0.0, 5 * MiB, 0.0],
+            "weights_bytes": 50 * MiB,
+        },
+    },
+    "f0": {
+        "pm": {"seconds": [0.0, 0.01, 0.0], "memory": [0.0, 0.1 * MiB, 0.0]},
+        "rmvpe": {"seconds": [0.0, 0.05, 0.0], "memory": [0.0, 20 * MiB, 0.0]},
+        "crepe": {"seconds": [0.0, 0.5, 0.0], "memory": [0.0, 1 * MiB, 0.0]},
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def costs(monkeypatch):
+    monkeypatch.setattr(admission, "_costs", COSTS)
+    monkeypatch.setattr(admission, "SPEED", "1")
+
+
+def _model(seconds, segment):
+    c, b, a = COSTS["models"]["v2-40000"]["seconds"]
+    per_segment = c * segment**2 + b * segment + a
+    return per_segment * seconds / segment
+
+
+def test_short_input_is_one_segment():
+    est = admission.estimate(10, "pm", "v2", 40000)
+    assert est.seconds == pytest.approx(_model(10, 10) + 0.1)
+    assert est.memory_bytes == pytest.approx(110 * MiB, abs=1)
+
+
+def test_memory_stops_growing_past_one_segment():
+    short = admission.estimate(20, "pm", "v2", 40000, segment_seconds=20)
+    long = admission.estimate(200, "pm", "v2", 40000, segment_seconds=20)
+    assert long.memory_bytes == short.memory_bytes
+    # ten segments of the same cost, plus f0 on the whole input
+    assert long.seconds == pytest.approx(10 * _model(20, 20) + 2.0)
+
+
+def test_segment_seconds_of_the_tuned_model():
+    est = admission.estimate(120, "pm", "v2", 40000, segment_seconds=30)
+    assert est.seconds == pytest.approx(_model(120, 30) + 1.2)
+    # the default and longer segments are held to the calibrated range
+    for segment in (None, 90):
+        est = admission.estimate(120, "pm", "v2", 40000, segment_seconds=segment)
+        assert est.seconds == pytest.approx(_model(120, 60) + 1.2)
+
+
+def test_hybrid_sums_times_and_takes_the_largest_memory():
+    pm = admission.estimate(10, "pm", "v1", 32000)
+    rmvpe = admission.estimate(10, "rmvpe", "v1", 32000)
+    hybrid = admission.estimate(10, "hybrid[pm+rmvpe]", "v1", 32000)
+    model_seconds = 0.05 * 10
+    assert hybrid.seconds == pytest.approx(model_seconds + 0.1 + 0.5)
+    assert hybrid.memory_bytes == max(pm.memory_bytes, rmvpe.memory_bytes)
+
+
+def test_unknown_models_and_methods_cost_the_worst_case():
+    known = admission.estimate(10, "pm", "v2", 40000)
+    assert admission.estimate(10, "pm") == known
+    # the closest calibrated sample rate of the version
+    assert admission.estimate(10, "pm", "v2", 48000) == known
+    assert admission.estimate(10, "unknown", "v1", 32000) == admission.estimate(
+        10, "crepe", "v1", 32000
+    )
+
+
+def test_speed_divides_the_seconds():
+    base = admission.estimate(10, "pm", "v2", 40000)
+    fast = admission.estimate(10, "pm", "v2", 40000, speed=2)
+    assert fast.seconds == pytest.approx(base.seconds / 2)
+    assert fast.memory_bytes == base.memory_bytes
+
+
+def test_controller_downgrades_then_rejects():
+    controller = admission.Controller(memory_bytes=300 * MiB)
+    assert controller.decide(10, "rmvpe", "v2", 40000).action == "admit"
+    # rmvpe needs 20 MiB per second of input, pm fits
+    decision = controller.decide(20, "rmvpe", "v2", 40000)
+    assert decision.action == "downgrade" and decision.f0_method == "pm"
+    assert controller.decide(120, "pm", "v2", 40000).action == "reject"
+
+
+@pytest.mark.parametrize("zipfile", [True, False])
+def test_model_info_without_an_artifact(tmp_path, zipfile):
+    import torch
+
+    cpt = {"config": [1025, 32, 48000], "version": "v2", "weight": {}}
+    torch.save(cpt, str(tmp_path / "voice.pth"), _use_new_zipfile_serialization=zipfile)
+    assert admission.model_info(str(tmp_path)) == ("v2", 48000)
+    (tmp_path / "voice.pth").write_bytes(b"truncated")
+    assert admission.model_info(str(tmp_path)) == (None, None)
+    assert admission.model_info(str(tmp_path / "missing")) == (None, None)
+
+
+def test_speed_is_measured_at_the_first_decision(monkeypatch):
+    measured = []
+    monkeypatch.setattr(
+        admission, "measure_speed", lambda device: measured.append(device) or 2.0
+    )
+    controller = admission.Controller(memory_bytes=300 * MiB)
+    assert measured == []
+    for _ in range(2):
+        decision = controller.decide(10, "pm", "v2", 40000)
+    assert measured == ["cpu"]
+    assert decision.estimate == admission.estimate(10, "pm", "v2", 40000, speed=2.0)
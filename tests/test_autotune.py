@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import autotune
+
+SECONDS = [2, 4, 8, 16, 32]
+
+
+def test_fit_recovers_a_quadratic():
+    values = [3 * s * s + 2 * s + 1 for s in SECONDS]
+    np.testing.assert_allclose(autotune._fit(SECONDS, values), [3, 2, 1], atol=1e-6)
+
+
+def test_fit_of_concave_noise_is_a_rising_line():
+    values = [10, 19, 35, 62, 100]
+    c, b, a = autotune._fit(SECONDS, values)
+    assert c == 0 and b > 0
+    np.testing.assert_allclose([b, a], np.polyfit(SECONDS, values, 1), rtol=1e-6)
+
+
+def test_fit_keeps_the_curvature_when_the_slope_is_negative():
+    # a quadratic growth term must not be dropped for a line, which would
+    # under-predict long segments
+    values = [s * s - 3 * s + 50 for s in SECONDS]
+    c, b, a = autotune._fit(SECONDS, values)
+    assert b == 0 and c > 0.9
+    assert np.polyval([c, b, a], 90) >= 0.9 * np.polyval([1, -3, 50], 90)
+
+
+def _profile(memory_per_second=1e6):
+    return {
+        "probe_seconds": SECONDS,
+        "memory": {"hubert": [0, memory_per_second, 0], "decoder": [0, 1, 0]},
+        # a fixed cost per segment: longer segments are cheaper per second
+        "latency": [0, 0, 1],
+    }
+
+
+def test_segment_params_pick_the_longest_segment_within_the_probes():
+    # padded segments of at most twice the longest probe
+    assert autotune.segment_params(_profile(), budget=1e15) == (3, 10, 58, 63)
+
+
+def test_segment_params_fit_the_budget():
+    assert autotune.segment_params(_profile(), budget=30.5e6) == (1, 5, 28, 31)
+    # nothing fits: the shortest segment is used anyway
+    assert autotune.segment_params(_profile(), budget=1) == (1, 1, 5, 8)
+
+
+def test_segment_params_keep_a_fixed_pad():
+    x_pad, _, x_center, x_max = autotune.segment_params(
+        _profile(), budget=1e15, x_pad=0.5
+    )
+    assert (x_pad, x_center, x_max) == (0.5, 63, 65.5)
+
+
+@pytest.mark.parametrize("longest", [8, 64])
+def test_segment_params_follow_the_probes_of_the_profile(longest):
+    profile = dict(_profile(), probe_seconds=[2, 4, longest])
+    _, _, x_center, _ = autotune.segment_params(profile, budget=1e15)
+    x_pad = min(3, max(1, round(x_center / 20)))
+    assert x_center + 2 * x_pad <= min(2 * longest, autotune.MAX_CENTER + 6)
+
+
+def test_tune_only_reads_stored_profiles(tmp_path, monkeypatch):
+    from rvc import get_config
+
+    def probe(*args):
+        raise AssertionError("tune must not probe")
+
+    monkeypatch.setattr(autotune, "probe", probe)
+    monkeypatch.setattr(autotune, "CACHE_PATH", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(autotune, "_profiles", {})
+    monkeypatch.setattr(autotune, "available_memory", lambda device: 1e15)
+    config = get_config("cpu", False)
+    # not probed: the fixed table stays
+    assert autotune.tune(config, "v2", 40000) is config
+
+    key = autotune.profile_key("cpu", False, "v2", 40000)
+    autotune._store_cache(key, _profile())
+    # what this process read is kept until it restarts
+    assert autotune.tune(config, "v2", 40000) is config
+    monkeypatch.setattr(autotune, "_profiles", {})
+    tuned = autotune.tune(config, "v2", 40000)
+    assert (tuned.x_pad, tuned.x_query, tuned.x_center, tuned.x_max) == (3, 10, 58, 63)
+    assert tuned.segment_params["source"] == "profile"
+
+    # profiles of other probe lengths are ignored
+    autotune._store_cache(key, dict(_profile(), probe_seconds=[2, 4, 8]))
+    monkeypatch.setattr(autotune, "_profiles", {})
+    assert autotune.tune(config, "v1", 40000) is config
+    assert autotune.tune(config, "v2", 40000) is config
@@ -0,0 +1,18 @@
+import shutil
+
+import pytest
+
+from benchmarks import concurrency, synthetic
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None, reason="ffmpeg is not installed"
+)
+
+
+def test_overlapping_conversions_match_serial_runs():
+    registry = concurrency.synthetic_registry(["32k"])
+    # harvest caches f0 by input path, which is the same in every workspace
+    result = concurrency.compare(
+        registry, "32k", synthetic.speech(2), jobs=3, threads=3, f0_method="harvest"
+    )
+    assert concurrency.matches(result, tolerance=0.05), result
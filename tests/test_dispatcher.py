@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import dispatcher
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Webhook receiver and file store: answers with the queued statuses,
+    then 200, and keeps what it was sent."""
+
+    def _answer(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+            if status == 200:
+                self.server.received.append((self.command, self.path, body))
+        time.sleep(self.server.delay)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_POST = do_PUT = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.lock = threading.Lock()
+    httpd.statuses, httpd.received, httpd.delay = [], [], 0.0
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(dispatcher, "backoff", lambda attempt, base=0: 0.01)
+    monkeypatch.setattr(dispatcher, "SCAN_SECONDS", 0.02)
+
+
+def _payloads(server):
+    return [json.loads(body) for _, _, body in server.received]
+
+
+def test_delivers_after_retries(server, tmp_path):
+    server.statuses = [500, 503]
+    webhooks = dispatcher.Dispatcher(str(tmp_path)).start()
+    webhooks.post(server.url + "/hook", {"id": 1})
+    assert webhooks.flush(5)
+    assert _payloads(server) == [{"id": 1}]
+    assert webhooks.stats == {"delivered": 1, "retried": 2, "failed": 0}
+
+
+def test_rejected_webhook_is_moved_to_failed(server, tmp_path):
+    server.statuses = [404]
+    webhooks = dispatcher.Dispatcher(str(tmp_path)).start()
+    record_id = webhooks.post(server.url + "/hook", {"id": 1})
+    assert webhooks.flush(5)
+    with open(tmp_path / "failed" / f"{record_id}.json") as f:
+        assert json.load(f)["error"] == "HTTP 404"
+    assert server.received == []
+
+
+def test_shared_outbox_delivers_once(server, tmp_path):
+    server.delay = 0.02
+    for i in range(40):
+        dispatcher._write_record(
+            str(tmp_path / f"{i:04d}.json"),
+            {"url": server.url, "payload": {"id": i}, "attempts": 0, "next_at": 0},
+        )
+    # two processes' worth of dispatchers scanning the same records
+    pair = [dispatcher.Dispatcher(str(tmp_path)).start() for _ in range(2)]
+    assert all(d.flush(20) for d in pair)
+    assert sorted(p["id"] for p in _payloads(server)) == list(range(40))
+
+
+def test_stale_claim_is_released(server, tmp_path):
+    claimed = str(tmp_path / "0001.claimed")
+    dispatcher._write_record(
+        claimed, {"url": server.url, "payload": {"id": 1}, "attempts": 0, "next_at": 0}
+    )
+    old = time.time() - dispatcher.CLAIM_SECONDS - 1
+    os.utime(claimed, (old, old))
+    fresh = str(tmp_path / "0002.claimed")
+    dispatcher._write_record(
+        fresh, {"url": server.url, "payload": {"id": 2}, "attempts": 0, "next_at": 0}
+    )
+    webhooks = dispatcher.Dispatcher(str(tmp_path)).start()
+    deadline = time.time() + 5
+    while not server.received and time.time() < deadline:
+        time.sleep(0.02)
+    time.sleep(0.1)
+    # the fresh claim belongs to a process still sending it
+    assert _payloads(server) == [{"id": 1}]
+    assert webhooks.pending() == ["0002.claimed"]
+
+
+def test_with_retries_uploads_to_file_store(server):
+    server.statuses = [503, 503]
+
+    def upload():
+        response = httpx.put(server.url + "/out.wav", content=b"audio")
+        response.raise_for_status()
+        return response
+
+    dispatcher.with_retries(upload, attempts=3, base=0.01)
+    assert server.received == [("PUT", "/out.wav", b"audio")]
+    server.statuses = [503] * 3
+    with pytest.raises(httpx.HTTPStatusError):
+        dispatcher.with_retries(upload, attempts=3, base=0.01)
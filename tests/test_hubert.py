@@ -0,0 +1,88 @@
+import sys
+import types
+
+import numpy as np
+import torch
+
+from benchmarks import synthetic
+from hubert import load_hubert_base
+
+SR = 16000
+
+
+def _fairseq_checkpoint(model, path, monkeypatch):
+    """Save ``model`` the way fairseq does: weight-normed ``pos_conv`` and the
+    training config pickled as fairseq objects."""
+    state = {k: v.clone() for k, v in model.state_dict().items()}
+    weight = state.pop("encoder.pos_conv.0.weight")
+    torch.manual_seed(1)
+    v = torch.randn_like(weight)
+    g = torch.rand(1, 1, weight.shape[2]) + 0.5
+    state["encoder.pos_conv.0.weight_v"] = v
+    state["encoder.pos_conv.0.weight_g"] = g
+
+    fairseq = types.ModuleType("fairseq")
+    config = type("FairseqConfig", (), {"__module__": "fairseq"})
+    fairseq.FairseqConfig = config
+    monkeypatch.setitem(sys.modules, "fairseq", fairseq)
+    cfg = config()
+    cfg.label_rate = 50
+    torch.save({"model": state, "cfg": cfg}, path)
+    # loading must not need fairseq
+    monkeypatch.delitem(sys.modules, "fairseq")
+    # the weight that fairseq's weight_norm(dim=2) computes from g and v
+    return torch._weight_norm(v, g, 2)
+
+
+def test_loads_a_fairseq_checkpoint(tmp_path, monkeypatch):
+    reference = synthetic.hubert()
+    path = str(tmp_path / "hubert_base.pt")
+    weight = _fairseq_checkpoint(reference, path, monkeypatch)
+    with torch.no_grad():
+        reference.encoder.pos_conv[0].weight.copy_(weight)
+
+    model = load_hubert_base(path).eval()
+    assert len(model.encoder.layers) == 12
+    torch.testing.assert_close(model.encoder.pos_conv[0].weight, weight)
+
+    source = torch.from_numpy(synthetic.speech(1.0, SR))[None]
+    with torch.no_grad():
+        for output_layer in (9, 12):
+            feats, mask = model.extract_features(
+                source, torch.zeros_like(source, dtype=torch.bool), output_layer
+            )
+            # 16 kHz to 50 Hz frames: 400 samples per frame, one every 320
+            assert feats.shape == (1, 49, 768)
+            assert mask is None
+            expected, _ = reference.extract_features(source, None, output_layer)
+            torch.testing.assert_close(feats, expected)
+        assert model.final_proj(feats).shape == (1, 49, 256)
+
+
+def test_padded_batch_matches_unpadded():
+    model = synthetic.hubert()
+    frames = 75
+    # one frame every 320 samples, each 400 long
+    long = synthetic.speech((frames * 320 + 80) / SR, SR, seed=1)
+    short = synthetic.speech(40 * 320 / SR, SR, seed=2)
+    batch = np.zeros((2, len(long)), dtype=np.float32)
+    batch[0] = long
+    batch[1, : len(short)] = short
+    padding_mask = torch.zeros(batch.shape, dtype=torch.bool)
+    padding_mask[1, len(short) :] = True
+
+    with torch.no_grad():
+        feats, mask = model.extract_features(
+            torch.from_numpy(batch), padding_mask, output_layer=12
+        )
+        assert feats.shape == (2, frames, 768)
+        # the last frame of the short row would reach 80 samples past its end
+        assert mask.tolist() == [[False] * frames, [False] * 39 + [True] * 36]
+        for row, audio in ((0, long), (1, short)):
+            alone, _ = model.extract_features(
+                torch.from_numpy(audio)[None], None, output_layer=12
+            )
+            valid = alone.shape[1]
+            torch.testing.assert_close(
+                feats[row, :valid], alone[0], rtol=1e-4, atol=1e-4
+            )
@@ -0,0 +1,196 @@
+import hashlib
+import io
+import os
+import queue
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import numpy as np
+import pytest
+import soundfile as sf
+
+import input_fetcher
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None, reason="ffmpeg is not installed"
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """``/ranged`` honours ranges, ``/plain`` ignores them, ``/drop`` closes
+    the connection halfway through the first response of every range and
+    ``/broken`` and ``/plain-broken`` halfway through every response.
+    ``/plain-unsized`` sends no length, and ``/slow-drop`` trickles the
+    bytes out and drops like ``/drop``."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.server.body
+        mode = self.path.strip("/").split(".")[0]
+        ranged = "Range" in self.headers and not mode.startswith("plain")
+        start, end = 0, len(body) - 1
+        if ranged:
+            first, _, last = self.headers["Range"].split("=")[1].partition("-")
+            start, end = int(first), min(int(last or end), end)
+        data = body[start : end + 1]
+        # recorded before the response, which a client may reject at once
+        with self.server.lock:
+            # a resumed range asks for a later start but the same end
+            resumed = any(r[0] == mode and r[2] == end for r in self.server.requests)
+            self.server.requests.append((mode, start, end))
+        drop = mode.endswith("broken") or (mode.endswith("drop") and not resumed)
+        self.send_response(206 if ranged else 200)
+        if mode == "plain-unsized":
+            # the body ends when the connection closes
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        else:
+            self.send_header("Content-Length", str(len(data)))
+        if ranged:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+            self.send_header("ETag", '"1"')
+        self.end_headers()
+        if drop:
+            data = data[: len(data) // 2]
+            self.close_connection = True
+        if mode.startswith("slow"):
+            for i in range(0, len(data), 2048):
+                self.wfile.write(data[i : i + 2048])
+                self.wfile.flush()
+                time.sleep(0.005)
+        else:
+            self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    rng = np.random.default_rng(0)
+    buf = io.BytesIO()
+    sf.write(
+        buf,
+        rng.uniform(-0.5, 0.5, 48000).astype(np.float32),
+        16000,
+        "PCM_16",
+        format="WAV",
+    )
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.body = buf.getvalue()
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch):
+    # a 96 kB input split into a first part and four ranges, each of which
+    # can hold two chunks ahead of the decoder
+    monkeypatch.setattr(input_fetcher, "FIRST_PART_BYTES", 16 << 10)
+    monkeypatch.setattr(input_fetcher, "MIN_PART_BYTES", 16 << 10)
+    monkeypatch.setattr(input_fetcher, "CHUNK_BYTES", 4 << 10)
+    monkeypatch.setattr(input_fetcher, "BUFFER_BYTES", 8 << 10)
+
+
+def _fetch(server, name, tmp_path, **limits):
+    url = f"http://127.0.0.1:{server.server_port}/{name}"
+    return input_fetcher.fetch_audio(url, parts=4, directory=str(tmp_path), **limits)
+
+
+@pytest.mark.parametrize(
+    "name", ["ranged.wav", "plain.wav", "plain-unsized.wav", "drop.wav"]
+)
+def test_fetch_audio(server, name, tmp_path):
+    fetched = _fetch(server, name, tmp_path)
+    with open(fetched.path, "rb") as f:
+        assert f.read() == server.body
+    assert fetched.sha256 == hashlib.sha256(server.body).hexdigest()
+    expected, _ = sf.read(io.BytesIO(server.body), dtype="float32")
+    np.testing.assert_allclose(fetched.audio, expected, atol=1e-4)
+    mode = name.split(".")[0]
+    requests = [r for r in server.requests if r[0] == mode]
+    # the first part and four ranges, each resumed once after a drop
+    assert (
+        len(requests) == {"ranged": 5, "plain": 1, "plain-unsized": 1, "drop": 10}[mode]
+    )
+
+
+def test_fetch_audio_resumes_on_a_slow_link(server, tmp_path, monkeypatch):
+    # the decoder falls behind, so ranges wait with their connections open
+    decoder_write = input_fetcher._Decoder.write
+
+    def slow_write(self, data):
+        time.sleep(0.01)
+        return decoder_write(self, data)
+
+    monkeypatch.setattr(input_fetcher._Decoder, "write", slow_write)
+    fetched = _fetch(server, "slow-drop.wav", tmp_path)
+    assert fetched.sha256 == hashlib.sha256(server.body).hexdigest()
+    requests = [r for r in server.requests if r[0] == "slow-drop"]
+    assert len(requests) == 10
+    # each range resumes from the last whole chunk before the drop instead
+    # of starting over
+    for end in {e for _, _, e in requests}:
+        first, resumed = sorted(s for _, s, e in requests if e == end)
+        cut = first + (end + 1 - first) // 2
+        assert first < resumed <= cut
+
+
+@pytest.mark.parametrize("name", ["ranged.wav", "plain.wav"])
+def test_fetch_audio_rejects_an_announced_size(server, name, tmp_path):
+    mode = name.split(".")[0]
+    seen = len([r for r in server.requests if r[0] == mode])
+    with pytest.raises(ValueError, match="the limit is 1000"):
+        _fetch(server, name, tmp_path, max_bytes=1000)
+    # only the first request, and nothing kept
+    assert len([r for r in server.requests if r[0] == mode]) == seen + 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_fetch_audio_limits_the_streamed_size(server, tmp_path):
+    with pytest.raises(ValueError, match="exceeds the limit of 50000 bytes"):
+        _fetch(server, "plain-unsized.wav", tmp_path, max_bytes=50000)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("name", ["ranged.wav", "plain.wav"])
+def test_fetch_audio_limits_the_duration(server, name, tmp_path):
+    # the input is 3 seconds long
+    with pytest.raises(ValueError, match="longer than 1.0 seconds"):
+        _fetch(server, name, tmp_path, max_seconds=1.0)
+    assert os.listdir(tmp_path) == []
+    assert len(_fetch(server, name, tmp_path, max_seconds=3.0).audio) == 48000
+
+
+@pytest.mark.parametrize("name", ["broken.wav", "plain-broken.wav"])
+def test_fetch_audio_fails_mid_stream(server, name, tmp_path, monkeypatch):
+    monkeypatch.setattr(input_fetcher.time, "sleep", lambda seconds: None)
+    with pytest.raises((RuntimeError, httpx.TransportError)):
+        _fetch(server, name, tmp_path)
+    # the partial download is removed
+    assert os.listdir(tmp_path) == []
+
+
+def test_stream_range_stops_while_blocked(server):
+    client = input_fetcher._client()
+    url = f"http://127.0.0.1:{server.server_port}/ranged.wav"
+    out, stop = queue.Queue(1), threading.Event()
+    reader = threading.Thread(
+        target=input_fetcher._stream_range,
+        args=(client, url, 0, len(server.body) - 1, None, out, stop),
+    )
+    reader.start()
+    time.sleep(0.3)
+    # one chunk queued, the next one waits for the decoder
+    assert reader.is_alive() and out.qsize() == 1
+    stop.set()
+    reader.join(2)
+    assert not reader.is_alive()
+    client.close()
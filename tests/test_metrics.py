@@ -0,0 +1,106 @@
+import math
+import re
+import shutil
+
+import httpx
+import pytest
+import soundfile as sf
+
+import main
+import metrics
+from benchmarks import concurrency, synthetic
+from result_cache import ResultCache
+
+SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$")
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def scrape(url):
+    """``{(name, labels): value}`` of a scrape, checking the text format."""
+    response = httpx.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples, types = {}, {}
+    for line in response.text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert kind in ("counter", "gauge", "histogram")
+            types[name] = kind
+            continue
+        if line.startswith("# HELP "):
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name, labels, value = match.groups()
+        # every series follows the TYPE of its metric
+        assert re.sub("_(bucket|sum|count)$", "", name) in types or name in types
+        labels = tuple(LABEL.findall(labels or ""))
+        assert (name, labels) not in samples, line
+        samples[name, labels] = float(value)
+    return samples, types
+
+
+def _buckets(samples, name, labels):
+    return sorted(
+        (math.inf if dict(l)["le"] == "+Inf" else float(dict(l)["le"]), v)
+        for (n, l), v in samples.items()
+        if n == name + "_bucket" and [p for p in l if p[0] != "le"] == list(labels)
+    )
+
+
+@pytest.fixture(scope="module")
+def url():
+    server = metrics.start_http_server(port=0, addr="127.0.0.1")
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_scrape(url, tmp_path):
+    requests = metrics.Counter("test_requests_total", 'Requests "quoted"', ("path",))
+    latency = metrics.Histogram(
+        "test_latency_seconds", "Latency", ("path",), buckets=(0.1, 1)
+    )
+    requests.inc(path='a"b\\c\n')
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, path="/x")
+    # caches are watched through weak references, this one lives to the scrape
+    cache = ResultCache(str(tmp_path))
+    cache.get("ab" * 32)
+
+    samples, types = scrape(url + "/metrics")
+    assert types["test_latency_seconds"] == "histogram"
+    assert samples["test_requests_total", (("path", 'a\\"b\\\\c\\n'),)] == 1
+    path = (("path", "/x"),)
+    assert _buckets(samples, "test_latency_seconds", path) == [
+        (0.1, 1),
+        (1.0, 2),
+        (math.inf, 3),
+    ]
+    assert samples["test_latency_seconds_count", path] == 3
+    assert samples["test_latency_seconds_sum", path] == 5.55
+    assert samples["rvc_cache_misses_total", (("cache", "result"),)] >= 1
+    assert httpx.get(url + "/other").status_code == 404
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_model_cache_series_follow_voice_conversion(url, tmp_path):
+    registry = concurrency.synthetic_registry(["32k"])
+    input_path = str(tmp_path / "input.wav")
+    sf.write(input_path, synthetic.speech(1), synthetic.SR)
+
+    def hits():
+        samples, _ = scrape(url + "/metrics")
+        return samples.get(("rvc_cache_hits_total", (("cache", "model"),)), 0)
+
+    before = hits()
+    for i in range(2):
+        main.voice_conversion(
+            input_path,
+            "32k",
+            f0_method="pm",
+            output_path=str(tmp_path / f"output{i}.wav"),
+            registry=registry,
+        )
+    # the models were loaded once, by synthetic_registry
+    assert hits() - before == 2
+    assert registry.stats == {"hits": 2, "misses": 0, "evictions": 0}
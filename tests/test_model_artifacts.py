@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+import torch
+
+import model_artifacts
+from benchmarks import synthetic
+
+
+@pytest.fixture(scope="module")
+def checkpoint(tmp_path_factory):
+    # a training checkpoint of the smallest architecture, weight norm included
+    cpt = synthetic.synthesizer_cpt("32k")
+    torch.manual_seed(0)
+    net_g = model_artifacts.build_synthesizer(cpt, is_half=False)
+    path = str(tmp_path_factory.mktemp("models") / "voice.pth")
+    torch.save(dict(cpt, weight=net_g.state_dict()), path)
+    return path
+
+
+@pytest.fixture
+def model_path(checkpoint, tmp_path):
+    path = str(tmp_path / "voice.pth")
+    with open(checkpoint, "rb") as src, open(path, "wb") as dst:
+        dst.write(src.read())
+    return path
+
+
+def _reference(model_path, is_half):
+    # the checkpoint path of get_vc
+    cpt = model_artifacts.load_checkpoint(model_path)
+    net_g = model_artifacts.build_synthesizer(cpt, is_half)
+    net_g.load_state_dict(cpt["weight"], strict=False)
+    model_artifacts._strip_weight_norm(net_g)
+    return cpt, net_g.half() if is_half else net_g.float()
+
+
+@pytest.mark.parametrize("is_half", [False, True])
+def test_artifact_round_trip(model_path, is_half):
+    path = model_artifacts.prepare(model_path, is_half)
+    assert path == model_artifacts.artifact_path(model_path, is_half)
+    assert model_artifacts.find_artifact(model_path, is_half) == path
+
+    cpt, net_g = model_artifacts.load_artifact(path)
+    expected_cpt, expected = _reference(model_path, is_half)
+    assert cpt["config"] == expected_cpt["config"]
+    assert (cpt["f0"], cpt["version"]) == (1, "v1")
+    assert cpt["sha256"] == model_artifacts.file_sha256(model_path)
+
+    state, expected_state = net_g.state_dict(), expected.state_dict()
+    assert state.keys() == expected_state.keys()
+    assert not any(k.startswith("enc_q.") for k in state)
+    dtype = torch.float16 if is_half else torch.float32
+    for key, value in state.items():
+        assert not value.is_meta, key
+        if value.is_floating_point():
+            assert value.dtype == dtype, key
+        torch.testing.assert_close(value, expected_state[key], rtol=0, atol=0)
+
+
+def test_prepare_keeps_a_current_artifact(model_path):
+    path = model_artifacts.prepare(model_path, False)
+    mtime = os.stat(path).st_mtime_ns
+    assert model_artifacts.prepare(model_path, False) == path
+    assert os.stat(path).st_mtime_ns == mtime
+    # the dtypes have separate artifacts
+    assert model_artifacts.find_artifact(model_path, True) is None
+
+
+def test_stale_artifact_is_ignored(model_path):
+    model_artifacts.prepare(model_path, False)
+    st = os.stat(model_path)
+    os.utime(model_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert model_artifacts.find_artifact(model_path, False) is None
+
+    # prepared again for the new checkpoint
+    path = model_artifacts.prepare(model_path, False)
+    assert model_artifacts.find_artifact(model_path, False) == path
+    # a different size with the same mtime
+    st = os.stat(model_path)
+    with open(model_path, "ab") as f:
+        f.write(b"\0")
+    os.utime(model_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert model_artifacts.find_artifact(model_path, False) is None
+
+
+def test_artifact_of_another_format_is_ignored(model_path, monkeypatch):
+    path = model_artifacts.prepare(model_path, False)
+    assert json.loads(model_artifacts.read_metadata(path)["config"])
+    monkeypatch.setattr(model_artifacts, "FORMAT", "rvc-infer-2")
+    assert model_artifacts.find_artifact(model_path, False) is None
+
+
+def test_unreadable_artifact_is_ignored(model_path):
+    with open(model_artifacts.artifact_path(model_path, False), "wb") as f:
+        f.write(b"not a safetensors file")
+    assert model_artifacts.find_artifact(model_path, False) is None
+
+
+def test_checkpoint_without_weights_is_rejected(tmp_path):
+    path = str(tmp_path / "broken.pth")
+    torch.save({"config": synthetic.synthesizer_cpt("32k")["config"]}, path)
+    with pytest.raises(ValueError, match="Incorrect format"):
+        model_artifacts.prepare(path, False)
@@ -0,0 +1,172 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import model_fetcher
+
+
+def _zip(pth):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("voice/voice.pth", pth)
+        zf.writestr("voice/added_voice.index", b"index")
+        zf.writestr("__MACOSX/voice/._voice.pth", b"junk")
+    return buf.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves ``server.body`` with its ETag, honouring ``Range`` and
+    ``If-Range`` and answering 416 to ranges that start past the end."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _etag(self):
+        return '"%s"' % hashlib.sha256(self.server.body).hexdigest()[:16]
+
+    def do_HEAD(self):
+        self._respond(head=True)
+
+    def do_GET(self):
+        self._respond()
+
+    def _respond(self, head=False):
+        body, etag = self.server.body, self._etag()
+        self.server.requests.append((self.command, self.headers.get("Range")))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        ranged = "Range" in self.headers and self.headers.get("If-Range") in (
+            None,
+            etag,
+        )
+        start = int(self.headers["Range"].split("=")[1].split("-")[0]) if ranged else 0
+        if start >= len(body):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(body)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = body[start:]
+        self.send_response(206 if ranged else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data)))
+        if ranged:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.body = _zip(b"weights-1")
+    httpd.requests = []
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}/voice.zip"
+    yield httpd
+    httpd.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def models_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_fetcher, "rvc_models_dir", str(tmp_path))
+    return tmp_path
+
+
+def _archive(models_dir, url):
+    downloads = models_dir / ".downloads"
+    downloads.mkdir(exist_ok=True)
+    return str(downloads / hashlib.sha256(url.encode("utf-8")).hexdigest()[:32])
+
+
+def _read(models_dir, name="voice.pth"):
+    return (models_dir / "voice" / name).read_bytes()
+
+
+def test_fetch_extracts_the_model_once(server, models_dir):
+    assert model_fetcher.fetch_model(server.url, "voice") == "downloaded"
+    assert sorted(os.listdir(models_dir / "voice")) == [
+        ".source.json",
+        "added_voice.index",
+        "voice.pth",
+    ]
+    assert _read(models_dir) == b"weights-1"
+    assert model_fetcher.fetch_model(server.url, "voice") == "cached"
+    assert model_fetcher.fetch_model(server.url, "voice", True) == "revalidated"
+    assert [r for r in server.requests if r[0] == "GET"] == [("GET", None)]
+    # no temporary folders or archives are left behind
+    assert sorted(os.listdir(models_dir)) == [".downloads", "voice"]
+    assert [
+        f for f in os.listdir(models_dir / ".downloads") if not f.endswith(".lock")
+    ] == []
+
+
+def test_a_changed_model_replaces_the_folder(server, models_dir):
+    model_fetcher.fetch_model(server.url, "voice")
+    server.body = _zip(b"weights-2")
+    assert model_fetcher.fetch_model(server.url, "voice", True) == "downloaded"
+    assert _read(models_dir) == b"weights-2"
+    assert sorted(os.listdir(models_dir)) == [".downloads", "voice"]
+
+
+def test_a_complete_part_is_used(server, models_dir):
+    # interrupted between the last chunk and the rename
+    archive = _archive(models_dir, server.url)
+    with open(archive + ".part", "wb") as f:
+        f.write(server.body)
+    etag = '"%s"' % hashlib.sha256(server.body).hexdigest()[:16]
+    with open(archive + ".part.json", "w") as f:
+        json.dump({"url": server.url, "etag": etag}, f)
+    assert model_fetcher.fetch_model(server.url, "voice") == "downloaded"
+    assert _read(models_dir) == b"weights-1"
+    assert server.requests == [("GET", f"bytes={len(server.body)}-")]
+    source = json.loads((models_dir / "voice" / ".source.json").read_text())
+    assert source["etag"] == etag
+    assert not os.path.exists(archive + ".part")
+
+
+def test_a_part_longer_than_the_remote_file_is_downloaded_again(server, models_dir):
+    archive = _archive(models_dir, server.url)
+    with open(archive + ".part", "wb") as f:
+        f.write(server.body + b"stale")
+    with open(archive + ".part.json", "w") as f:
+        json.dump({"url": server.url}, f)
+    assert model_fetcher.fetch_model(server.url, "voice") == "downloaded"
+    assert _read(models_dir) == b"weights-1"
+    assert server.requests == [("GET", f"bytes={len(server.body) + 5}-"), ("GET", None)]
+
+
+def test_a_partial_download_resumes(server, models_dir):
+    archive = _archive(models_dir, server.url)
+    with open(archive + ".part", "wb") as f:
+        f.write(server.body[:100])
+    with open(archive + ".part.json", "w") as f:
+        json.dump({"url": server.url}, f)
+    assert model_fetcher.fetch_model(server.url, "voice") == "downloaded"
+    assert _read(models_dir) == b"weights-1"
+    assert server.requests == [("GET", "bytes=100-")]
+
+
+def test_replace_folder_swaps_in_place(models_dir):
+    for name, content in (("voice", b"old"), (".tmp-new", b"new")):
+        (models_dir / name).mkdir()
+        (models_dir / name / "voice.pth").write_bytes(content)
+    model_fetcher._replace_folder(
+        str(models_dir / ".tmp-new"), str(models_dir / "voice")
+    )
+    assert _read(models_dir) == b"new"
+    assert os.listdir(models_dir) == ["voice"]
@@ -0,0 +1,19 @@
+import pytest
+import torch
+
+from infer_pack.models import SineGen
+
+
+@pytest.mark.parametrize("sr, upp", [(32000, 320), (40000, 400), (48000, 480)])
+def test_sinegen_infer_matches_forward(sr, upp, monkeypatch):
+    # the noise held fixed (at zero); the phase of the fundamental starts at 0
+    monkeypatch.setattr(torch, "randn_like", lambda x, **kw: torch.zeros_like(x))
+    gen = SineGen(sr, harmonic_num=0, sine_amp=0.1, noise_std=0.003)
+    # a 10 s glide with an unvoiced gap
+    f0 = torch.exp(torch.linspace(4.5, 6.5, 1000))[None]
+    f0[:, 250:330] = 0
+    expected, uv, _ = gen.forward(f0, upp)
+    sine, uv_frames = gen.infer(f0, upp)
+    assert sine.shape == expected.shape
+    torch.testing.assert_close(sine, expected, rtol=0, atol=5e-6)
+    torch.testing.assert_close(uv_frames.repeat_interleave(upp, dim=1), uv)
@@ -0,0 +1,72 @@
+import json
+import sys
+
+import profiling
+
+BEFORE = {
+    "traceEvents": [
+        {"ph": "M", "name": "process_name", "pid": 1, "args": {"name": "python"}},
+        {"ph": "X", "cat": "cpu_op", "name": "aten::conv1d", "ts": 0, "dur": 400},
+        {"ph": "X", "cat": "cpu_op", "name": "aten::conv1d", "ts": 500, "dur": 600},
+        {"ph": "X", "cat": "cpu_op", "name": "aten::add", "ts": 1200, "dur": 50},
+        {"ph": "X", "cat": "user_annotation", "name": "f0", "ts": 0, "dur": 2000},
+        {"ph": "i", "cat": "cpu_op", "name": "aten::conv1d", "ts": 900},
+        {"ph": "X", "cat": "cpu_op", "name": "aten::empty", "ts": 1300},
+    ]
+}
+# a bare event list, as some exporters write
+AFTER = [
+    {"ph": "X", "cat": "cpu_op", "name": "aten::conv1d", "ts": 0, "dur": 300},
+    {"ph": "X", "cat": "cpu_op", "name": "aten::add", "ts": 400, "dur": 60},
+    {"ph": "X", "cat": "user_annotation", "name": "f0", "ts": 0, "dur": 900},
+    {"ph": "X", "cat": "cuda_runtime", "name": "cudaLaunchKernel", "dur": 200},
+]
+
+
+def _write(tmp_path):
+    profile_dir = tmp_path / "before"
+    profile_dir.mkdir()
+    (profile_dir / "trace.json").write_text(json.dumps(BEFORE))
+    after = tmp_path / "after.json"
+    after.write_text(json.dumps(AFTER))
+    return str(profile_dir), str(after)
+
+
+def test_load_trace(tmp_path):
+    before, after = _write(tmp_path)
+    assert profiling.load_trace(before) == {
+        ("cpu_op", "aten::conv1d"): (1000.0, 2),
+        ("cpu_op", "aten::add"): (50.0, 1),
+        ("cpu_op", "aten::empty"): (0.0, 1),
+        ("user_annotation", "f0"): (2000.0, 1),
+    }
+    assert profiling.load_trace(after)[("cuda_runtime", "cudaLaunchKernel")] == (
+        200.0,
+        1,
+    )
+
+
+def test_diff(tmp_path):
+    before, after = _write(tmp_path)
+    assert profiling.diff(before, after) == [
+        ("user_annotation", "f0", 2000.0, 900.0, 1, 1),
+        ("cpu_op", "aten::conv1d", 1000.0, 300.0, 2, 1),
+        ("cuda_runtime", "cudaLaunchKernel", 0.0, 200.0, 0, 1),
+        ("cpu_op", "aten::add", 50.0, 60.0, 1, 1),
+        ("cpu_op", "aten::empty", 0.0, 0.0, 1, 0),
+    ]
+    assert [r[1] for r in profiling.diff(before, after, top=2)] == [
+        "f0",
+        "aten::conv1d",
+    ]
+
+
+def test_main(tmp_path, monkeypatch, capsys):
+    before, after = _write(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["profiling", before, after, "--top", "3"])
+    profiling.main()
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 4
+    assert lines[1].split() == ["2.00", "0.90", "-55%", "1", "[user_annotation]", "f0"]
+    assert lines[2].split()[2:4] == ["-70%", "2->1"]
+    assert lines[3].split()[2] == "new"
@@ -0,0 +1,147 @@
+import fcntl
+import os
+import threading
+import time
+
+import result_cache
+from result_cache import ResultCache
+
+
+def test_put_get_without_audio(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get("ab" * 32) is None
+    cache.put("ab" * 32, {"output_url": "https://example/x.wav", "format": "wav"})
+    assert cache.get("ab" * 32) == {
+        "output_url": "https://example/x.wav",
+        "format": "wav",
+    }
+    assert cache.stats == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_single_flight_prunes_thread_locks(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for i in range(50):
+        with cache.single_flight(f"{i:064x}"):
+            pass
+    assert cache._locks == {}
+
+
+def test_eviction_skips_locked_entries(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    old, new = "aa" * 32, "bb" * 32
+    cache.put(old, {"output_url": "old"})
+    cache.max_bytes = 0
+    with cache.single_flight(old):
+        # evicts everything over the 0 byte budget, except the locked entry
+        cache.put(new, {"output_url": "new"})
+        assert cache.get(old) == {"output_url": "old"}
+        assert os.path.exists(cache._lock_path(old))
+    assert cache.get(new) is None
+    cache.evict()
+    assert cache.get(old) is None
+    assert not os.path.exists(cache._lock_path(old))
+
+
+def test_waiter_relocks_a_lock_file_removed_by_eviction(tmp_path):
+    key = "cc" * 32
+    first, second = ResultCache(str(tmp_path)), ResultCache(str(tmp_path))
+    os.makedirs(os.path.dirname(first._lock_path(key)))
+    # an eviction holding the key's lock file, which it is about to remove
+    evicting = open(first._lock_path(key), "a")
+    fcntl.flock(evicting, fcntl.LOCK_EX)
+    inside = []
+
+    def job(cache, name, hold):
+        with cache.single_flight(key):
+            inside.append(name)
+            time.sleep(hold)
+            inside.append(name)
+
+    waiter = threading.Thread(target=job, args=(first, "waiter", 0))
+    waiter.start()
+    time.sleep(0.2)
+    os.remove(first._lock_path(key))
+    holder = threading.Thread(target=job, args=(second, "holder", 0.5))
+    holder.start()
+    time.sleep(0.1)
+    fcntl.flock(evicting, fcntl.LOCK_UN)
+    evicting.close()
+    waiter.join()
+    holder.join()
+    # the waiter did not run while the holder had the new lock file
+    assert inside == ["holder", "holder", "waiter", "waiter"]
+
+
+def _params(**changes):
+    params = {
+        "pitch_change": 0,
+        "f0_method": "rmvpe",
+        "index_rate": 0.5,
+        "filter_radius": 3,
+        "rms_mix_rate": 0.25,
+        "protect": 0.33,
+        "skip_silence": False,
+        "output_format": "wav",
+        "upload_filename": "neda/voice.wav",
+    }
+    params.update(changes)
+    return params
+
+
+def test_request_key_covers_the_upload_filename(tmp_path):
+    model_dir = tmp_path / "voice"
+    model_dir.mkdir()
+    (model_dir / "voice.pth").write_bytes(b"weights")
+    key = result_cache.request_key(None, str(model_dir), _params(), "ab" * 32)
+    assert key == result_cache.request_key(
+        None, str(model_dir), _params(index_rate=0.5000000001), "ab" * 32
+    )
+    other = _params(upload_filename="neda/other.wav")
+    assert key != result_cache.request_key(None, str(model_dir), other, "ab" * 32)
+
+
+def test_file_digests_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "_digests", result_cache.OrderedDict())
+    monkeypatch.setattr(result_cache, "MAX_DIGESTS", 4)
+    paths = []
+    for i in range(6):
+        paths.append(tmp_path / f"{i}.wav")
+        paths[-1].write_bytes(bytes([i]))
+        result_cache.file_sha256(str(paths[-1]))
+    assert len(result_cache._digests) == 4
+    # the most recent files are kept
+    assert [k[0] for k in result_cache._digests] == [str(p) for p in paths[2:]]
+
+
+def test_eviction_bounds_entries_without_walking(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_entries=3)
+    walks = []
+    walk = os.walk
+    monkeypatch.setattr(
+        result_cache.os, "walk", lambda *a, **kw: walks.append(a) or walk(*a, **kw)
+    )
+    keys = [f"{i:02x}" * 32 for i in range(6)]
+    for i, key in enumerate(keys):
+        cache.put(key, {"output_url": key})
+        if i == 2:
+            # a hit moves the oldest entry to the end
+            assert cache.get(keys[0]) is not None
+    # one walk builds the index, the puts after it keep it up to date
+    assert len(walks) == 1
+    assert cache.stats["evictions"] == 3
+    assert [k for k in keys if cache.get(k) is not None] == keys[3:]
+    assert sum(len(os.listdir(d)) for d in (tmp_path / "entries").iterdir()) == 3
+
+
+def test_rescan_sees_entries_of_other_processes(tmp_path, monkeypatch):
+    first, other = ResultCache(str(tmp_path), max_entries=2), ResultCache(str(tmp_path))
+    first.put("aa" * 32, {"output_url": "a"})
+    other.put("bb" * 32, {"output_url": "b"})
+    other.put("cc" * 32, {"output_url": "c"})
+    # three entries on disk, but this process only knows of its own
+    first.evict()
+    assert first.stats["evictions"] == 0
+    monkeypatch.setattr(result_cache, "RESCAN_SECONDS", 0)
+    first.evict()
+    assert first.stats["evictions"] == 1
+    assert first.get("aa" * 32) is None
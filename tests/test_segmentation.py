@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+from scipy import signal
+
+from benchmarks.segmentation import reference_split_points, speech_like
+from benchmarks.synthetic import speech
+from segmentation import find_split_points, silent_spans, stitch_segments
+from vc_infer_pipeline import ah, bh
+
+SR, WINDOW = 16000, 160
+
+
+def _filtered(audio):
+    # what VC.pipeline passes to the split-point search
+    return signal.filtfilt(bh, ah, audio)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("x_center, x_query", [(38, 6), (30, 5), (60, 10)])
+def test_split_points_match_loop_on_filtered_speech(seed, x_center, x_query):
+    audio = _filtered(speech_like(5 * 60 + seed * 7.3, SR, seed))
+    t_center, t_query = SR * x_center, SR * x_query
+    assert find_split_points(audio, WINDOW, t_center, t_query) == [
+        int(t) for t in reference_split_points(audio, WINDOW, t_center, t_query)
+    ]
+
+
+@pytest.mark.parametrize("seconds", [3.5, 41, 77, 123.4])
+def test_split_points_match_loop_near_the_end(seconds):
+    # lengths whose last query window is cut short by the end of the input
+    audio = _filtered(speech(seconds, SR, seed=1).astype(np.float64))
+    t_center, t_query = SR * 38, SR * 6
+    assert find_split_points(audio, WINDOW, t_center, t_query) == [
+        int(t) for t in reference_split_points(audio, WINDOW, t_center, t_query)
+    ]
+
+
+def test_split_points_keep_float32():
+    audio = speech_like(100, SR).astype(np.float32)
+    t_center, t_query = SR * 30, SR * 5
+    assert find_split_points(audio, WINDOW, t_center, t_query) == [
+        int(t) for t in reference_split_points(audio, WINDOW, t_center, t_query)
+    ]
+
+
+def _segments(lengths, pad, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.standard_normal(n + 2 * pad).astype(np.float32) for n in lengths]
+
+
+@pytest.mark.parametrize("overlap", [0, 40, 80, 200])
+def test_stitch_keeps_the_output_length(overlap):
+    pad = 100
+    segments = _segments([1000, 800, 500], pad)
+    out = stitch_segments(segments, pad, overlap)
+    assert out.shape == (2300,)
+    assert out.dtype == np.float32
+
+
+def test_stitch_last_segment_shorter_than_the_crossfade():
+    # the final cut close to the end: 45 samples left after the seam
+    pad, overlap = 100, 80
+    segments = _segments([1000, 5], pad)
+    segments[1] = segments[1][: 5 + 2 * pad]
+    out = stitch_segments(segments, pad, overlap)
+    assert out.shape == (1005,)
+    hard = stitch_segments(segments, pad, 0)
+    # untouched before the crossfade
+    np.testing.assert_array_equal(out[: 1000 - overlap // 2], hard[: 1000 - 40])
+
+
+def test_stitch_crossfade_of_a_continuous_signal_is_seamless():
+    # segments cut from one signal with their context: the ramps sum to 1
+    pad, overlap = 100, 80
+    signal_ = np.random.default_rng(1).standard_normal(3000)
+    padded = np.pad(signal_, pad)
+    cuts = [0, 1200, 2500, 3000]
+    segments = [padded[a : b + 2 * pad] for a, b in zip(cuts, cuts[1:])]
+    np.testing.assert_allclose(stitch_segments(segments, pad, overlap), signal_)
+
+
+def _tone(seconds, amplitude=0.5):
+    t = np.arange(int(seconds * SR)) / SR
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+@pytest.mark.parametrize("amplitude, silent", [(0.0031, True), (0.0032, False)])
+def test_silent_spans_threshold(amplitude, silent):
+    # -50 dBFS is an RMS of 0.00316, that of a +-amplitude square wave
+    audio = amplitude * np.resize(np.float32([1, -1]), 2 * SR)
+    assert silent_spans(audio, WINDOW) == ([(0, len(audio))] if silent else [])
+
+
+@pytest.mark.parametrize("silence, kept", [(0.9, True), (0.89, False)])
+def test_silent_spans_minimum_length(silence, kept):
+    # 0.15 s margins on both sides leave 0.6 s of a 0.9 s gap
+    audio = np.concatenate(
+        [_tone(1), np.zeros(int(silence * SR), np.float32), _tone(1)]
+    )
+    spans = silent_spans(audio, WINDOW)
+    assert spans == ([(SR + 2400, SR + int(silence * SR) - 2400)] if kept else [])
+
+
+def test_silent_spans_keep_no_margin_at_the_ends():
+    audio = np.concatenate(
+        [np.zeros(SR, np.float32), _tone(1), np.zeros(SR + 50, np.float32)]
+    )
+    # the partial frame at the end is part of the trailing silence
+    assert silent_spans(audio, WINDOW) == [(0, SR - 2400), (2 * SR + 2400, len(audio))]
+
+
+def test_voice_conversion_reports_the_skipped_ratio(tmp_path):
+    import main
+    from benchmarks import concurrency
+
+    registry = concurrency.synthetic_registry(["40k"])
+    audio = np.concatenate([speech(2, SR, seed=2), np.zeros(2 * SR, np.float32)])
+    stats = {}
+    main.voice_conversion(
+        "input.wav",
+        "40k",
+        f0_method="pm",
+        skip_silence=True,
+        audio=audio.astype(np.float32),
+        output_path=str(tmp_path / "output.wav"),
+        registry=registry,
+        stats=stats,
+    )
+    # the silent half, without the margin next to the speech
+    assert stats["skipped_ratio"] == pytest.approx((2 - 0.15) / 4, abs=0.05)
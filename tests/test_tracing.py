@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import tracing
+
+
+class _Collector(BaseHTTPRequestHandler):
+    """A stand-in for an OpenTelemetry collector's OTLP/HTTP receiver."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append((self.path, self.headers["Content-Type"], body))
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def collector():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Collector)
+    httpd.received = []
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+
+
+@pytest.fixture
+def endpoint(collector, monkeypatch):
+    url = f"http://127.0.0.1:{collector.server_port}"
+    monkeypatch.setattr(tracing, "ENABLED", True)
+    monkeypatch.setattr(tracing, "OTLP_ENDPOINT", url)
+    monkeypatch.setattr(tracing, "_exporter", None)
+    monkeypatch.setattr(tracing, "_exporter_pid", None)
+    return url
+
+
+def _spans(collector):
+    spans = []
+    for path, content_type, body in collector.received:
+        assert path == "/v1/traces"
+        assert content_type == "application/json"
+        (resource,) = json.loads(body)["resourceSpans"]
+        assert resource["resource"]["attributes"] == [
+            {"key": "service.name", "value": {"stringValue": tracing.SERVICE_NAME}}
+        ]
+        for scope in resource["scopeSpans"]:
+            spans.extend(scope["spans"])
+    return {s["name"]: s for s in spans}
+
+
+def test_spans_reach_the_collector(collector, endpoint, monkeypatch):
+    monkeypatch.setattr(
+        tracing, "_exporter", tracing.OTLPExporter(endpoint, interval=0.05)
+    )
+    monkeypatch.setattr(tracing, "_exporter_pid", os.getpid())
+    with tracing.span("request", job_id="job-1"):
+        tracing.set_trace_attributes(audio_seconds=2.5, device="cpu")
+        with tracing.span("f0", method="rmvpe"):
+            tracing.count("segments", 2)
+        with pytest.raises(ValueError):
+            with tracing.span("encode", format="mp3"):
+                raise ValueError("no encoder")
+    assert tracing.exporter().flush()
+
+    spans = _spans(collector)
+    assert set(spans) == {"request", "f0", "encode"}
+    request, f0, encode = spans["request"], spans["f0"], spans["encode"]
+    assert request["parentSpanId"] == ""
+    for child in (f0, encode):
+        assert child["traceId"] == request["traceId"]
+        assert child["parentSpanId"] == request["spanId"]
+    assert len(request["traceId"]) == 32 and len(request["spanId"]) == 16
+
+    def attributes(s):
+        return {a["key"]: a["value"] for a in s["attributes"]}
+
+    assert attributes(f0) == {
+        "audio_seconds": {"doubleValue": 2.5},
+        "device": {"stringValue": "cpu"},
+        "segments": {"intValue": "2"},
+        "method": {"stringValue": "rmvpe"},
+    }
+    # trace attributes set during the request reach the root span too
+    assert attributes(request)["job_id"] == {"stringValue": "job-1"}
+    assert attributes(request)["audio_seconds"] == {"doubleValue": 2.5}
+    assert f0["status"] == {"code": 1}
+    assert encode["status"] == {"code": 2, "message": "ValueError: no encoder"}
+    assert int(f0["startTimeUnixNano"]) <= int(f0["endTimeUnixNano"])
+
+
+def test_one_exporter_per_process(endpoint):
+    barrier = threading.Barrier(8)
+    exporters = []
+
+    def get():
+        barrier.wait()
+        exporters.append(tracing.exporter())
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(e) for e in exporters}) == 1
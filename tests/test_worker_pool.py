@@ -0,0 +1,147 @@
+import os
+import time
+
+import torch.multiprocessing as mp
+
+import worker_pool
+
+
+def _worker_plan(_):
+    time.sleep(0.05)
+    return os.getpid(), worker_pool._plan
+
+
+def test_every_worker_gets_its_own_plan():
+    ctx = mp.get_context("fork")
+    n = 16
+    plans = [
+        {"cpus": None, "intra_op": 1, "inter_op": 1, "worker": i} for i in range(n)
+    ]
+    with ctx.Pool(
+        n,
+        initializer=worker_pool._init_worker,
+        initargs=(None, plans, ctx.Value("i", 0)),
+    ) as pool:
+        seen = dict(pool.map(_worker_plan, range(4 * n), chunksize=1))
+    # no worker fell back to the unpinned default, and no plan was handed out twice
+    assert all("worker" in plan for plan in seen.values())
+    workers = [plan["worker"] for plan in seen.values()]
+    assert len(set(workers)) == len(workers)
+
+
+def test_replacement_workers_keep_the_inherited_affinity():
+    ctx = mp.get_context("fork")
+    started = ctx.Value("i", 1)
+    plans = [{"cpus": None, "intra_op": 1, "inter_op": 1, "worker": 0}]
+    with ctx.Pool(
+        1, initializer=worker_pool._init_worker, initargs=(None, plans, started)
+    ) as pool:
+        ((_, plan),) = pool.map(_worker_plan, [0])
+    assert "worker" not in plan and plan["cpus"] is None
+
+
+def test_cuda_workers_are_spawned():
+    # forked workers cannot use CUDA once the parent initialized it
+    for device, method in [("cpu", "fork"), ("cuda:0", "spawn")]:
+        registry = worker_pool.ModelRegistry(device, False)
+        assert worker_pool.WorkerPool(registry, 1, 1).method == method
+
+
+def test_registry_reloads_a_model_replaced_on_disk(tmp_path, monkeypatch):
+    model_dir = tmp_path / "voice"
+    model_dir.mkdir()
+    (model_dir / "voice.pth").write_bytes(b"old")
+    loads = []
+
+    def get_vc(device, is_half, config, model_path, concurrency=None):
+        with open(model_path, "rb") as f:
+            loads.append(f.read())
+        return (None, "v2", loads[-1], 40000, None)
+
+    monkeypatch.setattr(worker_pool, "rvc_models_dir", str(tmp_path))
+    monkeypatch.setattr(
+        worker_pool, "get_rvc_model", lambda name: str(tmp_path / name / "voice.pth")
+    )
+    monkeypatch.setattr(worker_pool, "get_vc", get_vc)
+    registry = worker_pool.ModelRegistry("cpu", False)
+    registry._hubert = object()
+
+    assert registry.get("voice")[2] == b"old"
+    assert registry.get("voice")[2] == b"old"
+    # replaced as fetch_model does: a new file under the same name
+    (tmp_path / "new.pth").write_bytes(b"new")
+    os.replace(tmp_path / "new.pth", model_dir / "voice.pth")
+    assert registry.get("voice")[2] == b"new"
+    assert loads == [b"old", b"new"]
+    assert registry.stats == {"hits": 1, "misses": 2, "evictions": 1}
+
+
+def test_pool_sizes_segments_for_its_workers(tmp_path, monkeypatch):
+    tuned = []
+
+    def tune(config, version, tgt_sr, concurrency=None):
+        tuned.append((version, concurrency))
+        return config
+
+    def get_vc(device, is_half, config, model_path, concurrency=None):
+        tuned.append((model_path, concurrency))
+        return (None, "v2", model_path, 40000, None)
+
+    monkeypatch.setattr(worker_pool.autotune, "tune", tune)
+    monkeypatch.setattr(worker_pool, "get_vc", get_vc)
+    monkeypatch.setattr(worker_pool, "rvc_models_dir", str(tmp_path))
+    monkeypatch.setattr(worker_pool, "get_rvc_model", lambda name: name + ".pth")
+    registry = worker_pool.ModelRegistry("cpu", False)
+    registry._hubert = object()
+    registry.get("preloaded")
+
+    pool = worker_pool.WorkerPool(registry, 3, 1, pin=False)
+    assert pool.processes == registry.concurrency == 3
+    # the preloaded model is tuned again, models loaded later get the count
+    registry.get("later")
+    assert tuned == [
+        ("preloaded.pth", None),
+        ("v2", 3),
+        ("later.pth", 3),
+    ]
+    assert isinstance(registry.get("preloaded")[4], worker_pool.VC)
+
+
+def test_batch_workers_share_the_models_of_the_parent(tmp_path, monkeypatch):
+    import json
+
+    import torch
+
+    import main
+
+    def get_vc(device, is_half, config, model_path, concurrency=None):
+        # workers are other processes, they report through a file
+        with open(tmp_path / "loads", "a") as f:
+            f.write(f"{os.getpid()} {model_path}\n")
+        return (None, "v2", torch.nn.Linear(1, 1), 40000, None)
+
+    def rvc_infer(index_path, index_rate, input_path, output_path, *args, **kw):
+        with open(output_path, "w") as f:
+            f.write(input_path)
+        return {}
+
+    monkeypatch.setattr(worker_pool, "get_vc", get_vc)
+    monkeypatch.setattr(worker_pool, "rvc_infer", rvc_infer)
+    monkeypatch.setattr(worker_pool, "load_hubert", lambda *a: torch.nn.Linear(1, 1))
+    monkeypatch.setattr(worker_pool, "rvc_models_dir", str(tmp_path))
+    monkeypatch.setattr(worker_pool, "get_rvc_model", lambda name: name + ".pth")
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text(
+        "".join(
+            json.dumps({"input_audio": f"{i}.wav", "rvc_model": f"voice{i % 3}"}) + "\n"
+            for i in range(12)
+        )
+    )
+    main.run_batch(str(manifest), output_dir=str(tmp_path / "out"), workers=2)
+
+    # each model loaded once, by the parent
+    loads = (tmp_path / "loads").read_text().splitlines()
+    assert sorted(loads) == [f"{os.getpid()} voice{i}.pth" for i in range(3)]
+    with open(tmp_path / "jobs.results.jsonl") as f:
+        results = [json.loads(line) for line in f]
+    assert [r["status"] for r in results] == ["done"] * 12